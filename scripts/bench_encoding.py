@@ -0,0 +1,51 @@
+"""A small benchmark of API list payload encodings: plain JSON (flask-restx default)
+versus column-oriented JSON (Accept: application/x-scitq-columns+json), each with
+or without gzip, on a synthetic task listing (100k tasks by default)
+
+usage: python bench_encoding.py [number_of_tasks] [gzip_level]
+(gzip level defaults to 5, the server COMPRESS_LEVEL)
+"""
+import sys
+import time
+import gzip
+import json
+from datetime import datetime
+from scitq.util import to_columns, from_columns
+
+def fake_tasks(n):
+    now = datetime.utcnow().isoformat()
+    return [{'task_id': i, 'name': f'sample{i}', 'status': 'succeeded',
+             'command': f'sh -c "bowtie2 -p 4 --no-unal -x /resource/ref -1 /input/sample{i}.1.fastq.gz -2 /input/sample{i}.2.fastq.gz | samtools view -b -o /output/sample{i}.bam"',
+             'creation_date': now, 'modification_date': now, 'status_date': now,
+             'batch': 'align', 'input': f's3://bucket/reads/sample{i}/',
+             'output': f's3://bucket/results/align/sample{i}/', 'container': 'gmtscience/bowtie2:2.5.1',
+             'container_options': None, 'resource': 's3://bucket/resource/ref.tgz|untar',
+             'required_task_ids': [], 'retry': 2, 'download_timeout': None, 'run_timeout': None,
+             'use_cache': False} for i in range(n)]
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter()-start
+
+def bench(name, data, encode, decode, level):
+    payload, encode_time = timed(encode, data)
+    zipped, zip_time = timed(gzip.compress, payload, compresslevel=level)
+    _, unzip_time = timed(gzip.decompress, zipped)
+    decoded, decode_time = timed(decode, payload)
+    assert decoded == data
+    print(f'{name:<10} encode {encode_time*1000:8.1f}ms  decode {decode_time*1000:8.1f}ms  '
+          f'size {len(payload)/1024**2:7.2f}MiB  gzip {len(zipped)/1024**2:6.2f}MiB '
+          f'(+{zip_time*1000:.1f}ms/{unzip_time*1000:.1f}ms)')
+
+if __name__=='__main__':
+    n = int(sys.argv[1]) if len(sys.argv)>1 else 100000
+    level = int(sys.argv[2]) if len(sys.argv)>2 else 5
+    tasks = fake_tasks(n)
+    print(f'{n} tasks, gzip level {level}')
+    bench('json', tasks,
+          lambda d: json.dumps(d).encode('utf-8'),
+          lambda p: json.loads(p), level)
+    bench('columns', tasks,
+          lambda d: json.dumps(to_columns(d), separators=(',',':')).encode('utf-8'),
+          lambda p: from_columns(json.loads(p)), level)
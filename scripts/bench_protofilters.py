@@ -0,0 +1,76 @@
+"""A small benchmark of recruiter protofilter matching (as done for worker recycling):
+the former per worker eval of the protofilter string versus compiled predicates
+(scitq.server.model.compile_protofilters), on synthetic flavors and workers
+
+usage: python bench_protofilters.py [number_of_workers] [protofilters]
+(protofilters defaults to 'cpu>=8:ram>=30:tags!#G:region~GRA%:eviction<=5:cost<1')
+"""
+import sys
+import time
+import random
+from scitq.server.model import compile_protofilters, FLAVOR_FIELDS
+from scitq.constants import PROTOFILTER_SEPARATOR
+from scitq.util import protofilter_syntax, is_like, has_tag
+
+def fake_flavors(n=500, regions=('GRA7','GRA9','SBG5','BHS5','WAW1','UK1')):
+    flavors = []
+    for i in range(n):
+        cpu = random.choice([2,4,8,16,32,64])
+        for region in regions:
+            flavors.append(dict(zip(FLAVOR_FIELDS,
+                [f'flavor{i}', 'ovh', region, cpu, cpu*random.choice([2,4,8])-1.0,
+                 random.choice(['','S','G','M','GS']), None, None, cpu*25.0,
+                 cpu*random.uniform(0.005,0.05), random.choice([None,0,5,10])])))
+    return flavors
+
+def legacy_match(protofilters, flavor):
+    """The former Recruiter.match_flavor evaluation, one eval per protofilter"""
+    env = dict(flavor)
+    result = True
+    for protofilter in protofilters.split(PROTOFILTER_SEPARATOR):
+        protofilter_match = protofilter_syntax.match(protofilter)
+        if protofilter_match:
+            protofilter_match = protofilter_match.groupdict()
+            variable = protofilter_match['item']
+            comp = protofilter_match['comparator']
+            value = protofilter_match['value']
+            if value[0] not in '0123456789.':
+                value=repr(value)
+            if comp=='~':
+                env['is_like']=is_like
+                eval_protofilter = f"is_like({variable},{value})"
+            elif comp=='#':
+                env['has_tag']=has_tag
+                eval_protofilter = f"has_tag({variable},{value})"
+            elif comp=='!~':
+                env['is_like']=is_like
+                eval_protofilter = f"not(is_like({variable},{value}))"
+            elif comp=='!#':
+                env['has_tag']=has_tag
+                eval_protofilter = f"not(has_tag({variable},{value}))"
+            else:
+                eval_protofilter = f"{variable}{comp}{value}"
+            try:
+                result = result and eval(eval_protofilter,env)
+            except Exception:
+                return False
+    return result
+
+def compiled_match(protofilters, flavor):
+    return all(predicate(flavor) for predicate in compile_protofilters(protofilters))
+
+def bench(name, match, protofilters, workers):
+    start = time.perf_counter()
+    matches = sum(1 for flavor in workers if match(protofilters, flavor))
+    elapsed = time.perf_counter()-start
+    print(f'{name:<10} {elapsed*1000:8.1f}ms  ({elapsed/len(workers)*1e6:6.2f}us per worker, {matches} matches)')
+
+if __name__=='__main__':
+    n = int(sys.argv[1]) if len(sys.argv)>1 else 10000
+    protofilters = sys.argv[2] if len(sys.argv)>2 else 'cpu>=8:ram>=30:tags!#G:region~GRA%:eviction<=5:cost<1'
+    random.seed(0)
+    flavors = fake_flavors()
+    workers = [random.choice(flavors) for _ in range(n)]
+    print(f'{n} workers, protofilters {protofilters}')
+    bench('legacy', legacy_match, protofilters, workers)
+    bench('compiled', compiled_match, protofilters, workers)
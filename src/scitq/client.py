@@ -14,7 +14,8 @@ import psutil
 import platform
 import queue
 import tempfile
-from .fetch import get,put,pathjoin, info, FetchError, UnsupportedError, list_content
+from .fetch import get,put,pathjoin, info, FetchError, UnsupportedError, list_content, GENERIC_REGEXP, \
+    put_files, supports_put_files, put_packed, split_action, PACK_ACTION, PACK_SUFFIX, ena_prefetch_uris
 import traceback
 import shutil
 import subprocess
@@ -26,9 +27,10 @@ import json
 import datetime
 import sys
 from uuid import uuid1
-from .util import isfifo, force_hard_link, PropagatingProcess
+from .util import isfifo, force_hard_link, PropagatingProcess, docker_image_name, to_obj
 from .client_events import monitor_events
 import math
+from collections import deque
 
 CPU_MAX_VALUE =10
 POLLING_TIME = 4
@@ -48,6 +50,8 @@ RESOURCE_FILES_SUBDIR = 'files'
 RESOURCE_FILE = os.path.join(BASE_RESOURCE_DIR, 'resource.json')
 MAXIMUM_PARALLEL_UPLOAD = 5
 RETRY_UPLOAD = 5
+# files per transfer when output can be uploaded in bulk
+UPLOAD_BATCH_SIZE = 1000
 RETRY_DOWNLOAD = 2
 DEFAULT_AUTOCLEAN = 90
 RESOURCE_VERSION = 2
@@ -55,6 +59,15 @@ try:
     SCITQ_PERMANENT_WORKER = bool(int(os.environ.get("SCITQ_PERMANENT_WORKER", '1')))
 except:
     SCITQ_PERMANENT_WORKER = True
+BASE_CACHE_DIR = os.path.join(BASE_WORKDIR, 'cache')
+CACHE_FILE = os.path.join(BASE_CACHE_DIR, 'cache.json')
+# size (in Gb) of the worker local input cache, 0 means no cache
+try:
+    INPUT_CACHE_SIZE = float(os.environ.get("SCITQ_INPUT_CACHE_SIZE", '0'))
+except:
+    INPUT_CACHE_SIZE = 0
+# inputs from these protocols cannot change (they have no metadata so they are cached on URI only)
+IMMUTABLE_PROTOCOLS = ['run+fastq','run+submitted']
 
 if not os.path.exists(BASE_RESOURCE_DIR):
     os.mkdir(BASE_RESOURCE_DIR)
@@ -85,6 +98,17 @@ DOWNLOAD_TIMEOUT_SEC_PER_GB = 600
 DOWNLOAD_TIMEOUT_NO_INFO = 1800
 DOWNLOAD_LOOP_TIME = 60
 
+TELEMETRY_INTERVAL = 10
+TELEMETRY_BUFFER_SIZE = 360
+TELEMETRY_FULL_STATS_EVERY = 30
+PARTITION_REFRESH_TIME = 600
+IMAGE_REFRESH_TIME = 60
+# docker pull timeout (in seconds) when the task has no download_timeout
+DOCKER_PULL_TIMEOUT = 3600
+# how long we wait for ENA metadata prefetch before launching executions
+ENA_PREFETCH_WAIT = 5
+IGNORED_MOUNTPOINTS = ('/snap/','/boot','/System')
+
 def client_status_code(status):
     """A small wrapper to translate status string to a int code"""
     if status=='running':
@@ -125,6 +149,36 @@ def docker_inspect(container_id):
         log.exception(f'Docker ps gave an non exploitable output: {alive_container}')
         return None
 
+def docker_image_present(image):
+    """Return True if this docker image is present locally"""
+    return subprocess.run(['docker','image','inspect',image], capture_output=True).returncode==0
+
+def docker_pull(image, timeout=DOCKER_PULL_TIMEOUT):
+    """Pull a docker image if it is not present, return True if the image is present in the end"""
+    if docker_image_present(image):
+        return True
+    log.warning(f'Pulling docker image {image}')
+    try:
+        process = subprocess.run(['docker','pull',image], capture_output=True, encoding='utf-8', timeout=timeout)
+    except subprocess.TimeoutExpired:
+        log.warning(f'Could not pull docker image {image}: timeout after {timeout}s')
+        return False
+    if process.returncode!=0:
+        log.warning(f'Could not pull docker image {image}: {process.stderr}')
+        return False
+    log.warning(f'Docker image {image} pulled')
+    return True
+
+def docker_images():
+    """Return the set of docker images present locally"""
+    try:
+        images=subprocess.run(['docker','images','--format','{{.Repository}}:{{.Tag}}'],
+            capture_output=True, check=True, encoding='utf-8').stdout.split()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        log.warning('Could not list docker images')
+        return set()
+    return set([docker_image_name(image) for image in images if not image.endswith(':<none>')])
+
 def docker_logs(container_id):
     process = subprocess.run(['docker','logs',container_id],
             capture_output=True, check=True, encoding='utf-8'
@@ -190,7 +244,7 @@ def json_to_resource(resource_db,resource_file=RESOURCE_FILE):
                 else:
                     del(resource['version'])
                     for data,data_info in resource.items():
-                        resource_db[data]=dict( [(k,datetime.datetime.fromisoformat(v)) if k=='date' else (k,v) 
+                        resource_db[data]=dict( [(k,datetime.datetime.fromisoformat(v)) if k=='date' and v is not None else (k,v) 
                                              for k,v in data_info.items()] )
         except Exception as e:
             log.exception(f'Could not import resource from {resource_file}')
@@ -256,6 +310,151 @@ def _get(data, folder, data_info=None, timeout=None, execution_queue=None):
         return True
     raise DownloadTimeoutException(f'Download of {data} took longer than {timeout}, bailing out')
 
+def local_signature(path):
+    """Return total size and latest modification time of the files in a local folder"""
+    size = 0
+    mtime = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            stat = os.stat(os.path.join(root, f))
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+class InputCache:
+    """A worker local cache of input objects: an input is downloaded once in the cache
+    and then hard linked in the input dir of the tasks that use it (like resources). 
+    Objects are keyed by URI and checked against remote size/modification date/md5 when 
+    available. The cache has a disk budget, least recently used objects are evicted first.
+    
+    NB: as inputs are hard linked, a task modifying its input in place would corrupt 
+    the cache, this is detected (local size and modification date are checked) and the
+    object is then downloaded again."""
+
+    def __init__(self, manager, size, cache_dir=BASE_CACHE_DIR, cache_file=CACHE_FILE):
+        """- manager: a multiprocessing.Manager so that the cache is shared among Executors
+        - size: the disk budget in bytes"""
+        self.size = size
+        self.cache_dir = cache_dir
+        self.cache_file = cache_file
+        self.db = manager.dict()
+        self.lock = manager.Lock()
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        json_to_resource(self.db, self.cache_file)
+        for data,item in list(self.db.items()):
+            if item['status']!='loaded' or not os.path.exists(item['path']):
+                log.warning(f'{data} is not properly loaded in input cache, removing')
+                self.evict(data)
+        self.shrink()
+
+    def signature(self, data):
+        """Return the remote signature (size, date and md5) of data or None if data cannot be cached"""
+        m = GENERIC_REGEXP.match(data)
+        if not m or m['resource'].endswith('/'):
+            return None
+        proto = m['proto']
+        if proto=='file':
+            return None
+        if proto in IMMUTABLE_PROTOCOLS:
+            return {'size':None, 'date':None, 'md5':None}
+        try:
+            data_info = info(data)
+        except Exception as e:
+            log.warning(f'Input {data} will not be cached as it has no metadata: {e}')
+            return None
+        if data_info is None or data_info.size is None:
+            return None
+        return {'size':data_info.size, 'date':data_info.modification_date, 
+                'md5':getattr(data_info, 'md5', None)}
+
+    def is_valid(self, item, signature):
+        """Check that a cached item is still consistent with remote and local data"""
+        if item['status']!='loaded' or not os.path.exists(item['path']):
+            return False
+        if item['size']!=signature['size'] or item['date']!=signature['date']:
+            return False
+        if item['md5'] and signature['md5'] and item['md5']!=signature['md5']:
+            return False
+        return local_signature(item['path'])==(item['local_size'],item['local_mtime'])
+
+    def evict(self, data):
+        """Remove an object from cache (must be called with lock acquired)"""
+        path = self.db[data].get('path')
+        if path:
+            shutil.rmtree(path, ignore_errors=True)
+        del(self.db[data])
+
+    def shrink(self, keep=None):
+        """Evict least recently used objects until the cache fits its budget (must be called with lock acquired)"""
+        loaded = sorted([(item['last_used'], data, item['local_size']) for data,item in self.db.items()
+                            if item['status']=='loaded' and data!=keep])
+        total = sum([size for _,_,size in loaded]) + (self.db[keep]['local_size'] if keep else 0)
+        for _,data,size in loaded:
+            if total <= self.size:
+                break
+            log.warning(f'Evicting {data} from input cache')
+            self.evict(data)
+            total -= size
+        resource_to_json(self.db, self.cache_file)
+
+    def clear(self):
+        """Empty the cache"""
+        with self.lock:
+            for data in list(self.db.keys()):
+                if self.db[data]['status']!='lock':
+                    self.evict(data)
+            resource_to_json(self.db, self.cache_file)
+
+    def get(self, data, destination, getter):
+        """Provide data in destination folder using the cache, getter(data, folder) is called 
+        to download data if needed. Return False if data cannot be provided by the cache, in 
+        which case the caller should download it directly."""
+        signature = self.signature(data)
+        if signature is None:
+            return False
+        with self.lock:
+            item = self.db.get(data)
+            if item is not None and item['status']=='lock':
+                log.warning(f'Input {data} is being cached by another task, not waiting')
+                return False
+            if item is not None and self.is_valid(item, signature):
+                item['last_used'] = time()
+                self.db[data] = item
+                hit = True
+            else:
+                if item is not None:
+                    log.warning(f'Input {data} is obsolete in cache')
+                    self.evict(data)
+                self.db[data] = {'status':'lock'}
+                hit = False
+        if hit:
+            log.warning(f'Input {data} found in cache')
+            shutil.copytree(item['path'], destination, copy_function=force_hard_link, 
+                        dirs_exist_ok=True)
+            return True
+
+        path = os.path.join(self.cache_dir, str(uuid1()))+'/'
+        try:
+            getter(data, path)
+        except:
+            with self.lock:
+                self.evict(data)
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        shutil.copytree(path, destination, copy_function=force_hard_link, 
+                        dirs_exist_ok=True)
+        local_size, local_mtime = local_signature(path)
+        with self.lock:
+            self.db[data] = dict(signature, status='loaded', path=path, 
+                                 local_size=local_size, local_mtime=local_mtime,
+                                 last_used=time())
+            if local_size > self.size:
+                log.warning(f'Input {data} is too big for input cache')
+                self.evict(data)
+            self.shrink(keep=data if data in self.db else None)
+        return True
+
 class Executor:
     """Executor represent the process in which the task is launched, it is also
     designed to monitor the task and grab its output to push it regularly to the
@@ -267,7 +466,7 @@ class Executor:
                 cpu, resource_dir, resource, resources_db, #run_slots, #run_slots_semaphore,
                 worker_id, status, working_dirs, client_status,
                 recover=False, input_dir=None, output_dir=None, task_resource_dir=None,
-                temp_dir=None, workdir=None, container_id=None, go=None):
+                temp_dir=None, workdir=None, container_id=None, go=None, input_cache=None):
         log.warning(f'Starting executor for {execution_id}')
         self.s = Server(server, style='object')
         self.worker_id = worker_id
@@ -287,6 +486,7 @@ class Executor:
         self.cpu=cpu 
         self.resource=resource
         self.resources_db=resources_db
+        self.input_cache=input_cache
         #self.run_slots=run_slots
         #self.run_slots_semaphore=run_slots_semaphore
         self.dynamic_read_timeout = READ_TIMEOUT
@@ -596,6 +796,10 @@ class Executor:
                         dirs_exist_ok=True)
             
 
+    def get_input(self, data, folder):
+        """Download one input in folder"""
+        _get(data, folder, execution_queue=self.execution_queue, timeout=self.task.download_timeout)
+
     def download(self, input=None, resource=None):
         """Do the downloading part, before launching, getting all input URIs into input_dir"""
         if self.status != STATUS_RUNNING:
@@ -603,6 +807,14 @@ class Executor:
             self.status = STATUS_DOWNLOADING
         else:
             log.warning(f'Checking previous downloads{(" with timeout "+str(self.task.download_timeout)+"s") if self.task.download_timeout else ""}...')
+        if self.container:
+            # pulling the image now so that it does not happen while holding a run slot
+            retry=RETRY_DOWNLOAD
+            while not docker_pull(self.container, timeout=self.task.download_timeout or DOCKER_PULL_TIMEOUT):
+                retry -= 1
+                if retry<0:
+                    raise FetchError(f'Could not pull docker image {self.container}')
+                log.warning('Retrying')
         if input is None:
             input = self.input.split() if self.input else []
         if resource is None:
@@ -614,7 +826,8 @@ class Executor:
             failed_input = []
             for data in current_input:
                 try:
-                    _get(data, self.input_dir, execution_queue=self.execution_queue, timeout=self.task.download_timeout)
+                    if self.input_cache is None or not self.input_cache.get(data, self.input_dir, self.get_input):
+                        self.get_input(data, self.input_dir)
                 except Exception as e:
                     log.exception(e)
                     last_exception=e
@@ -679,35 +892,60 @@ class Executor:
         log.warning('Uploading output results...')
         if self.output:
             output_files = []
+            transferred = set()
+            output, action = split_action(self.output)
+            pack = action==PACK_ACTION
+            if action and not pack:
+                log.warning(f'Unsupported output action {action} is ignored')
             retry = RETRY_UPLOAD
             while retry>0:
                 try:
                     jobs = {}
                     transfer_failed = False
+                    bulk = supports_put_files(output)
+                    batch = []
                     with concurrent.futures.ProcessPoolExecutor(max_workers=self.maximum_parallel_upload) as executor:
-                        for root, _, files in os.walk(self.output_dir):
+                        for root, dirs, files in os.walk(self.output_dir):
                             rel_path = os.path.relpath(root, self.output_dir)
+                            if pack and root==self.output_dir:
+                                # in packed mode each subfolder is streamed as an archive
+                                for local_dir in dirs:
+                                    data = os.path.join(root, local_dir)
+                                    if data not in transferred:
+                                        jobs[executor.submit(put_packed, data, 
+                                                    pathjoin(output, local_dir+PACK_SUFFIX))]=[data]
+                                dirs.clear()
                             for local_data in files:
                                 data = os.path.join(root, local_data)
-                                if not os.path.islink(data) and not isfifo(data) and data not in output_files:
-                                    jobs[executor.submit(put, data, pathjoin(self.output,rel_path,'/'))]=data
+                                if not os.path.islink(data) and not isfifo(data) and data not in transferred:
+                                    if bulk:
+                                        batch.append(data)
+                                        if len(batch)>=UPLOAD_BATCH_SIZE:
+                                            jobs[self.submit_upload_batch(executor, batch, output)]=batch
+                                            batch = []
+                                    else:
+                                        jobs[executor.submit(put, data, pathjoin(output,rel_path,'/'))]=[data]
                                 else:
-                                    if data in output_files:
+                                    if data in transferred:
                                         log.warning(f'Passing {data} as it is already transfered')
                                     elif os.path.islink(data):
                                         log.warning(f'{local_data} is ignored as it is a symbolic link.')
                                     elif isfifo(data):
                                         log.warning(f'{local_data} is ignored as it is a FIFO (named pipe).')
+                        if batch:
+                            jobs[self.submit_upload_batch(executor, batch, output)]=batch
                         for job in concurrent.futures.as_completed(jobs):
-                            obj = jobs[job]
+                            objs = jobs[job]
+                            obj = objs[0] if len(objs)==1 else f'{len(objs)} files ({objs[0]}...)'
                             if job.exception() is not None:
                                 transfer_failed = True
                                 log.warning(f'Transfer failed for {obj}: {job.exception()}')
                                 log.exception(job.exception())
                                 latest_exception = job.exception()
                             else:
-                                log.warning(f'Transfer done for {obj}: {job.result()}')
-                                output_files.append(obj)
+                                log.warning(f'Transfer done for {obj}')
+                                output_files.extend(objs)
+                                transferred.update(objs)
                     if transfer_failed:
                         log.error(f'Upload partially failed for task {self.task_id}')
                         if self.maximum_parallel_upload>1:
@@ -732,6 +970,12 @@ class Executor:
                     if retry<=0:
                         raise
     
+    def submit_upload_batch(self, executor, batch, output):
+        """Submit the bulk upload of a list of output files (with absolute paths)"""
+        return executor.submit(put_files, self.output_dir, 
+                               [os.path.relpath(data, self.output_dir) for data in batch],
+                               output)
+
     def clean(self):
         """Clean working directory (triggered if all went well)"""
         shutil.rmtree(self.workdir)
@@ -927,8 +1171,154 @@ class Executor:
                     except queue.Empty:
                         pass
 
+class Telemetry:
+    """Sample worker telemetry in a separate thread on its own cadence, keeping the
+    numerical samples in a ring buffer. The main loop only reads the latest values and 
+    sends the human readable stats as deltas (only the fields that changed)."""
+
+    def __init__(self, interval=TELEMETRY_INTERVAL, buffer_size=TELEMETRY_BUFFER_SIZE):
+        self.interval = interval
+        self.samples = deque(maxlen=buffer_size)
+        self.lock = threading.Lock()
+        self.partitions = []
+        self.partitions_time = None
+        self.ref_disk = self.ref_network = None
+        self.previous = None
+        self.cpu_list = deque(maxlen=CPU_MAX_VALUE)
+        self.stats = {}
+        self.cpu_string = ''
+        self.memory = None
+        self.scratch_usage = None
+        self.reset()
+        self.sample()
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def reset(self):
+        """Forget what was sent so that next ping sends full stats"""
+        self.sent_stats = self.sending_stats = {}
+        self.sent_time = None
+        self.pings = 0
+
+    def get_partitions(self):
+        """Return the list of monitored partitions, refreshed every PARTITION_REFRESH_TIME"""
+        now = time()
+        if self.partitions_time is None or now - self.partitions_time > PARTITION_REFRESH_TIME:
+            # removes device that we see several times (i.e. bind mount)
+            seen_devices = set()
+            partitions = []
+            for part in psutil.disk_partitions():
+                if part.mountpoint.startswith(IGNORED_MOUNTPOINTS) or part.device in seen_devices:
+                    continue
+                seen_devices.add(part.device)
+                partitions.append(part.mountpoint)
+            self.partitions = partitions
+            self.partitions_time = now
+        return self.partitions
+
+    def sample(self):
+        """Take one telemetry sample"""
+        current_time = time()
+        memory = psutil.virtual_memory().percent
+        disk_usage = [(mountpoint,psutil.disk_usage(mountpoint).percent) 
+                        for mountpoint in self.get_partitions()]
+        scratch_usage = None
+        for mountpoint,usage in disk_usage:
+            if mountpoint=='/' and scratch_usage is None:
+                scratch_usage = usage
+            elif BASE_WORKDIR.startswith(mountpoint):
+                scratch_usage = usage
+
+        network = (lambda x: (x.bytes_sent,x.bytes_recv))(psutil.net_io_counters())
+        if self.ref_network is None:
+            self.ref_network = network
+        disk = (lambda x: (x.read_bytes,x.write_bytes)) (
+            psutil.disk_io_counters(perdisk=False, nowrap=True))
+        if self.ref_disk is None:
+            self.ref_disk = disk
+        load = psutil.getloadavg()
+
+        if self.previous is not None:
+            previous_time, previous_disk, previous_network = self.previous
+            duration = current_time - previous_time
+            disk_speed = tuple(speed(previous_disk, disk, duration))
+            network_speed = tuple(speed(previous_network, network, duration))
+        else:
+            disk_speed = ('-','-')
+            network_speed = ('-', '-')
+        self.previous = (current_time, disk, network)
+
+        cpus = psutil.cpu_times_percent()
+        self.cpu_list.append(cpus.user)
+        cpu_string = f'{cpus.user}'+ ('↑' if cpus.user >= sum(self.cpu_list)/len(self.cpu_list) else '↓')
+        iowait = getattr(cpus, 'iowait', None)
+        if  platform.system() =='Linux':
+            cpu_string += f' / {iowait}'
+
+        stats = { 
+            'load':' '.join(map(lambda x: str(round(x,1)),load)),
+            'disk': {
+                'speed': '/'.join(map(bytes2mb, disk_speed)) + ' Mb/s',
+                'usage': list(map(lambda x: f'{x[0]}:{x[1]:.0f}',disk_usage)),
+                'counter': '/'.join(map(bytes2gb, relative(disk,self.ref_disk))) + ' Gb'
+            },
+            'network': {
+                'speed': '/'.join(map(bytes2mb,network_speed)) + ' Mb/s',
+                'counter': '/'.join(map(bytes2gb, relative(network, self.ref_network))) + ' Gb'
+            } 
+        }
+
+        with self.lock:
+            self.stats = stats
+            self.cpu_string = cpu_string
+            self.memory = memory
+            self.scratch_usage = scratch_usage
+            if self.previous is not None and type(disk_speed[0])!=str:
+                self.samples.append({
+                    'time': current_time,
+                    'cpu': cpus.user,
+                    'iowait': iowait,
+                    'memory': memory,
+                    'load': load[0],
+                    'disk_read': disk_speed[0],
+                    'disk_write': disk_speed[1],
+                    'network_sent': network_speed[0],
+                    'network_recv': network_speed[1],
+                    'scratch_usage': scratch_usage,
+                })
+
+    def loop(self):
+        """Telemetry thread"""
+        while True:
+            sleep(self.interval)
+            try:
+                self.sample()
+            except Exception:
+                log.exception('An exception occured during telemetry sampling')
+
+    def ping_data(self):
+        """Return (stats, delta, samples) to send in next ping:
+        - stats is the full stats every TELEMETRY_FULL_STATS_EVERY pings, only the changed fields otherwise (None if nothing changed),
+        - delta is True if stats is partial,
+        - samples are the numerical samples not sent yet"""
+        with self.lock:
+            stats = self.stats
+            samples = [sample for sample in self.samples 
+                       if self.sent_time is None or sample['time']>self.sent_time]
+        self.sending_stats = stats
+        if not self.sent_stats or self.pings % TELEMETRY_FULL_STATS_EVERY == 0:
+            return stats, False, samples
+        changed = {k:v for k,v in stats.items() if self.sent_stats.get(k)!=v}
+        return (changed or None), True, samples
+
+    def acknowledge(self, samples):
+        """Called when ping_data was successfully sent"""
+        self.sent_stats = self.sending_stats
+        if samples:
+            self.sent_time = samples[-1]['time']
+        self.pings += 1
+
 class Client:
-    def __init__(self, server, concurrency, name, batch, autoclean, flavor):
+    def __init__(self, server, concurrency, name, batch, autoclean, flavor, input_cache=INPUT_CACHE_SIZE):
         self.s = Server(server, style='object')
         self.server = server
         self.concurrency = concurrency
@@ -953,6 +1343,11 @@ class Client:
             if item['status']=='lock':
                 log.warning(f'{key} is marked as locked in resource, removing')
                 del self.resources_db[key]
+        if input_cache and input_cache>0:
+            log.warning(f'Input cache is enabled ({input_cache} Gb)')
+            self.input_cache = InputCache(self.manager, input_cache*1024**3)
+        else:
+            self.input_cache = None
         self.resource_dir = os.path.join(BASE_RESOURCE_DIR, RESOURCE_FILES_SUBDIR)
         if not os.path.exists(self.resource_dir):
             os.makedirs(self.resource_dir)
@@ -962,7 +1357,13 @@ class Client:
         #self.run_slots_semaphore = multiprocessing.BoundedSemaphore()
         #self.has_run_slots_semaphore=False
         self.executions_status = {}
-        self.ref_disk = self.ref_network = None
+        self.telemetry = Telemetry()
+        self.has_docker = shutil.which('docker') is not None
+        self.images = set()
+        self.images_time = None
+        self.sent_images = None
+        self.received_signals = set()
+        self.pull_thread = None
         self.autoclean = autoclean
         self.executions_go = {}
         self.zombie_executions = {}
@@ -994,7 +1395,7 @@ class Client:
         log.warning(f'Working_dirs are {self.working_dirs.values()}')
         for dir in os.listdir(BASE_WORKDIR):
             full_dir = os.path.join(BASE_WORKDIR, dir)
-            if full_dir==BASE_RESOURCE_DIR or full_dir==DOCKER_DIR:
+            if full_dir in [BASE_RESOURCE_DIR, DOCKER_DIR, BASE_CACHE_DIR]:
                 continue
             for working_dir in self.working_dirs.values():
                 if full_dir==working_dir:
@@ -1012,7 +1413,7 @@ class Client:
         dirs.sort(reverse=True)
         log.warning(f'Dirs are {dirs}')
         for _,full_dir in dirs:
-            if full_dir==BASE_RESOURCE_DIR or full_dir==DOCKER_DIR:
+            if full_dir in [BASE_RESOURCE_DIR, DOCKER_DIR, BASE_CACHE_DIR]:
                 continue
             for working_dir in self.working_dirs.values():
                 if full_dir==working_dir:
@@ -1023,6 +1424,47 @@ class Client:
                     shutil.rmtree(full_dir)
                     break
 
+    def pull_images(self, images):
+        """Pre-pull some docker images (run in a separate thread)"""
+        for image in images:
+            docker_pull(image)
+        self.images_time = None
+
+    def refresh_images(self):
+        """Update the list of locally present docker images every IMAGE_REFRESH_TIME, and 
+        pre-pull the images needed by the tasks of our batch.
+        Return the space separated list of images if it changed since last ping, None otherwise"""
+        if not self.has_docker:
+            return None
+        now = time()
+        if self.images_time is None or now - self.images_time > IMAGE_REFRESH_TIME:
+            self.images = docker_images()
+            self.images_time = now
+            if self.w.status=='running' and (self.pull_thread is None or not self.pull_thread.is_alive()):
+                try:
+                    wanted_images = self.s.worker_images(self.w.worker_id)
+                except HTTPException as e:
+                    log.warning(f'Could not get images to pre-pull: {e}')
+                    wanted_images = []
+                missing_images = [image for image in map(docker_image_name, wanted_images)
+                                    if image not in self.images]
+                if missing_images:
+                    log.warning(f'Pre-pulling docker images {missing_images}')
+                    self.pull_thread = threading.Thread(target=self.pull_images, args=(missing_images,), daemon=True)
+                    self.pull_thread.start()
+        images = ' '.join(sorted(self.images))
+        return images if images!=self.sent_images else None
+
+    def prefetch_metadata(self, tasks):
+        """Resolve ENA metadata of all the run accessions inputs of these tasks in one go (in a 
+        separate thread, waiting only a little for it so that the first downloads benefit from it)"""
+        uris = [uri for task in tasks for uri in (task.input or '').split()]
+        if not any(uri.startswith('run+') for uri in uris):
+            return
+        prefetch_thread = threading.Thread(target=ena_prefetch_uris, args=(uris,), daemon=True)
+        prefetch_thread.start()
+        prefetch_thread.join(timeout=ENA_PREFETCH_WAIT)
+
     def clean_execution(self, execution_id):
         """Called when an execution is dead (or has become a zombie)"""
         del(self.executions[execution_id])
@@ -1035,105 +1477,48 @@ class Client:
         self.w = self.s.worker_update(self.w.worker_id, status=status, flavor=self.flavor)
         self.task_properties = json.loads(self.w.task_properties)
         log.warning(f'Task properties are {repr(self.task_properties)}')
-        cpu_list=[]
-        previous_disk = previous_network = None
-        previous_time = None
         while True:
             try:
+                signals = []
                 try:
                     current_time = time()
-                    memory=psutil.virtual_memory().percent
-                    partitions=[part for part in psutil.disk_partitions() 
-                                if not part.mountpoint.startswith('/snap/') and
-                                  not part.mountpoint.startswith('/boot') and
-                                  not part.mountpoint.startswith('/System')]
-                    
-                    # removes device that we see several times (i.e. bind mount)
-                    seen_devices=[]
-                    for part in list(partitions):
-                        if part.device not in seen_devices:
-                            seen_devices.append(part.device)
-                        else:
-                            partitions.remove(part)
-                    
-                    disk_usage=[(part.mountpoint,psutil.disk_usage(part.mountpoint).percent) 
-                                for part in partitions]
-                    scratch_usage = None
-                    for disk,usage in disk_usage:
-                        if disk=='/' and scratch_usage is None:
-                            scratch_usage = usage
-                        elif BASE_WORKDIR.startswith(disk):
-                            scratch_usage = usage
-                    
+                    scratch_usage = self.telemetry.scratch_usage
                     if scratch_usage and scratch_usage >= self.autoclean:
                         log.warning(f'Workdir is full ({scratch_usage}>{self.autoclean}), autocleaning')
                         self.clean_oldest()
 
-
-                    network = (lambda x: (x.bytes_sent,x.bytes_recv))(
-                                    psutil.net_io_counters())
-                    if self.ref_network is None:
-                        self.ref_network = network
-                    disk = (lambda x: (x.read_bytes,x.write_bytes)) (
-                        psutil.disk_io_counters(perdisk=False, nowrap=True))
-                    if self.ref_disk is None:
-                        self.ref_disk = disk
-                    load = psutil.getloadavg()
-
-                    if previous_time is not None:
-                        duration = current_time - previous_time
-                        disk_speed = speed(previous_disk, disk, duration)
-                        network_speed = speed(previous_network, network, duration)
-                    else:
-                        disk_speed = ('-','-')
-                        network_speed = ('-', '-')
-
-                    worker_stats = { 
-                        'load':' '.join(map(lambda x: str(round(x,1)),load)),
-                        'disk': {
-                            'speed': '/'.join(map(bytes2mb, disk_speed))
-                                        + ' Mb/s',
-                            'usage': tuple(map(lambda x: f'{x[0]}:{x[1]:.0f}',disk_usage)),
-                            'counter': '/'.join(map(bytes2gb, 
-                                        relative(disk,self.ref_disk)))
-                                    + ' Gb'
-                        },
-                        'network': {
-                            'speed': '/'.join(map(bytes2mb,network_speed))
-                                    + ' Mb/s',
-                            'counter': '/'.join(map(bytes2gb,
-                                                relative(network,
-                                                            self.ref_network)))
-                                    + ' Gb'
-                        } 
-                    }
-
-                    #CPU1,CPU5,CPU15 = [round((x / psutil.cpu_count()) *100,2) for x in psutil.getloadavg()]
-                    cpus = psutil.cpu_times_percent()
-                    cpu_list.append(cpus.user)
-                    while len(cpu_list)>= CPU_MAX_VALUE:
-                        cpu_list.pop(0)
-                    cpu_string = f'{cpus.user}'+ ('↑' if cpus.user >= sum(cpu_list)/len(cpu_list) else '↓')
-                    if  platform.system() =='Linux':
-                        cpu_string += f' / {cpus.iowait}'
-                    log.warning(f'CPU is {cpu_string}')
-                    self.w=self.s.worker_ping(self.w.worker_id, cpu_string, memory, 
-                                              json.dumps(worker_stats))
+                    stats, delta, samples = self.telemetry.ping_data()
+                    images = self.refresh_images()
+                    log.warning(f'CPU is {self.telemetry.cpu_string}')
+                    self.w=self.s.worker_ping(self.w.worker_id, self.telemetry.cpu_string, self.telemetry.memory, 
+                                              json.dumps(stats) if stats is not None else None,
+                                              delta=delta, 
+                                              samples=json.dumps(samples) if samples else None,
+                                              images=images,
+                                              signals_ack=sorted(set(signal_id for signal_id,_ in self.received_signals)))
+                    self.telemetry.acknowledge(samples)
+                    # batch signals are repeated in each answer for a while, and a signal may be repeated 
+                    # if our acknowledgement was lost: only new (signal_id, execution_id) pairs are handled
+                    received_signals = set()
+                    for signal in self.w.signals or []:
+                        key = (signal['signal_id'], signal['execution_id'])
+                        if key not in self.received_signals:
+                            signals.append(to_obj(signal))
+                        received_signals.add(key)
+                    self.received_signals = received_signals
+                    if images is not None:
+                        self.sent_images = images
                     self.task_properties = json.loads(self.w.task_properties)
                     if client_status_code(self.w.status)!=self.shared_status.value:
                         log.warning(f'Client status was changed to {self.w.status}')
                         self.shared_status.value = client_status_code(self.w.status)
 
-                    previous_time = current_time
-                    previous_disk = disk
-                    previous_network = network
-                    ##self.w=self.s.worker_ping(self.w.worker_id, load = ' '.join(map(
-                        #lambda x: str(int(x*100)),psutil.getloadavg())))
-                    ##
                 except HTTPException as e:
                     log.exception(e)
                     if e.status_code==404:
                         self.declare()
+                        self.telemetry.reset()
+                        self.sent_images = None
                         continue
                 if self.w.concurrency != self.concurrency:
                     #self.run_slots_semaphore.acquire()
@@ -1149,9 +1534,13 @@ class Client:
                     self.prefetch = self.w.prefetch
                 if self.w.status=='running':
                     executions=self.s.worker_executions(self.w.worker_id, status='pending')
+                    new_tasks = { execution.execution_id:self.s.task_get(execution.task_id) 
+                                    for execution in executions 
+                                    if execution.execution_id not in self.executions }
+                    self.prefetch_metadata(new_tasks.values())
                     for execution in executions:
                         if execution.execution_id not in self.executions:
-                            task = self.s.task_get(execution.task_id)
+                            task = new_tasks[execution.execution_id]
                             #execution_started = multiprocessing.Semaphore(0)
                             self.executions_go[execution.execution_id] = multiprocessing.Semaphore(0)
                             execution_queue = multiprocessing.Queue()
@@ -1182,7 +1571,8 @@ class Client:
                                     'status': self.executions_status[execution.execution_id],
                                     'working_dirs': self.working_dirs,
                                     'client_status': self.shared_status,
-                                    'go': self.executions_go[execution.execution_id]
+                                    'go': self.executions_go[execution.execution_id],
+                                    'input_cache': self.input_cache,
                                 })
                             p.start()
                             self.executions[execution.execution_id]=(p,execution_queue)
@@ -1199,7 +1589,7 @@ class Client:
                                 (now-self.idle_time > IDLE_TIMEOUT and self.has_worked):
                             self.s.worker_callback(self.w.worker_id, message = "idle")
                             self.idle_time = None
-                for signal in self.s.worker_signals(self.w.worker_id):
+                for signal in signals:
                     if signal.execution_id in self.executions:
                         log.warning(f'Sending signal {signal.signal} to execution {signal.execution_id}')
                         self.executions[signal.execution_id][1].put(signal.signal)
@@ -1226,6 +1616,9 @@ class Client:
                             log.warning('Received reset resource signal, forgetting resources')
                             for resource in self.resources_db.keys():
                                 del(self.resources_db[resource])
+                            if self.input_cache is not None:
+                                log.warning('Also emptying input cache')
+                                self.input_cache.clear()
                     else:
                         log.warning(f'Execution {signal.execution_id} is not running in this worker')
                 for execution_id in list(self.executions.keys()):
@@ -1384,6 +1777,8 @@ def main():
             help=f"Clean failures when disk is full up to this %% (default to {DEFAULT_AUTOCLEAN})")
     parser.add_argument('-f','--flavor', type=str, default=None,
             help=f"Update the declared flavor of this client to this value (otherwise keep the default value)")
+    parser.add_argument('-c','--input-cache', type=float, default=INPUT_CACHE_SIZE,
+            help=f"Size (in Gb) of the local cache for task inputs, 0 to disable it (default to SCITQ_INPUT_CACHE_SIZE environment variable or 0)")
     args = parser.parse_args()
     
     Client(
@@ -1393,6 +1788,7 @@ def main():
         batch=args.batch,
         autoclean=args.autoclean,
         flavor=args.flavor,
+        input_cache=args.input_cache,
     ).run(status=args.status)
     
 
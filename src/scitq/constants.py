@@ -16,8 +16,16 @@ WORKER_STATUS = ['paused','running','offline','failed','evicted']
 PROTOFILTER_SYNTAX=r'^(?P<item>cpu|ram|disk|tags|gpumem|eviction|region|cost|provider)(?P<comparator>==|!=|>=|>|<|<=|~|#|!~|!#)(?P<value>[0-9\.]+|[A-Za-z0-9_%-]+)$'
 PROTOFILTER_SEPARATOR=':'
 
+# names of the policies implemented in server.recruiting (RECRUITER_POLICIES)
+RECRUITER_POLICY_NAMES=['tasks_per_worker','drain']
+RECRUITER_DEFAULT_POLICY='tasks_per_worker'
+
 FLAVOR_DEFAULT_LIMIT=10
 FLAVOR_DEFAULT_EVICTION=5
 
+# compact column-oriented JSON encoding of lists, negotiated with Accept header
+COLUMNS_MIMETYPE='application/x-scitq-columns+json'
+COLUMNS_KEY='__columns__'
+
 TASK_STATUS_ID = {status:i for i,status in enumerate(TASK_STATUS)}
 TASK_STATUS_ID_REVERSE = {i:status for i,status in enumerate(TASK_STATUS)}
\ No newline at end of file
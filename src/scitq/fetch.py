@@ -1,7 +1,8 @@
-from ftplib import FTP
+from ftplib import FTP, error_perm, error_temp
 import re
 import logging as log
 from functools import wraps, cached_property
+from contextlib import contextmanager
 from time import sleep, time
 import shutil
 import os
@@ -23,6 +24,8 @@ import json
 import tempfile
 from rclone_python import rclone
 import sys
+import threading
+from urllib.parse import quote
 
 # how many time do we retry
 RETRY_TIME = 3
@@ -40,12 +43,37 @@ FTP_DIR_MONTH_POSITION = 5
 FTP_DIR_DAY_POSITION = 6
 FTP_DIR_YEAR_POSITION = 7
 FTP_DIR_NAME_POSITION = 8
+FTP_TIMEOUT = 60
+# idle connections kept per host, and delay after which they are checked before reuse
+FTP_POOL_SIZE = 5
+FTP_POOL_IDLE_TIME = 30
+MAX_PARALLEL_FTP_LIST = 5
 
 HTTP_CHUNK_SIZE = 81920
+HTTP_TIMEOUT = 60
+# files above that size are downloaded with several range requests in parallel
+HTTP_PARALLEL_MIN_SIZE = 64*1024**2
+HTTP_PARALLEL_CONNECTIONS = 5
+# progress of resumable downloads is kept in destination+HTTP_STATE_SUFFIX
+HTTP_STATE_SUFFIX = '.scitq-download'
+HTTP_STATE_SAVE_SIZE = 16*1024**2
 
 ARIA2_PROCESSES = 5
 SRA_AWS_URL = 'https://sra-pub-run-odp.s3.amazonaws.com/sra/{run_accession}/{run_accession}'
 
+# ENA metadata (file lists and md5 of runs) cache
+ENA_FILEREPORT_URL = 'https://www.ebi.ac.uk/ena/portal/api/filereport'
+ENA_SEARCH_URL = 'https://www.ebi.ac.uk/ena/portal/api/search'
+ENA_FIELDS = ['run_accession', 'fastq_md5', 'fastq_aspera', 'fastq_ftp', 'sra_md5', 'sra_ftp',
+              'submitted_md5', 'submitted_aspera', 'submitted_ftp']
+ENA_TIMEOUT = 30
+ENA_BATCH_SIZE = 100
+try:
+    ENA_CACHE_TTL = int(os.environ.get('SCITQ_ENA_CACHE_TTL', str(7*24*3600)))
+except ValueError:
+    ENA_CACHE_TTL = 7*24*3600
+ENA_CACHE_DIR = os.environ.get('SCITQ_ENA_CACHE_DIR', os.path.expanduser('~/.cache/scitq/ena'))
+
 # name of Azure variables
 AZURE_ACCOUNT='SCITQ_AZURE_ACCOUNT'
 AZURE_KEY='SCITQ_AZURE_KEY'
@@ -55,8 +83,39 @@ AZURE_CHUNK_SIZE = 100*1024**2
 
 ASPERA_DOCKER = 'martinlaurent/ascli:4.14.0'
 
+# packed output mode: output URI ending with |pack upload /output subfolders as archives
+PACK_ACTION = 'pack'
+PACK_SUFFIX = '.tar.zst'
+# decompressors used when streaming archives into tar, by archive suffix
+ARCHIVE_DECOMPRESSORS = {
+    '.tar.zst': ['zstd','-dcq'],
+    '.tzst': ['zstd','-dcq'],
+    '.tar.gz': ['pigz','-dc'],
+    '.tgz': ['pigz','-dc'],
+    '.tar.bz2': ['bzip2','-dc'],
+    '.tar': None,
+}
+STREAM_CHUNK_SIZE = 1024**2
+# single file decompression actions: decompressor reading stdin and suffix removed from the name
+DECOMPRESSION_ACTIONS = {
+    'gunzip': (['pigz','-dc'], '.gz'),
+    'pigz': (['pigz','-dc'], '.gz'),
+    'zstd': (['zstd','-dcq'], '.zst'),
+}
+
 MAX_PARALLEL_SYNC = 10
 
+# optional listing cache for info/list_content (TTL in seconds, 0 means no cache)
+try:
+    FETCH_CACHE_TTL = int(os.environ.get('SCITQ_FETCH_CACHE_TTL', '0'))
+except ValueError:
+    FETCH_CACHE_TTL = 0
+FETCH_CACHE_DIR = os.environ.get('SCITQ_FETCH_CACHE_DIR')
+FETCH_CACHE_DATE_FIELDS = ['creation_date', 'modification_date']
+
+# where sync manifests (local sizes, dates and md5) are kept between runs
+SYNC_MANIFEST_DIR = os.environ.get('SCITQ_SYNC_MANIFEST_DIR', os.path.expanduser('~/.cache/scitq/sync'))
+
 class FetchError(Exception):
     pass
 
@@ -130,6 +189,22 @@ def gunzip(filepath):
     """Stupid gunzipper with gzip"""
     subprocess.run(['pigz','-d',filepath], check=True)
     
+def unzstd(filepath):
+    """Zstd decompression in place like gunzip (the .zst file is replaced by its decompressed version)"""
+    subprocess.run(['zstd','-dq','--rm',filepath], check=True)
+
+def decompress_stream(stream, destination, command):
+    """Decompress a binary stream with command (reading stdin, writing stdout) into destination file"""
+    with open(destination, 'wb') as f:
+        decompress = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=f)
+        try:
+            shutil.copyfileobj(stream, decompress.stdin, STREAM_CHUNK_SIZE)
+        finally:
+            decompress.stdin.close()
+            returncode = decompress.wait()
+    if returncode:
+        raise FetchError(f'Could not decompress to {destination} ({command[0]} returned {returncode})')
+
 def untar(filepath):
     """Untar the tar archive locally where it is and delete the archive.
     (so it behaves like gunzip, and not like tar usually)"""
@@ -147,6 +222,39 @@ def unzip(filepath):
     subprocess.run(['unzip',filepath] + ['-d',path] if path else [], check=True)
     os.remove(filepath)
 
+def split_action(uri):
+    """Return the URI without its |action part and the action (None if there is none)"""
+    if '|' in uri:
+        uri, action = uri.split('|',1)
+        return uri, action
+    return uri, None
+
+def is_archive(name):
+    """Return True if name looks like an archive that can be streamed into tar"""
+    return any(name.endswith(suffix) for suffix in ARCHIVE_DECOMPRESSORS)
+
+def untar_stream(stream, destination_folder, name):
+    """Extract a tar archive (possibly compressed, as guessed from name) read from 
+    a binary stream into destination_folder, without any intermediate file"""
+    decompressor = next((command for suffix,command in ARCHIVE_DECOMPRESSORS.items() 
+                         if name.endswith(suffix)), None)
+    os.makedirs(destination_folder, exist_ok=True)
+    if decompressor:
+        decompress = subprocess.Popen(decompressor, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        tar = subprocess.Popen(['tar','x','-C',destination_folder], stdin=decompress.stdout)
+        decompress.stdout.close()
+        processes = [decompress, tar]
+    else:
+        tar = subprocess.Popen(['tar','x','-C',destination_folder], stdin=subprocess.PIPE)
+        processes = [tar]
+    try:
+        shutil.copyfileobj(stream, processes[0].stdin, STREAM_CHUNK_SIZE)
+    finally:
+        processes[0].stdin.close()
+        returncodes = [process.wait() for process in processes]
+    if any(returncodes):
+        raise FetchError(f'Could not extract {name} (return codes {returncodes})')
+
 def older_python_fromisoformat(d):
     """This is a script to add minimal support to Z date (eg ISO 8601 strings) that were not supported before 3.11"""
     if '.' in d:
@@ -253,12 +361,13 @@ class RcloneClient:
     def copy(self, source, destination, show_progress=False, args=[]):
         if not self.is_installed:
             raise FetchErrorNoRepeat('rclone is not installed')
-        destination=self._uri(destination)
+        _destination=self._uri(destination)
         source=self._uri(source)
-        if destination.endswith('/'):
-            rclone.copy(source, destination, show_progress=show_progress, args=args)
+        if _destination.endswith('/'):
+            rclone.copy(source, _destination, show_progress=show_progress, args=args)
         else:
-            rclone.copyto(source, destination, show_progress=show_progress, args=args)
+            rclone.copyto(source, _destination, show_progress=show_progress, args=args)
+        listing_cache.invalidate(destination)
 
 
     def delete(self, uri, include=[]):
@@ -267,6 +376,19 @@ class RcloneClient:
         if include:
             args=[f'--include "{i}"' for i in include]
         rclone.delete(_uri, args=args)
+        listing_cache.invalidate(uri)
+
+    @retry_if_it_fails(RETRY_TIME)
+    def copy_files(self, source, destination, files, show_progress=False):
+        """Copy a list of files (relative to source folder) to destination folder in one rclone call"""
+        if not self.is_installed:
+            raise FetchErrorNoRepeat('rclone is not installed')
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as files_from:
+            files_from.write(''.join(f'{file}\n' for file in files))
+            files_from.flush()
+            rclone.copy(self._uri(source), self._uri(destination), show_progress=show_progress, 
+                        args=[f'--files-from-raw "{files_from.name}"'])
+        listing_cache.invalidate(destination)
 
     def has_source(self, source):
         return source in self.remotes
@@ -279,11 +401,12 @@ class RcloneClient:
         """Small wrapper above rclone.copy to avoid deleting (but this time we know that these are folder, so no copy to)"""
         if not self.is_installed:
             raise FetchErrorNoRepeat('rclone is not installed')
-        destination=self._uri(destination)
+        _destination=self._uri(destination)
         source=self._uri(source)
         if include:
             args.extend([f'--include "{i}"' for i in include])
-        rclone.copy(source, destination, show_progress=show_progress, args=args)
+        rclone.copy(source, _destination, show_progress=show_progress, args=args)
+        listing_cache.invalidate(destination)
 
 # work as a singleton
 rclone_client = RcloneClient()
@@ -293,6 +416,138 @@ rclone_client = RcloneClient()
 
 FTP_REGEXP=re.compile(r'^ftp://(?P<host>[^/]*)/(?P<path>.*)$')
 
+class FTPPool:
+    """A per host pool of logged in FTP connections, reused across calls in a process.
+    Connections are checked with a NOOP before reuse if they have been idle for a while,
+    and a connection that failed during use is discarded rather than returned to the pool
+    (unless the failure is a plain error reply of the server, like a missing file)."""
+
+    def __init__(self, size=FTP_POOL_SIZE, idle_time=FTP_POOL_IDLE_TIME):
+        self.size = size
+        self.idle_time = idle_time
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.idle = {}
+        self.mlsd_support = {}
+
+    def _check_pid(self):
+        """Sockets must not be shared with a forked process: start afresh in a child"""
+        if os.getpid()!=self.pid:
+            self.pid = os.getpid()
+            self.idle = {}
+
+    def acquire(self, host):
+        """Return a logged in connection to host, reusing an idle one if possible"""
+        with self.lock:
+            self._check_pid()
+            idle = self.idle.setdefault(host, [])
+            while idle:
+                ftp, last_used = idle.pop()
+                if time()-last_used<self.idle_time:
+                    return ftp
+                try:
+                    ftp.voidcmd('NOOP')
+                    return ftp
+                except Exception:
+                    self.discard(ftp)
+        ftp = FTP(host, timeout=FTP_TIMEOUT)
+        ftp.login()
+        return ftp
+
+    def release(self, host, ftp):
+        """Give back a connection to the pool (or close it if the pool is full)"""
+        with self.lock:
+            self._check_pid()
+            idle = self.idle.setdefault(host, [])
+            if len(idle)<self.size:
+                idle.append((ftp, time()))
+                return
+        self.discard(ftp, quit=True)
+
+    def discard(self, ftp, quit=False):
+        """Close a connection"""
+        try:
+            if quit:
+                ftp.quit()
+            else:
+                ftp.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, host):
+        """Context manager to borrow a connection to host"""
+        ftp = self.acquire(host)
+        try:
+            yield ftp
+        except (error_perm, error_temp):
+            # the server answered, the connection is still usable
+            self.release(host, ftp)
+            raise
+        except BaseException:
+            self.discard(ftp)
+            raise
+        self.release(host, ftp)
+
+# work as a singleton
+ftp_pool = FTPPool()
+
+def ftp_parse_date(obj):
+    """Parse the date of a split `dir` output line, which contains either the year or
+    the time for recent files (and then the year is the current one)"""
+    date = ' '.join( (obj[FTP_DIR_MONTH_POSITION], obj[FTP_DIR_DAY_POSITION]) )
+    for year in [obj[FTP_DIR_YEAR_POSITION], str(datetime.datetime.now().year)]:
+        try:
+            return datetime.datetime.strptime(f'{date} {year}', '%b %d %Y').replace(tzinfo=pytz.utc)
+        except ValueError:
+            pass
+    return None
+
+def ftp_parse_mlsd_date(modify):
+    """Parse a MLSD/MLST modify fact (YYYYMMDDHHMMSS[.sss], always UTC)"""
+    if not modify:
+        return None
+    try:
+        return datetime.datetime.strptime(modify[:14], '%Y%m%d%H%M%S').replace(tzinfo=pytz.utc)
+    except ValueError:
+        return None
+
+def ftp_listdir(host, path):
+    """List a FTP folder (not recursively), returning a list of Namespace with name,
+    is_dir, size and date attributes. MLSD is used when the server supports it, else
+    the output of `dir` is parsed"""
+    with ftp_pool.connection(host) as ftp:
+        if ftp_pool.mlsd_support.get(host, True):
+            try:
+                return [argparse.Namespace(name=name, 
+                                           is_dir=facts.get('type','').lower()=='dir',
+                                           size=int(facts.get('size',0) or 0),
+                                           date=ftp_parse_mlsd_date(facts.get('modify')))
+                        for name,facts in ftp.mlsd(path, facts=['type','size','modify'])
+                        if facts.get('type','').lower() not in ['cdir','pdir']]
+            except error_perm as e:
+                if not str(e).startswith('50'):
+                    raise
+                log.info(f'FTP server {host} does not support MLSD, falling back to dir')
+                ftp_pool.mlsd_support[host] = False
+        listing = []
+        ftp.dir(path, listing.append)
+    answer = []
+    for item in listing:
+        obj = item.split(None, FTP_DIR_NAME_POSITION)
+        if len(obj)<=FTP_DIR_NAME_POSITION:
+            continue
+        name = obj[FTP_DIR_NAME_POSITION]
+        if item[0]=='l':
+            name = name.split(' -> ')[0]
+        if name in ['.','..']:
+            continue
+        answer.append(argparse.Namespace(name=name, 
+                                         is_dir=item[0]=='d',
+                                         size=int(obj[FTP_DIR_SIZE_POSITION]) if obj[FTP_DIR_SIZE_POSITION].isdigit() else 0,
+                                         date=ftp_parse_date(obj)))
+    return answer
+
 @retry_if_it_fails(RETRY_TIME)
 def ftp_get(source, destination):
     """FTP downloader: download source expressed as ftp://host/path_to_file 
@@ -308,8 +563,7 @@ def ftp_get(source, destination):
         raise FetchError(message)
     uri_match = uri_match.groupdict()
     with open(destination, 'wb') as local_file:
-        with FTP(uri_match['host']) as ftp:
-            ftp.login()
+        with ftp_pool.connection(uri_match['host']) as ftp:
             ftp.retrbinary(f"RETR {uri_match['path']}", local_file.write)
 
 @retry_if_it_fails(RETRY_TIME)
@@ -319,120 +573,102 @@ def ftp_put(source, destination):
     log.info(f'FTP uploading {source} to {destination}')
     destination=complete_if_ends_with_slash(source, destination)
     uri_match = FTP_REGEXP.match(destination).groupdict()
-    with open(destination, 'rb') as local_file:
-        with FTP(uri_match['host']) as ftp:
-            ftp.login()
-            ftp.storbinary(f"STOR {uri_match['path']}", local_file.read)
+    with open(source, 'rb') as local_file:
+        with ftp_pool.connection(uri_match['host']) as ftp:
+            ftp.storbinary(f"STOR {uri_match['path']}", local_file)
 
 @retry_if_it_fails(RETRY_TIME)
 def ftp_info(uri, md5=False):
     """FTP info: get some information on a FTP object"""
     log.info(f'FTP get info for {uri}')
     uri_match = FTP_REGEXP.match(uri).groupdict()
-    with FTP(uri_match['host']) as ftp:
-        ftp.login()
+    host = uri_match['host']
+    with ftp_pool.connection(host) as ftp:
+        if ftp_pool.mlsd_support.get(host, True):
+            try:
+                answer = ftp.sendcmd(f"MLST {uri_match['path']}")
+            except error_perm as e:
+                if str(e).startswith('550'):
+                    raise FetchErrorNoRepeat(f'{uri} was not found')
+                if not str(e).startswith('50'):
+                    raise
+                log.info(f'FTP server {host} does not support MLST, falling back to dir')
+                ftp_pool.mlsd_support[host] = False
+            else:
+                # answer is like '250-Listing path\n type=file;size=12;modify=...; path\n250 End'
+                lines = answer.splitlines()
+                facts_line = lines[1] if len(lines)>2 else ''
+                facts = dict(fact.split('=',1) for fact in facts_line.strip().split(' ',1)[0].split(';') if '=' in fact)
+                facts = {k.lower():v for k,v in facts.items()}
+                obj_date = ftp_parse_mlsd_date(facts.get('modify'))
+                obj_type = facts.get('type','').lower()
+                return argparse.Namespace(size=int(facts.get('size',0) or 0),
+                                    creation_date=obj_date, 
+                                    modification_date=obj_date,
+                                    md5=None,
+                                    type='dir' if obj_type in ['dir','cdir'] else 'file' if obj_type=='file' else 'unknown')
 
         with io.StringIO() as output:
             ftp.dir('-a',uri_match['path'],output.write)
             output.seek(0)
             answer = output.readline()
         
-        if answer:
-            obj = answer.split()
-            try:
-                obj_date = datetime.datetime.strptime(
-                    ' '.join( (obj[FTP_DIR_MONTH_POSITION],
-                            obj[FTP_DIR_DAY_POSITION],
-                            obj[FTP_DIR_YEAR_POSITION])
-                        ),
-                    '%b %d %Y').replace(tzinfo=pytz.utc)
-            except ValueError:
-                try:
-                    obj_date = datetime.datetime.strptime(
-                        ' '.join( (obj[FTP_DIR_MONTH_POSITION],
-                                obj[FTP_DIR_DAY_POSITION],
-                                str(datetime.datetime.now().year))
-                            ),
-                        '%b %d %Y').replace(tzinfo=pytz.utc)
-                except ValueError:
-                    obj_date = None
-            if obj[FTP_DIR_NAME_POSITION]=='.':
-                obj_type='dir'
-            elif obj[FTP_DIR_NAME_POSITION]==uri_match['path'].split('/')[-1]:
-                obj_type='file'
-            else:
-                obj_type='unknown'
-            return argparse.Namespace(size=obj[FTP_DIR_SIZE_POSITION],
-                                    creation_date=obj_date, 
-                                    modification_date=obj_date,
-                                    md5=None,
-                                    type=obj_type)
+    if answer:
+        obj = answer.split()
+        obj_date = ftp_parse_date(obj)
+        if obj[FTP_DIR_NAME_POSITION]=='.':
+            obj_type='dir'
+        elif obj[FTP_DIR_NAME_POSITION]==uri_match['path'].split('/')[-1]:
+            obj_type='file'
         else:
-            raise FetchErrorNoRepeat(f'{uri} was not found')
+            obj_type='unknown'
+        return argparse.Namespace(size=int(obj[FTP_DIR_SIZE_POSITION]),
+                                creation_date=obj_date, 
+                                modification_date=obj_date,
+                                md5=None,
+                                type=obj_type)
+    else:
+        raise FetchErrorNoRepeat(f'{uri} was not found')
 
-def ftp_list(uri, no_rec=False):
+def ftp_list(uri, no_rec=False, md5=False):
     """list recursively the content of a FTP folder
-    not recursively if no_rec is True"""
+    not recursively if no_rec is True (md5 is not available with FTP)
+    subfolders are listed in parallel using pooled connections"""
     log.info(f'FTP get info for {uri}')
     uri_match = FTP_REGEXP.match(uri).groupdict()
+    host = uri_match['host']
+    root = uri_match['path']
     answer = []
-    with FTP(uri_match['host']) as ftp:
-        ftp.login()
-
-        with io.StringIO() as output:
-            listing = []
-            ftp.dir(uri_match['path'],listing.append)
-        
-        for item in listing:
-            obj = item.split()
-            is_dir=item[0]=='d'
-            if is_dir:
-                if no_rec:
-                    try:
-                        obj_date = datetime.datetime.strptime(
-                            ' '.join( (obj[FTP_DIR_MONTH_POSITION],
-                                    obj[FTP_DIR_DAY_POSITION],
-                                    obj[FTP_DIR_YEAR_POSITION])
-                                ),
-                            '%b %d %Y').replace(tzinfo=pytz.utc)
-                    except ValueError:
-                        try:
-                            obj_date = datetime.datetime.strptime(
-                                ' '.join( (obj[FTP_DIR_MONTH_POSITION],
-                                        obj[FTP_DIR_DAY_POSITION],
-                                        str(datetime.datetime.now().year))
-                                    ),
-                                '%b %d %Y').replace(tzinfo=pytz.utc)
-                        except ValueError:
-                            obj_date = None
-                    answer.append(argparse.Namespace(
-                        name=f"ftp://{uri_match['host']}/{os.path.join(uri_match['path'],obj[FTP_DIR_NAME_POSITION]+'/')}",
-                        rel_name=obj[FTP_DIR_NAME_POSITION]+'/',
-                        size=0,
-                        creation_date = obj_date,
-                        modification_date=obj_date,
-                        md5=None
-                    ))
-                else:
-                    dir_name = obj[FTP_DIR_NAME_POSITION]
-                    for item in ftp_list(os.path.join(uri, dir_name)):
-                        item.rel_name = f"{dir_name}/{item.rel_name}"
-                        answer.append(item)
+    def _item(rel_name, entry, size):
+        return argparse.Namespace(
+                    name=f"ftp://{host}/{os.path.join(root,rel_name)}",
+                    rel_name=rel_name,
+                    size=size,
+                    creation_date=entry.date, 
+                    modification_date=entry.date,
+                    md5=None)
+
+    if no_rec:
+        for entry in ftp_listdir(host, root):
+            if entry.is_dir:
+                answer.append(_item(entry.name+'/', entry, 0))
             else:
-                obj_date = datetime.datetime.strptime(
-                    ' '.join( (obj[FTP_DIR_MONTH_POSITION],
-                            obj[FTP_DIR_DAY_POSITION],
-                            obj[FTP_DIR_YEAR_POSITION])
-                        ),
-                    '%b %d %Y').replace(tzinfo=pytz.utc)
-                answer.append(argparse.Namespace(
-                    name=f"ftp://{uri_match['host']}/{os.path.join(uri_match['path'],obj[FTP_DIR_NAME_POSITION])}",
-                    rel_name=obj[FTP_DIR_NAME_POSITION],
-                    size=obj[FTP_DIR_SIZE_POSITION],
-                    creation_date=obj_date, 
-                    modification_date=obj_date,
-                    md5=None))
+                answer.append(_item(entry.name, entry, entry.size))
+        return answer
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PARALLEL_FTP_LIST) as executor:
+        pending = {executor.submit(ftp_listdir, host, root): ''}
+        while pending:
+            done,_ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for job in done:
+                rel_dir = pending.pop(job)
+                for entry in job.result():
+                    rel_name = rel_dir+entry.name
+                    if entry.is_dir:
+                        pending[executor.submit(ftp_listdir, host, os.path.join(root, rel_name))]=rel_name+'/'
+                    else:
+                        answer.append(_item(rel_name, entry, entry.size))
+    answer.sort(key=lambda item: item.rel_name)
     return answer
 
 @cached_property
@@ -499,50 +735,187 @@ def fasp_get(source, destination):
 FASTQ_RUN_REGEXP=re.compile(r'^run\+fastq://(?P<run_accession>[^/]*)/?$')
 FASTQ_PARITY = re.compile(r'.*(1|2)\.f.*q(\.gz)?$')
 
+def sra_demux(stream, destination, run_accession, filter_r1=False):
+    """Split an interleaved FASTQ stream whose deflines are '@<read index> <name>' (as produced by 
+    fastq_sra_get fastq-dump call) into <run_accession>_<read index>.fastq.gz files, compressing 
+    them on the fly with pigz. Reads other than the first are dropped if filter_r1 is set.
+    Return the list of files"""
+    compressors = {}
+    files = {}
+    try:
+        while True:
+            header = stream.readline()
+            if not header:
+                break
+            record = [stream.readline(), stream.readline(), stream.readline()]
+            read_index, name = header[1:].split(b' ',1)
+            if filter_r1 and read_index!=b'1':
+                continue
+            if read_index not in compressors:
+                files[read_index] = os.path.join(destination, 
+                                        f'{run_accession}_{read_index.decode()}.fastq.gz')
+                with open(files[read_index], 'wb') as f:
+                    compressors[read_index] = subprocess.Popen(['pigz','-c'], 
+                                                stdin=subprocess.PIPE, stdout=f)
+            compressors[read_index].stdin.writelines([b'@', name]+record)
+    finally:
+        for compressor in compressors.values():
+            compressor.stdin.close()
+        returncodes = [compressor.wait() for compressor in compressors.values()]
+    if any(returncodes):
+        raise FetchError(f'pigz failed for {run_accession} (return codes {returncodes})')
+    return [files[index] for index in sorted(files)]
+
 @retry_if_it_fails(RETRY_TIME)
 def fastq_sra_get(run_accession, destination, filter_r1=False):
     """This subfunction of runacc_get is only called when EBI's ENA won't
-    answer as NCBI's SRA while more complete is quite slow"""
+    answer as NCBI's SRA while more complete is quite slow
+    The .sra file is converted in a single streaming pass (fastq-dump to stdout, demultiplexed
+    and compressed on the fly), so only the .sra and the final .fastq.gz are written on disk"""
     log.info(f'SRA get run+fastq://{run_accession} to {destination}')
     if not docker_available:
         raise FetchError('Cannot use SRA toolkit without docker')
     if not destination.endswith('/'):
             destination+='/'
-    previous_fastq = glob.glob(os.path.join(destination, '*.fastq'))
+    sra_file = os.path.join(destination, run_accession+'.sra')
+    prefetch_folder = os.path.join(destination, run_accession)
     try:
-        aria2 = True
-        aria2_get(SRA_AWS_URL.format(run_accession=run_accession), os.path.join(destination,run_accession+'.sra'))
-        log.warning('aria download ok')
-        subprocess.run(f"docker run --rm -v {destination}:/destination ncbi/sra-tools \
-            sh -c 'cd /destination && vdb-validate {run_accession}.sra && fasterq-dump -f -F --split-files {run_accession}.sra'",
-            shell=True,
-            check=True)
-    except:
-        aria2 = False
-        log.warning(f'aria2 download of {run_accession} failed, trying with prefetch')
-        subprocess.run(f'docker run --rm -v {destination}:/destination ncbi/sra-tools \
-            sh -c "cd /destination && prefetch -X 9999999999999 {run_accession} && fasterq-dump -f --split-files {run_accession}"',
-            shell=True,
-            check=True)
-    current_fastq = glob.glob(os.path.join(destination, '*.fastq'))
-    fastqs = [fastq for fastq in current_fastq if fastq not in previous_fastq]
-    if filter_r1:
-        unfiltered_fastqs = fastqs
-        fastqs = []
-        for fastq in unfiltered_fastqs:
-            if fastq.endswith('1.fastq'):
-                fastqs.append(fastq)
-            else:
-                log.info(f'Removing read as it is not r1: {fastq}')
+        try:
+            aria2_get(SRA_AWS_URL.format(run_accession=run_accession), sra_file)
+            log.warning('aria download ok')
+            subprocess.run(['docker','run','--rm','-v',f'{destination}:/destination','ncbi/sra-tools',
+                            'vdb-validate',f'/destination/{run_accession}.sra'], check=True)
+            sra_path = f'/destination/{run_accession}.sra'
+        except Exception:
+            log.warning(f'aria2 download of {run_accession} failed, trying with prefetch')
+            if os.path.exists(sra_file):
+                os.remove(sra_file)
+            subprocess.run(['docker','run','--rm','-v',f'{destination}:/destination','-w','/destination',
+                            'ncbi/sra-tools','prefetch','-X','9999999999999',run_accession], check=True)
+            sra_path = f'/destination/{run_accession}/{run_accession}.sra'
+        dump = subprocess.Popen(['docker','run','--rm','-v',f'{destination}:/destination','ncbi/sra-tools',
+                                 'fastq-dump','--stdout','--split-spot','--skip-technical',
+                                 '--defline-seq','@$ri $sn','--defline-qual','+', sra_path],
+                                stdout=subprocess.PIPE)
+        try:
+            try:
+                fastqs = sra_demux(dump.stdout, destination, run_accession, filter_r1=filter_r1)
+            finally:
+                dump.stdout.close()
+                returncode = dump.wait()
+            if returncode:
+                raise FetchError(f'fastq-dump failed for {run_accession} (return code {returncode})')
+        except Exception:
+            # whatever failed (fastq-dump, demultiplexing or pigz), partial FASTQ must not stay behind
+            for fastq in glob.glob(os.path.join(destination, f'{run_accession}_*.fastq.gz')):
                 os.remove(fastq)
-    if aria2:
-        os.remove(os.path.join(destination, run_accession+'.sra'))
-    elif os.path.isdir(os.path.join(destination, run_accession)):
-        shutil.rmtree(os.path.join(destination, run_accession))
-    log.info(f'Pigziping fastqs ({fastqs})')
-    subprocess.run(['pigz','-f']+fastqs,
-        check=True)
-    
+            raise
+        log.info(f'SRA conversion done ({fastqs})')
+    finally:
+        if os.path.exists(sra_file):
+            os.remove(sra_file)
+        if os.path.isdir(prefetch_folder):
+            shutil.rmtree(prefetch_folder)
+
+class EnaMetadataCache:
+    """An on disk cache (shared between processes) of ENA read_run file reports, per run accession"""
+
+    def __init__(self, cache_dir=ENA_CACHE_DIR, ttl=ENA_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _path(self, accession):
+        return os.path.join(self.cache_dir, f'{accession}.json')
+
+    def get(self, accession):
+        """Return the cached report of a run or None"""
+        if not self.ttl:
+            return None
+        try:
+            with open(self._path(accession)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time()-entry.get('date',0)>=self.ttl:
+            return None
+        return entry.get('run')
+
+    def set(self, accession, run):
+        """Store the report of a run"""
+        if not self.ttl:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self.cache_dir, suffix='.tmp', delete=False) as f:
+                json.dump({'date':time(), 'run':run}, f)
+            os.replace(f.name, self._path(accession))
+        except OSError:
+            log.warning(f'Could not cache ENA metadata for {accession}')
+
+# work as a singleton
+ena_cache = EnaMetadataCache()
+
+def ena_run_metadata(run_accession):
+    """Return ENA file report for a run (a dict with ENA_FIELDS) using the cache when possible,
+    or None if EBI does not answer or does not know this run"""
+    run = ena_cache.get(run_accession)
+    if run is not None:
+        return run
+    query_try = RETRY_TIME+1
+    while query_try>0:
+        try:
+            run_query = requests.get(ENA_FILEREPORT_URL, params={
+                'accession': run_accession, 'result': 'read_run', 'fields': ','.join(ENA_FIELDS),
+                'format': 'json', 'download': 'true', 'limit': 0}, timeout=ENA_TIMEOUT)
+        except requests.Timeout:
+            query_try -= 1
+            continue
+        if run_query.status_code==204:
+            log.warning(f'{run_accession} does not seem to be available on EBI')
+            return None
+        runs = run_query.json()
+        if len(runs)==0:
+            # it seems the new API of EBI tends to answer empty responses
+            # hoping this will change in near future
+            query_try -= 1
+            continue
+        run = runs[0]
+        ena_cache.set(run_accession, run)
+        return run
+    log.warning('EBI does not answer our query')
+    return None
+
+def ena_prefetch(run_accessions):
+    """Resolve ENA metadata for several runs at once (in batches of ENA_BATCH_SIZE), filling
+    the cache, so that later downloads of these runs do not need to query EBI.
+    Return the number of runs that were fetched."""
+    missing = sorted(set(accession for accession in run_accessions if ena_cache.get(accession) is None))
+    fetched = 0
+    for batch in [missing[i:i+ENA_BATCH_SIZE] for i in range(0, len(missing), ENA_BATCH_SIZE)]:
+        try:
+            run_query = requests.post(ENA_SEARCH_URL, data={
+                'result': 'read_run', 
+                'query': ' OR '.join(f'run_accession="{accession}"' for accession in batch),
+                'fields': ','.join(ENA_FIELDS), 'format': 'json', 'limit': 0}, timeout=ENA_TIMEOUT)
+            run_query.raise_for_status()
+            runs = run_query.json() if run_query.status_code!=204 else []
+        except (requests.RequestException, ValueError) as e:
+            log.warning(f'Could not prefetch ENA metadata: {e}')
+            continue
+        for run in runs:
+            if run.get('run_accession') in batch:
+                ena_cache.set(run['run_accession'], run)
+                fetched += 1
+    return fetched
+
+def ena_prefetch_uris(uris):
+    """Same as ena_prefetch for a list of URIs, keeping only run+fastq/run+submitted ones"""
+    accessions = []
+    for uri in uris:
+        m = GENERIC_REGEXP.match(uri)
+        if m and m['proto'] in ['run+fastq','run+submitted']:
+            accessions.append(m['resource'].strip('/'))
+    return ena_prefetch(accessions) if accessions else 0
 
 def _my_fastq_download(method, url, md5, destination):
     """A small adhoc function to download and check a fastq through a ftp_url plus a md5"""
@@ -553,10 +926,9 @@ def _my_fastq_download(method, url, md5, destination):
         fasp_get(f'fasp://era-fasp@{url}', destination, __retry_number__=1)
     else:
         raise FetchError(f'No such method: {method}')
-    with open(os.path.join(destination,filename),"rb") as f:
-        readable_hash = hashlib.md5(f.read()).hexdigest()
-        if readable_hash!=md5:
-            raise FetchError(f'{filename} md5: {readable_hash} does not match ENA md5 {md5}')
+    readable_hash = get_md5(os.path.join(destination,filename))
+    if readable_hash!=md5:
+        raise FetchError(f'{filename} md5: {readable_hash} does not match ENA md5 {md5}')
 
 
 @retry_if_it_fails(PUBLIC_RETRY_TIME)
@@ -566,38 +938,9 @@ def fastq_run_get(source, destination, methods=['fastq_aspera', 'fastq_ftp', 'sr
     if not destination.endswith('/'):
             destination+='/'
     uri_match = FASTQ_RUN_REGEXP.match(source).groupdict()
-    query_try = RETRY_TIME+1
-    while query_try>0:
-        while query_try>0:
-            try:
-                run_query = requests.get(f"https://www.ebi.ac.uk/ena/portal/api/filereport?\
-accession={uri_match['run_accession']}&result=read_run&fields=fastq_md5,fastq_aspera,\
-fastq_ftp,sra_md5,sra_ftp&format=json&download=true&limit=0", timeout=30)
-            except requests.Timeout:
-                query_try -= 1
-                continue
-            break
-        else:
-            log.exception('EBI does not answer our query')
-            return fastq_sra_get(uri_match['run_accession'], destination, filter_r1=filter_r1)
-        if run_query.status_code==204:
-            log.exception('This does not seem to be available on EBI')
-            return fastq_sra_get(uri_match['run_accession'], destination, filter_r1=filter_r1)
-        runs = run_query.json()
-        if len(runs)==0:
-            # it seems the new API of EBI tends to answer empty responses
-            # hoping this will change in near future
-            query_try -= 1
-            continue
-        else:
-            run=runs[0]
-            break
-    else:
-        log.exception('EBI does not answer our query')
+    run = ena_run_metadata(uri_match['run_accession'])
+    if run is None:
         return fastq_sra_get(uri_match['run_accession'], destination, filter_r1=filter_r1)
-        
-
-
 
     if 'fastq_ftp' or 'fastq_aspera' in run:
         ftp_md5s = run['fastq_md5'].split(';')
@@ -649,23 +992,9 @@ def submitted_run_get(source, destination, methods=['submitted_aspera', 'submitt
     if not destination.endswith('/'):
             destination+='/'
     uri_match = SUBMITTED_RUN_REGEXP.match(source).groupdict()
-    query_try = RETRY_TIME+1
-    while query_try>0:
-        try:
-            run_query = requests.get(f"https://www.ebi.ac.uk/ena/portal/api/filereport?\
-accession={uri_match['run_accession']}&result=read_run&fields=submitted_md5,submitted_aspera,\
-submitted_ftp&format=json&download=true&limit=0", timeout=30)
-        except requests.Timeout:
-            query_try -= 1
-            continue
-        break
-    else:
-        raise FetchError('EBI does not answer our query')
-    if run_query.status_code==204:
-        raise FetchError('This does not seem to be available on EBI')
-    run = run_query.json()[0]
-
-
+    run = ena_run_metadata(uri_match['run_accession'])
+    if run is None:
+        raise FetchError(f'EBI does not answer our query or does not know {source}')
 
     if 'submitted_ftp' or 'submitted_aspera' in run:
         ftp_md5s = run['submitted_md5'].split(';')
@@ -804,21 +1133,292 @@ def file_delete(uri):
     else:
         raise FetchError(f"Local URL did not match file://<path> pattern {uri}")
 
+class HTTPDownload:
+    """A resumable HTTP download: when the server accepts range requests the file
+    is preallocated and fetched as several ranges in parallel, the progress of each
+    range being kept in a small state file next to the destination, so that a retry
+    resumes where the previous attempt stopped instead of restarting from zero."""
+
+    def __init__(self, url, destination, connections=HTTP_PARALLEL_CONNECTIONS):
+        self.url = url
+        self.destination = destination
+        self.state_file = destination + HTTP_STATE_SUFFIX
+        self.connections = connections
+        self.lock = threading.Lock()
+        self.stale = False
+        self.size, self.validator, self.accept_ranges = self.head()
+
+    def head(self):
+        """Return size, validator (ETag or Last-Modified) and range support of the url"""
+        try:
+            r = requests.head(self.url, allow_redirects=True, timeout=HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            log.warning(f'HTTP HEAD failed for {self.url}: {e}')
+            return None, None, False
+        if r.status_code!=200:
+            return None, None, False
+        size = r.headers.get('Content-Length')
+        size = int(size) if size and size.isdigit() else None
+        # weak ETags cannot be used with If-Range
+        etag = r.headers.get('ETag')
+        validator = etag if etag and not etag.startswith('W/') else r.headers.get('Last-Modified')
+        accept_ranges = r.headers.get('Accept-Ranges','').lower()=='bytes'
+        return size, validator, accept_ranges
+
+    def load_state(self):
+        """Return the previous progress if it is still relevant, None otherwise"""
+        if not os.path.exists(self.state_file) or not os.path.exists(self.destination):
+            return None
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.validator is None or (state.get('url'),state.get('size'),state.get('validator')) \
+                !=(self.url,self.size,self.validator):
+            log.warning(f'{self.url} changed since the last attempt, restarting download')
+            return None
+        return state
+
+    def new_state(self):
+        """Split the download in ranges and preallocate the destination"""
+        parts = self.connections if self.size>=HTTP_PARALLEL_MIN_SIZE else 1
+        part_size = -(-self.size//parts)
+        ranges = [[start, min(start+part_size, self.size)-1, 0] 
+                    for start in range(0, self.size, part_size)]
+        with open(self.destination, 'wb') as f:
+            f.truncate(self.size)
+        return {'url':self.url, 'size':self.size, 'validator':self.validator, 'ranges':ranges}
+
+    def save_state(self):
+        """Persist the progress of the ranges (atomically)"""
+        with self.lock:
+            if self.stale:
+                return
+            with open(self.state_file+'.tmp', 'w') as f:
+                json.dump(self.state, f)
+            os.replace(self.state_file+'.tmp', self.state_file)
+
+    def get_range(self, index):
+        """Download the remaining part of a range at its position in destination"""
+        start, end, done = self.state['ranges'][index]
+        if start+done>end:
+            return
+        headers = {'Range': f'bytes={start+done}-{end}'}
+        if self.validator:
+            headers['If-Range'] = self.validator
+        with requests.get(self.url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as r:
+            r.raise_for_status()
+            if r.status_code!=206:
+                # If-Range did not match: the resource changed under our feet
+                self.remove_state()
+                raise FetchError(f'{self.url} changed during download or stopped honoring range requests')
+            etag = r.headers.get('ETag')
+            if etag and self.validator and etag!=self.validator and self.validator.startswith('"'):
+                self.remove_state()
+                raise FetchError(f'{self.url} ETag changed during download ({self.validator} -> {etag})')
+            position = start+done
+            unsaved = 0
+            try:
+                with open(self.destination, 'r+b') as f:
+                    f.seek(position)
+                    for chunk in r.iter_content(chunk_size=HTTP_CHUNK_SIZE):
+                        chunk = chunk[:end+1-position]
+                        f.write(chunk)
+                        position += len(chunk)
+                        unsaved += len(chunk)
+                        with self.lock:
+                            self.state['ranges'][index][2] = position-start
+                        if unsaved>=HTTP_STATE_SAVE_SIZE:
+                            f.flush()
+                            self.save_state()
+                            unsaved = 0
+                        if position>end:
+                            break
+            finally:
+                self.save_state()
+        if position<=end:
+            raise FetchError(f'{self.url} range {start}-{end} ended prematurely at {position}')
+
+    def remove_state(self):
+        """Forget the progress so that next attempt restarts from scratch"""
+        with self.lock:
+            self.stale = True
+            if os.path.exists(self.state_file):
+                os.remove(self.state_file)
+
+    def stream(self):
+        """Plain single connection download, when ranges are not available"""
+        with requests.get(self.url, stream=True, timeout=HTTP_TIMEOUT) as r:
+            r.raise_for_status()
+            expected_size = r.headers.get('Content-Length') if 'Content-Encoding' not in r.headers else None
+            with open(self.destination, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=HTTP_CHUNK_SIZE):
+                    f.write(chunk)
+        if expected_size and expected_size.isdigit():
+            self.check_size(int(expected_size))
+
+    def check_ranges(self):
+        """Raise a FetchError if some range is not complete (the destination is preallocated, so
+        its size tells nothing)"""
+        for start, end, done in self.state['ranges']:
+            if start+done<=end:
+                raise FetchError(f'{self.url} range {start}-{end} is incomplete ({done} bytes done)')
+
+    def check_size(self, size):
+        """Raise a FetchError if destination is not of the expected size"""
+        actual_size = os.path.getsize(self.destination)
+        if actual_size!=size:
+            raise FetchError(f'{self.url} downloaded size {actual_size} differs from expected {size}')
+
+    def run(self):
+        """Download the url to destination"""
+        if not self.accept_ranges or not self.size:
+            log.info(f'HTTP downloading {self.url} in a single stream')
+            self.stream()
+            return
+        self.state = self.load_state()
+        if self.state is None:
+            self.state = self.new_state()
+        else:
+            log.info(f'HTTP resuming download of {self.url}')
+        self.save_state()
+        ranges = len(self.state['ranges'])
+        log.info(f'HTTP downloading {self.url} using {ranges} connection(s)')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=ranges) as executor:
+            for job in [executor.submit(self.get_range, i) for i in range(ranges)]:
+                job.result()
+        self.check_ranges()
+        self.remove_state()
+
 @retry_if_it_fails(PUBLIC_RETRY_TIME)
-def http_get(url, destination):
+def _http_get(url, destination, connections=HTTP_PARALLEL_CONNECTIONS):
+    """One attempt of http_get(), resuming the previous one if possible"""
+    HTTPDownload(url, destination, connections=connections).run()
+
+def http_get(url, destination, connections=HTTP_PARALLEL_CONNECTIONS):
     """HTTP downloader: download source expressed as http(s)://host/path_to_file 
-    to destination - a local file path"""
+    to destination - a local file path. Large files are fetched with parallel range 
+    requests when the server supports them, and a failed download is resumed on retry"""
     destination=complete_if_ends_with_slash(url, destination)
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(destination, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=HTTP_CHUNK_SIZE): 
-                # If you have chunk encoded response uncomment if
-                # and set chunk_size parameter to None.
-                #if chunk: 
-                f.write(chunk)
+    try:
+        _http_get(url, destination, connections=connections)
+    except Exception:
+        # no more retry: the state and the preallocated (incomplete) destination must not stay behind
+        state_file = destination + HTTP_STATE_SUFFIX
+        if os.path.exists(state_file):
+            os.remove(state_file)
+            if os.path.exists(destination):
+                os.remove(destination)
+        raise
+
+
+
+# streaming
+
+STREAMABLE_PROTOCOLS = ['ftp','file','http','https']
+
+def is_streamable(proto):
+    """Return True if objects of this protocol can be read or written as a stream"""
+    return proto in STREAMABLE_PROTOCOLS or rclone_client.has_source(proto)
+
+@contextmanager
+def open_stream(uri):
+    """Open a remote object (without action) as a binary stream for reading"""
+    proto = uri.split('://')[0]
+    if proto=='file':
+        with open(get_file_uri(uri), 'rb') as f:
+            yield f
+    elif proto in ['http','https']:
+        with requests.get(uri, stream=True, timeout=HTTP_TIMEOUT) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            yield r.raw
+    elif proto=='ftp':
+        uri_match = FTP_REGEXP.match(uri).groupdict()
+        with ftp_pool.connection(uri_match['host']) as ftp:
+            ftp.voidcmd('TYPE I')
+            with ftp.transfercmd(f"RETR {uri_match['path']}") as connection:
+                with connection.makefile('rb') as f:
+                    yield f
+            ftp.voidresp()
+    elif rclone_client.has_source(proto):
+        cat = subprocess.Popen(['rclone','cat',rclone_client._uri(uri)], stdout=subprocess.PIPE)
+        try:
+            yield cat.stdout
+        finally:
+            cat.stdout.close()
+            if cat.wait()!=0:
+                raise FetchError(f'Could not read {uri} (rclone cat returned {cat.returncode})')
+    else:
+        raise UnsupportedError(f'Streaming is not supported for {uri}')
+
+def put_stream(stream, uri):
+    """Write a binary stream to a remote object (the stream is read until its end)"""
+    proto = uri.split('://')[0]
+    if proto=='file':
+        path = get_file_uri(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, STREAM_CHUNK_SIZE)
+    elif proto=='ftp':
+        uri_match = FTP_REGEXP.match(uri).groupdict()
+        with ftp_pool.connection(uri_match['host']) as ftp:
+            ftp.storbinary(f"STOR {uri_match['path']}", stream)
+    elif rclone_client.has_source(proto):
+        subprocess.run(['rclone','rcat',rclone_client._uri(uri)], stdin=stream, check=True)
+    else:
+        raise UnsupportedError(f'Streaming is not supported for {uri}')
+    listing_cache.invalidate(uri)
 
+@retry_if_it_fails(RETRY_TIME)
+def get_untar(uri, destination_folder):
+    """Extract a remote archive (or all the archives of a remote folder, keeping their relative
+    path, other files of the folder being simply downloaded) into destination_folder, streaming 
+    the archives directly into tar"""
+    archives = []
+    if uri.endswith('/'):
+        for item in list_content(uri):
+            if is_archive(item.rel_name):
+                archives.append((item.name, os.path.dirname(item.rel_name)))
+            elif not item.rel_name.endswith('/'):
+                destination = os.path.join(destination_folder, item.rel_name)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                get(item.name, destination)
+    else:
+        archives.append((uri, ''))
+    for archive, rel_path in archives:
+        log.info(f'Streaming {archive} into {os.path.join(destination_folder, rel_path)}')
+        with open_stream(archive) as stream:
+            untar_stream(stream, os.path.join(destination_folder, rel_path), archive)
+
+@retry_if_it_fails(RETRY_TIME)
+def get_decompressed(uri, destination, action):
+    """Download a remote compressed file decompressing it on the fly (the compression suffix is
+    removed from the destination name, like gunzip does)"""
+    command, suffix = DECOMPRESSION_ACTIONS[action]
+    if destination.endswith(suffix):
+        destination = destination[:-len(suffix)]
+    log.info(f'Streaming {uri} into {destination}')
+    with open_stream(uri) as stream:
+        decompress_stream(stream, destination, command)
 
+@retry_if_it_fails(RETRY_TIME)
+def put_packed(source_folder, uri):
+    """Pack a local folder as a tar.zst archive streamed directly to uri (no local archive is created),
+    the archive containing the folder itself (not only its content)"""
+    log.info(f'Packing {source_folder} to {uri}')
+    parent, name = os.path.split(source_folder.rstrip('/'))
+    tar = subprocess.Popen(['tar','cf','-','-C',parent,name], stdout=subprocess.PIPE)
+    zstd = subprocess.Popen(['zstd','-q','-T0','-c'], stdin=tar.stdout, stdout=subprocess.PIPE)
+    tar.stdout.close()
+    try:
+        put_stream(zstd.stdout, uri)
+    finally:
+        zstd.stdout.close()
+        returncodes = [tar.wait(), zstd.wait()]
+    if any(returncodes):
+        raise FetchError(f'Could not pack {source_folder} (return codes {returncodes})')
 
 # generic wrapper
 
@@ -856,6 +1456,16 @@ def get(uri, destination, parallel=None, show_progress=False):
         else:
             options=[]
         
+        if m['action']=='untar' and not options and is_streamable(m['proto']) and \
+                (m['resource'].endswith('/') or is_archive(m['resource'])):
+            # archives are extracted on the fly, there is no temporary copy
+            get_untar(source, complete_destination_folder)
+            return
+        if m['action'] in DECOMPRESSION_ACTIONS and not options and is_streamable(m['proto']) and \
+                not m['resource'].endswith('/'):
+            get_decompressed(source, complete_destination, m['action'])
+            return
+
         if 'aria2' in options:
             aria2_get(source, complete_destination)
 
@@ -897,8 +1507,10 @@ def get(uri, destination, parallel=None, show_progress=False):
                 raise FetchError(f"This URI protocol is not supported: {m['proto']}")        
         if m['action'] and m['action'].startswith('mv'):
             pass
-        elif m['action']=='gunzip':
+        elif m['action'] in ['gunzip','pigz']:
             gunzip(complete_destination)
+        elif m['action']=='zstd':
+            unzstd(complete_destination)
         elif m['action']=='untar':
             untar(complete_destination)
         elif m['action']=='unzip':
@@ -908,6 +1520,180 @@ def get(uri, destination, parallel=None, show_progress=False):
     else:
         raise FetchError(f'This URI is malformed: {uri}')
 
+class ListingCache:
+    """A process level (and optionally on disk, thus shared between processes) cache for
+    info and list_content answers on remote URIs, entries expiring after ttl seconds.
+    Entries are invalidated by prefix when something is put or deleted in a URI, expired entries
+    are dropped when read and by a purge of the whole cache done at most once per ttl.
+    On disk, entries of a URI are stored in a folder tree mirroring the URI path, so that
+    invalidation only looks at the folders of the URI parents and removes the URI subtree."""
+
+    def __init__(self, ttl=FETCH_CACHE_TTL, cache_dir=FETCH_CACHE_DIR):
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.last_purge = time()
+        if self.ttl and self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def enabled_for(self, uri):
+        """Local objects are not cached"""
+        return self.ttl>0 and get_file_uri(uri) is None and not uri.startswith('file://')
+
+    @staticmethod
+    def encode(answer):
+        """Transform a Namespace or a list of Namespace to JSON compatible data"""
+        if isinstance(answer, list):
+            return [ListingCache.encode(item) for item in answer]
+        return {k:v.isoformat() if isinstance(v, datetime.datetime) else v 
+                for k,v in vars(answer).items()}
+
+    @staticmethod
+    def decode(data):
+        """Reverse of encode, always creating new objects"""
+        if isinstance(data, list):
+            return [ListingCache.decode(item) for item in data]
+        return argparse.Namespace(**{k:datetime.datetime.fromisoformat(v) if k in FETCH_CACHE_DATE_FIELDS and v else v
+                                     for k,v in data.items()})
+
+    @staticmethod
+    def key(kind, uri, params):
+        return json.dumps([kind, uri.rstrip('/'), sorted(params.items())])
+
+    @staticmethod
+    def _parts(uri):
+        """The folder names of an URI, each part being quoted so that entry files (starting
+        with #) cannot collide with a part"""
+        return [quote(part, safe='').replace('.','%2E') if part in ['.','..'] else quote(part, safe='')
+                    for part in uri.rstrip('/').split('/') if part]
+
+    def _folder(self, uri):
+        """The folder of the entries of an URI"""
+        return os.path.join(self.cache_dir, *self._parts(uri))
+
+    def _path(self, key):
+        return os.path.join(self._folder(json.loads(key)[1]), '#'+hashlib.sha1(key.encode()).hexdigest()+'.json')
+
+    def _read(self, key):
+        """Return the (date, data) of a key or None, dropping the entry if it has expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None and self.cache_dir:
+            try:
+                with open(self._path(key)) as f:
+                    entry = json.load(f)['entry']
+            except (OSError, ValueError, KeyError):
+                return None
+        if entry is not None and time()-entry[0]>=self.ttl:
+            with self.lock:
+                self.entries.pop(key, None)
+            if self.cache_dir:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            return None
+        return entry
+
+    def get(self, kind, uri, **params):
+        """Return a cached answer or None, an md5 answer being good for a non md5 query"""
+        candidates = [params] if params.get('md5') else [params, dict(params, md5=True)]
+        for candidate in candidates:
+            entry = self._read(self.key(kind, uri, candidate))
+            if entry:
+                return self.decode(entry[1])
+        return None
+
+    def set(self, kind, uri, answer, **params):
+        """Store an answer"""
+        key = self.key(kind, uri, params)
+        entry = [time(), self.encode(answer)]
+        with self.lock:
+            self.entries[key] = entry
+        if time()-self.last_purge>=self.ttl:
+            self.purge()
+        if self.cache_dir:
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), prefix='#', suffix='.tmp', 
+                                                 delete=False) as f:
+                    json.dump({'uri':uri.rstrip('/'), 'entry':entry}, f)
+                os.replace(f.name, path)
+            except OSError:
+                # the folder may have been invalidated by another process meanwhile
+                log.info(f'Could not cache the answer for {uri}')
+
+    def purge(self):
+        """Drop all expired entries (on disk, files are dated by their modification time)"""
+        now = time()
+        with self.lock:
+            self.last_purge = now
+            for key, entry in list(self.entries.items()):
+                if now-entry[0]>=self.ttl:
+                    del self.entries[key]
+        if self.cache_dir:
+            for folder, _, files in os.walk(self.cache_dir, topdown=False):
+                for name in files:
+                    path = os.path.join(folder, name)
+                    try:
+                        if name.startswith('#') and now-os.path.getmtime(path)>=self.ttl:
+                            os.remove(path)
+                    except OSError:
+                        pass
+                if folder!=self.cache_dir:
+                    try:
+                        # only empty folders can be removed
+                        os.rmdir(folder)
+                    except OSError:
+                        pass
+
+    @staticmethod
+    def _related(cached_uri, uri):
+        """True if a change in uri may change an answer about cached_uri (or conversely)"""
+        return cached_uri==uri or uri.startswith(cached_uri+'/') or cached_uri.startswith(uri+'/')
+
+    def invalidate(self, uri):
+        """Drop all entries of an URI, its parent folders and its content (a local destination,
+        which is never cached, costs nothing)"""
+        if not self.enabled_for(uri):
+            return
+        m = GENERIC_REGEXP.match(uri)
+        if m:
+            uri = f"{m['proto']}://{m['resource']}"
+        uri = uri.rstrip('/')
+        with self.lock:
+            for key in list(self.entries):
+                if self._related(json.loads(key)[1], uri):
+                    del self.entries[key]
+        if self.cache_dir:
+            parts = self._parts(uri)
+            # the URI itself and its content
+            shutil.rmtree(os.path.join(self.cache_dir, *parts), ignore_errors=True)
+            # the parents of the URI
+            for i in range(1, len(parts)):
+                try:
+                    for entry in os.scandir(os.path.join(self.cache_dir, *parts[:i])):
+                        if entry.name.startswith('#') and entry.name.endswith('.json'):
+                            os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """Drop all entries"""
+        with self.lock:
+            self.entries = {}
+        if self.cache_dir:
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                elif entry.name.endswith('.json'):
+                    os.remove(entry.path)
+
+# work as a singleton
+listing_cache = ListingCache()
+
 def put(source, uri, parallel=None, show_progress=False):
     """General uploader destination should start with s3://.... or ftp://...
     (only anonymous ftp is implemented so put is unlikely to work with ftp)
@@ -936,10 +1722,30 @@ def put(source, uri, parallel=None, show_progress=False):
                 rclone_client.copy(source, destination, show_progress=show_progress)
             else:
                 raise FetchError(f"This URI proto is not supported: {m['proto']}")
+        listing_cache.invalidate(destination)
     else:
         raise FetchError(f'This URI is malformed: {uri}')
 
 
+def put_files(source_folder, files, uri, show_progress=False):
+    """Bulk uploader: upload a list of files (relative to source_folder) to uri folder,
+    keeping their relative path. This is done in a single transfer for rclone remotes
+    (rather than one process per file), file by file with put otherwise."""
+    proto = check_uri(uri)
+    if rclone_client.has_source(proto):
+        rclone_client.copy_files(source_folder, uri, files, show_progress=show_progress)
+    else:
+        for file in files:
+            put(os.path.join(source_folder, file), pathjoin(uri, os.path.dirname(file) or '.', '/'), 
+                show_progress=show_progress)
+
+def supports_put_files(uri):
+    """Return True if put_files does a real bulk transfer for this uri"""
+    try:
+        return rclone_client.has_source(check_uri(uri))
+    except FetchError:
+        return False
+
 def delete(uri):
     """General deleter for a URI."""
     m = GENERIC_REGEXP.match(uri)
@@ -954,6 +1760,7 @@ def delete(uri):
                 rclone_client.delete(uri)
             else:
                 raise FetchErrorNoRepeat(f"This URI proto is not supported: {m['proto']}")
+        listing_cache.invalidate(uri)
     else:
         raise FetchErrorNoRepeat(f'This URI is malformed: {uri}')
 
@@ -996,23 +1803,29 @@ def info(uri, md5=False):
         if '@' in proto:
             # get rid of protocol options like @aria2
             proto = proto.split('@')[0]
-        #if proto=='s3':
-        #    return s3_info(source, md5=md5)
-        #elif proto=='azure':
-        #    return AzureClient().info(source, md5=md5) 
-        if proto=='ftp':
-            return ftp_info(source,md5=md5)
-        elif proto=='file':
-            return file_info(source, md5=md5) 
-        #elif m['proto']=='fasp':
-        #    fasp_get(source, destination)
-        #elif m['proto']=='run+fastq':
-        #    fastq_run_get(source, destination)       
+        if listing_cache.enabled_for(source):
+            answer = listing_cache.get('info', source, md5=md5)
+            if answer is None:
+                answer = _info(source, proto, md5=md5)
+                listing_cache.set('info', source, answer, md5=md5)
+            return answer
+        return _info(source, proto, md5=md5)
+
+def _info(source, proto, md5=False):
+    """Uncached part of info()"""
+    #if proto=='s3':
+    #    return s3_info(source, md5=md5)
+    #elif proto=='azure':
+    #    return AzureClient().info(source, md5=md5) 
+    if proto=='ftp':
+        return ftp_info(source,md5=md5)
+    elif proto=='file':
+        return file_info(source, md5=md5) 
+    else:
+        if rclone_client.has_source(proto):
+            return rclone_client.info(source, md5=md5)
         else:
-            if rclone_client.has_source(proto):
-                return rclone_client.info(source, md5=md5)
-            else:
-                raise UnsupportedError(f"This URI protocol is not supported: {m['proto']}")
+            raise UnsupportedError(f"This URI protocol is not supported: {proto}")
 
 def list_content(uri, no_rec=False, md5=False):
     """Return the recursive listing of folder specified as a URI
@@ -1024,26 +1837,32 @@ def list_content(uri, no_rec=False, md5=False):
     if m:
         m = m.groupdict()
         source = f"{m['proto']}://{m['resource']}"
-        #if m['proto']=='s3':
-        #    return s3_list(source, no_rec=no_rec, md5=md5)
-        #elif m['proto']=='azure':
-        #    return AzureClient().list(source, no_rec=no_rec, md5=md5) 
-        if m['proto']=='ftp':
-            return ftp_list(source, no_rec=no_rec,md5=md5)
-        elif m['proto']=='file':
-            return file_list(source, no_rec=no_rec,md5=md5) 
-        #elif m['proto']=='fasp':
-        #    fasp_get(source, destination)
-        #elif m['proto']=='run+fastq':
-        #    fastq_run_get(source, destination)       
-        else:
-            if rclone_client.has_source(m['proto']):
-                return rclone_client.list(source, no_rec=no_rec, md5=md5)
-            else:
-                raise UnsupportedError(f"This URI protocol is not supported: {m['proto']}")
+        if listing_cache.enabled_for(source):
+            answer = listing_cache.get('list', source, no_rec=no_rec, md5=md5)
+            if answer is None:
+                answer = _list_content(source, m['proto'], no_rec=no_rec, md5=md5)
+                listing_cache.set('list', source, answer, no_rec=no_rec, md5=md5)
+            return answer
+        return _list_content(source, m['proto'], no_rec=no_rec, md5=md5)
     else:
         return []
 
+def _list_content(source, proto, no_rec=False, md5=False):
+    """Uncached part of list_content()"""
+    #if proto=='s3':
+    #    return s3_list(source, no_rec=no_rec, md5=md5)
+    #elif proto=='azure':
+    #    return AzureClient().list(source, no_rec=no_rec, md5=md5) 
+    if proto=='ftp':
+        return ftp_list(source, no_rec=no_rec,md5=md5)
+    elif proto=='file':
+        return file_list(source, no_rec=no_rec,md5=md5) 
+    else:
+        if rclone_client.has_source(proto):
+            return rclone_client.list(source, no_rec=no_rec, md5=md5)
+        else:
+            raise UnsupportedError(f"This URI protocol is not supported: {proto}")
+
 def ncdu(uri, output_file):
     """Return a JSON list in the format that ncdu accept with -f"""
 
@@ -1090,96 +1909,139 @@ def ncdu(uri, output_file):
                 top_folder.ncdu_object()],
               output_file)
 
-def sync(uri1, uri2, include=[], process=MAX_PARALLEL_SYNC, show_progress=False):
-    """Sync two URI, one must be local
-    Identity of the files is assessed only with name and size
+def sync_manifest_file(uri1, uri2):
+    """Where the manifest of a sync between two URI is persisted"""
+    return os.path.join(SYNC_MANIFEST_DIR, 
+                        hashlib.sha1(f'{uri1} {uri2}'.encode()).hexdigest()+'.json')
+
+def local_manifest(path, previous={}):
+    """Return a manifest (a dict rel_name -> {size, mtime, md5}) of a local folder,
+    reusing md5 from previous manifest for files that did not change"""
+    manifest = {}
+    for dir_path,_,files in os.walk(path):
+        for file in files:
+            complete_file = os.path.join(dir_path, file)
+            rel_name = os.path.relpath(complete_file, path)
+            stat = os.stat(complete_file)
+            entry = {'size':stat.st_size, 'mtime':stat.st_mtime, 'md5':None}
+            old_entry = previous.get(rel_name)
+            if old_entry and (old_entry['size'],old_entry['mtime'])==(entry['size'],entry['mtime']):
+                entry['md5'] = old_entry['md5']
+            manifest[rel_name] = entry
+    return manifest
+
+def remote_manifest(uri, md5=False):
+    """Return a manifest (a dict rel_name -> {size, md5}) of a remote folder"""
+    return { item.rel_name:{'size':item.size, 'md5':item.md5} 
+                for item in list_content(uri, md5=md5) if not item.rel_name.endswith('/') }
+
+def manifest_md5(manifest, rel_name, local_path=None):
+    """Return the md5 of an item of a manifest, computing it if this is a local manifest"""
+    entry = manifest[rel_name]
+    if entry['md5'] is None and local_path is not None:
+        entry['md5'] = get_md5(os.path.join(local_path, rel_name))
+    return entry['md5']
+
+def manifest_differ(source, destination, rel_name, md5=False, local_path1=None, local_path2=None):
+    """Tell if an item of source manifest should be copied to destination: if it is missing there,
+    if sizes differ, or if md5 is True and md5 differ (when both sides have one, some remotes like 
+    FTP give no md5, then size only is used)"""
+    if rel_name not in destination or destination[rel_name]['size']!=source[rel_name]['size']:
+        return True
+    if not md5:
+        return False
+    # look first at the side without local path: its md5 is known (or missing) without computing anything
+    sides = sorted([(source, local_path1), (destination, local_path2)], key=lambda side: side[1] is not None)
+    md5s = []
+    for manifest, local_path in sides:
+        item_md5 = manifest_md5(manifest, rel_name, local_path)
+        if item_md5 is None:
+            return False
+        md5s.append(item_md5)
+    return md5s[0]!=md5s[1]
+
+def sync(uri1, uri2, include=[], process=MAX_PARALLEL_SYNC, show_progress=False, md5=False):
+    """Sync two URI, copying from uri1 to uri2 what is missing or different (never deleting)
+    Identity of the files is assessed with name and size, plus md5 if md5 is True and both sides
+    have one (local md5 are kept in a persisted manifest so that they are computed only once)
+    Transfers are done in one rclone call when possible, else in parallel (process threads)
     """
-    local_uri = get_file_uri(uri1)
-    if local_uri is not None:
-        command = put
-        remote = uri2
-        try:
-            proto2=check_uri(uri2)
-            remote_proto=proto2
-        except FetchError:
-            local_uri=get_file_uri(uri2)
-            if local_uri is None:
-                raise UnsupportedError(f'uri2 appears to be neither locale nor proper: {uri2}')
-            else:
-                rclone_client.sync(uri1, uri2, show_progress=show_progress, include=include)
-                #command=get
-                #remote=uri1 if ':' in uri1 else f'file://{uri1}'
-    else:
+    local_path1 = get_file_uri(uri1)
+    local_path2 = get_file_uri(uri2)
+    proto1 = 'file' if local_path1 is not None else check_uri(uri1)
+    proto2 = 'file' if local_path2 is not None else check_uri(uri2)
+    if local_path1 is not None and local_path2 is not None:
+        return rclone_client.sync(uri1, uri2, show_progress=show_progress, include=include)
+    if local_path1 is None and local_path2 is None and \
+            not (rclone_client.has_source(proto1) and rclone_client.has_source(proto2)):
+        raise UnsupportedError('Neither URI seems to be local nor supported remotes, unsupported yet')
+    if local_path2 is not None:
+        os.makedirs(local_path2, exist_ok=True)
+
+    manifest_file = sync_manifest_file(uri1, uri2)
+    previous = {}
+    if os.path.exists(manifest_file):
         try:
-            proto1=check_uri(uri1)
-            remote_proto=proto1
-        except FetchError:
-            raise UnsupportedError(f'Destination URI seems illdefined: {uri1}')
-        local_uri=get_file_uri(uri2)
-        if local_uri is None:
-            try:
-                proto2=check_uri(uri2)
-            except FetchError:
-                raise UnsupportedError(f'Destination URI seems illdefined: {uri2}') 
-            if rclone_client.has_source(proto2) and rclone_client.has_source(proto1):
-                return rclone_client.sync(uri1, uri2, show_progress=show_progress, include=include)                
-            else:
-                raise UnsupportedError('Neither URI seems to be local nor supported remotes, unsupported yet')
+            with open(manifest_file) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            log.warning(f'Could not read sync manifest {manifest_file}, ignoring it')
+    source = local_manifest(local_path1, previous.get('source',{})) if local_path1 is not None \
+                else remote_manifest(uri1, md5=md5)
+    destination = local_manifest(local_path2, previous.get('destination',{})) if local_path2 is not None \
+                else remote_manifest(uri2, md5=md5)
+
+    to_copy = []
+    for rel_name in sorted(source):
+        if include and not any(fnmatch(rel_name, inc) for inc in include):
+            continue
+        if manifest_differ(source, destination, rel_name, md5=md5, local_path1=local_path1, local_path2=local_path2):
+            to_copy.append(rel_name)
+
+    failed = False
+    if to_copy:
+        log.warning(f'Copying {len(to_copy)} file(s) from {uri1} to {uri2}')
+        if rclone_client.has_source(proto1) or rclone_client.has_source(proto2):
+            rclone_client.copy_files(uri1, uri2, to_copy, show_progress=show_progress)
         else:
-            return rclone_client.sync(uri1, uri2, show_progress=show_progress, include=include)
-        #command=get
-        #remote=uri1
-    
-    if rclone_client.has_source(remote_proto):
-        return rclone_client.sync(uri1, uri2, show_progress=show_progress, include=include)
-    else:
-        full_local_uri=f"file://{local_uri}"
-        if not os.path.exists(local_uri):
-            os.makedirs(local_uri, exist_ok=True)
-        
-
-        local_list = dict([(item.rel_name,item) for item in list_content(full_local_uri)])
-        remote_list = dict([(item.rel_name,item) for item in list_content(remote)])
+            jobs = {}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=process) as executor:
+                for rel_name in to_copy:
+                    if local_path1 is not None:
+                        jobs[executor.submit(put, os.path.join(local_path1, rel_name), 
+                                             os.path.join(uri2, rel_name))]=rel_name
+                    else:
+                        os.makedirs(os.path.dirname(os.path.join(local_path2, rel_name)), exist_ok=True)
+                        jobs[executor.submit(get, os.path.join(uri1, rel_name), 
+                                             os.path.join(local_path2, rel_name))]=rel_name
+            for job in concurrent.futures.as_completed(jobs):
+                rel_name = jobs[job]
+                if job.exception() is None:
+                    log.info(f'Done for {rel_name}')
+                else:
+                    log.error(f'Could not copy {rel_name}')
+                    log.exception(job.exception())
+                    failed = True
+        if local_path2 is not None:
+            destination = local_manifest(local_path2, destination)
+            if not failed:
+                # what was just copied has the md5 of the source
+                for rel_name in to_copy:
+                    if rel_name in destination and source[rel_name]['md5']:
+                        destination[rel_name]['md5'] = source[rel_name]['md5']
+        listing_cache.invalidate(uri2)
 
-        if command==get:
-            source_list=remote_list
-            dest_list=local_list
-            source_uri=remote
-            dest_uri=local_uri
-        else:
-            source_list=local_list
-            dest_list=remote_list
-            source_uri=local_uri
-            dest_uri=remote
+    try:
+        os.makedirs(SYNC_MANIFEST_DIR, exist_ok=True)
+        with open(manifest_file+'.tmp','w') as f:
+            json.dump({'source':source if local_path1 is not None else {},
+                       'destination':destination if local_path2 is not None else {}}, f)
+        os.replace(manifest_file+'.tmp', manifest_file)
+    except OSError:
+        log.warning(f'Could not save sync manifest {manifest_file}')
 
-        jobs = {}
-        with concurrent.futures.ProcessPoolExecutor(max_workers=process) as executor:
-            for item_name, item in source_list.items():
-                if item_name not in dest_list or \
-                        dest_list[item_name].size!=item.size:
-                    if include:
-                        for inc in include:
-                            if fnmatch(item_name, inc):
-                                break
-                        else:
-                            continue
-                    log.warning(f'Copying {os.path.join(source_uri, item_name)} to {os.path.join(dest_uri, item_name)}')
-                    jobs[executor.submit(command, 
-                                    os.path.join(source_uri, item_name),
-                                    os.path.join(dest_uri, item_name))]=item_name
-        
-        failed = False
-        for job in concurrent.futures.as_completed(jobs):
-            item_name = jobs[job]
-            if job.exception() is None:
-                log.info(f'Done for {item_name}: {job.result()}')
-            else:
-                log.error(f'Could not download {item_name}')
-                log.exception(job.exception())
-                failed = True
-        
-        if failed:
-            raise FetchError('At least some objects could not be synchronized')
+    if failed:
+        raise FetchError('At least some objects could not be synchronized')
 
 def recursive_delete(uri, include=[], dryrun=False):
     """Works the same way than sync, recursively deleting some objects from uri"""
@@ -1218,10 +2080,13 @@ def recursive_delete(uri, include=[], dryrun=False):
                 log.exception(job.exception())
                 failed = True
 
+        listing_cache.invalidate(uri)
         if failed:
             raise FetchError('At least some objects could not be deleted')
 
 def copy(source_uri, destination_uri, show_progress=False, file_list=None):
+        source_uri,_ = split_action(source_uri)
+        destination_uri,_ = split_action(destination_uri)
         candidate_source = get_file_uri(source_uri)
         candidate_destination = get_file_uri(destination_uri)
         proto_source = None if candidate_source else check_uri(source_uri)
@@ -1277,12 +2142,16 @@ one of them must be a file URI (starts with file://... or be a simple path)''')
     nrlist_parser.add_argument('--md5', action="store_true", help="Fetch also md5")
     nrlist_parser.add_argument('uri', type=str, help='the remote folder uri')
 
-    sync_parser = subparser.add_parser('sync', help='Sync some file or folder to some folder (one of them must be local) (identity is checked using name and size)')
+    sync_parser = subparser.add_parser('sync', help='Sync some file or folder to some folder (identity is checked using name and size, and optionally md5)')
     sync_parser.add_argument('source_uri', type=str, help='the uri (can be a local file or a remote URI)')
     sync_parser.add_argument('destination_uri', type=str,
                         help='the destination uri (same as above, default to ., means download locally)', default=os.getcwd())
     sync_parser.add_argument('--include',action='append',type=str,
                         help="A pattern that should be included (only those will be synced) (can be specified several times)")
+    sync_parser.add_argument('--md5',action='store_true',
+                        help="Compare also md5 (when sizes are the same)")
+    sync_parser.add_argument('--process',type=int,default=MAX_PARALLEL_SYNC,
+                        help=f"How many parallel transfers when rclone is not used (default to {MAX_PARALLEL_SYNC})")
     
 
     delete_parser = subparser.add_parser('delete', help='Delete some file or folder expressed as a URI')
@@ -1339,7 +2208,7 @@ one of them must be a file URI (starts with file://... or be a simple path)''')
             tablefmt='plain'
         ))
     elif args.command=='sync':
-        sync(args.source_uri, args.destination_uri, include=args.include, process=args.process, show_progress=True)
+        sync(args.source_uri, args.destination_uri, include=args.include, process=args.process, show_progress=True, md5=args.md5)
     elif args.command=='delete':
         recursive_delete(args.uri, include=args.include, dryrun=args.dryrun)
     elif args.command=='ncdu':
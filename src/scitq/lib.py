@@ -9,14 +9,17 @@ from argparse import Namespace
 import logging as log
 import time
 import os
-from .util import filter_none as _clean, validate_protofilter
-from .constants import FLAVOR_DEFAULT_EVICTION, FLAVOR_DEFAULT_LIMIT, TASK_STATUS_ID_REVERSE, TASK_STATUS, DEFAULT_SERVER
+from .util import filter_none as _clean, validate_protofilter, from_columns
+from .constants import FLAVOR_DEFAULT_EVICTION, FLAVOR_DEFAULT_LIMIT, TASK_STATUS_ID_REVERSE, TASK_STATUS, DEFAULT_SERVER, COLUMNS_MIMETYPE
 
 PUT_TIMEOUT = 30
 GET_TIMEOUT = 150
 QUERY_THREAD_TIMEOUT = 10
 QUERY_THREAD_IDLE_TIMEOUT = 60
-JOIN_DYNAMIC_SLEEP_TIME_INCREMENT = 10
+JOIN_CHANGES_INTERVAL = 10
+# ask for compact column-oriented lists, plain JSON is still accepted (gzip is negotiated by requests)
+GET_HEADERS = {'Accept': f'{COLUMNS_MIMETYPE}, application/json;q=0.9'}
+LIST_PAGE_SIZE = 1000
 
 def _parse_date_andco(item):
     """A custom filter to transform JSON date (i.e. date in ISO formated text) 
@@ -61,6 +64,8 @@ def _filter_non200(r):
         raise HTTPException(f'Error {r.status_code}: {message}', 
                 message=message, 
                 status_code=r.status_code)
+    if r.headers.get('Content-Type','').startswith(COLUMNS_MIMETYPE):
+        return from_columns(r.json())
     return r.json()
 class LazyObject:
     """A lazy object or dict initialized with a queue.Queue 
@@ -199,7 +204,7 @@ class Server:
         return the objects according to Server style (see style in class doc)"""
         try:
             return (wrap or self._wrap)(requests.get(
-                self.url+url, timeout=self.get_timeout, json=args
+                self.url+url, timeout=self.get_timeout, json=args, headers=GET_HEADERS
             ))
         except (ConnectionError,Timeout,HTTPException) as e:
             if hasattr(e,'status_code') and e.status_code!=403:
@@ -209,6 +214,22 @@ class Server:
             sleep(self.get_timeout)
             return self.get(url, **args)
 
+    def paginate(self, url, id_attribute, page_size=LIST_PAGE_SIZE, **args):
+        """A generator wrapping a get operation on a paginated (after_id/limit) listing,
+        yielding objects one by one while fetching them page by page.
+        - url: extra string to add after base server URL
+        - id_attribute: the key used as pagination cursor (e.g. task_id)
+        - page_size: the number of objects fetched in each query"""
+        after_id = None
+        while True:
+            if after_id is not None:
+                args['after_id'] = after_id
+            page = self.get(url, limit=page_size, **args)
+            yield from page
+            if len(page)<page_size:
+                break
+            after_id = page[-1][id_attribute] if self.style=='dict' else getattr(page[-1],id_attribute)
+
     def put(self,url, data, asynchronous=None, timeout=None):
         """A wrapper used for all put operations.
         - url: extra string to add after base server URL
@@ -334,11 +355,29 @@ class Server:
         return the worker"""
         return self.get(f'/workers/{id}')
 
-    def worker_ping(self, id, load, memory, stats, asynchronous=False):
+    def worker_ping(self, id, load, memory, stats, delta=False, samples=None, images=None, signals_ack=None, 
+                    asynchronous=False):
         """Update a specific worker ping time (heartbit)
-        return a updated worker object with attribute or key (depending on style)"""
-        return self.put(f'/workers/{id}/ping', data={'load':load,'memory':memory,
-            'stats':stats}, asynchronous=asynchronous)
+        - delta: if True, stats only contain the fields that changed since last ping
+        - samples: an optional JSON list of numerical telemetry samples to record in worker history
+        - images: an optional space separated list of docker images present on the worker (only sent when it changes)
+        - signals_ack: an optional list of signal ids received in previous answers (they are deleted)
+        return a updated worker object with attribute or key (depending on style), its signals attribute
+        is the list of pending signals for this worker"""
+        return self.put(f'/workers/{id}/ping', data=_clean({'load':load,'memory':memory,
+            'stats':stats, 'delta':delta, 'samples':samples, 'images':images,
+            'signals_ack':' '.join(map(str,signals_ack)) if signals_ack else None}), asynchronous=asynchronous)
+
+    def worker_images(self, id):
+        """Return the list of docker images needed by the tasks queued for this worker batch"""
+        return self.get(f'/workers/{id}/images', wrap=_filter_non200)
+
+    def worker_stats(self, id, since=None, limit=None):
+        """Return the telemetry history of a worker
+        - since: a datetime, return only samples after this date
+        - limit: return only the N most recent samples"""
+        return self.get(f'/workers/{id}/stats', **_clean({'since':since.isoformat() if since else None,
+                                                          'limit':limit}))
 
     def worker_callback(self, id, message, asynchronous=False):
         """Send a callback message (mainly idle) to trigger action on worker from the server
@@ -374,9 +413,15 @@ class Server:
         - limit: int (limit results to N)
         - reverse: set to true to have most recent executions first (default to False)
         - trunc: trunc output/error to this size (trunc, keeping only this number of last characters)
+        - after_id: int (only executions after this one in sorting order, for pagination)
         """
         return self.get(f'/executions/', **args)
     
+    def iter_executions(self, page_size=LIST_PAGE_SIZE, **args):
+        """Same as executions() except that executions are yielded while they are 
+        fetched page by page (page_size each time), limit is not accepted"""
+        return self.paginate(f'/executions/', 'execution_id', page_size=page_size, **args)
+    
     def execution_create(self, worker_id, task_id, status='pending', command=None,
                          asynchronous=True):
         """Create a new execution, return the newly created execution
@@ -496,9 +541,16 @@ class Server:
         - status: str
         - batch: str
         - name: str
+        - after_id: int (only tasks with a greater task_id, for pagination)
+        - limit: int (limit results to N)
         """
         return self.get(f'/tasks/', **args)
     
+    def iter_tasks(self, page_size=LIST_PAGE_SIZE, **args):
+        """Same as tasks() except that tasks are yielded while they are fetched
+        page by page (page_size each time), which is much lighter for big batches"""
+        return self.paginate(f'/tasks/', 'task_id', page_size=page_size, **args)
+    
     def task_status(self, task_id_list):
         """Get a list of tasks'status
         Only one mandatory argument, a list of task.task_id:
@@ -506,6 +558,19 @@ class Server:
         """
         return [TASK_STATUS_ID_REVERSE[status_id] for status_id in self.get(f'/tasks/status', wrap=_filter_non200, task_id=task_id_list)]
 
+    def task_changes(self, since=None, task_id_list=None, batch=None):
+        """Get the status changes of tasks since a certain cursor
+        - since: the cursor returned by the previous call (if None, all tasks are returned)
+        - task_id_list: an optional list of task.task_id to restrict the feed
+        - batch: an optional list of batches to restrict the feed
+
+        return a tuple (cursor, {task_id: status}), tasks may appear even if their status
+        did not change, cursor should be used as since in next call"""
+        answer = self.get(f'/tasks/changes', wrap=_filter_non200, since=since, 
+                          task_id=task_id_list, batch=batch)
+        return answer['cursor'], dict([(task_id, TASK_STATUS_ID_REVERSE[status_id]) 
+                                       for task_id,status_id in answer['tasks']])
+
     def task_delete(self,id, asynchronous=True):
         """delete a specific task"""
         return self.delete(f'/tasks/{id}', asynchronous=asynchronous)
@@ -561,24 +626,27 @@ class Server:
         return self.get(f'/recruiter/', **args)
 
     def recruiter_create(self, batch, rank, tasks_per_worker, flavor, concurrency, region=None, provider=None,  
-                         prefetch=None, minimum_tasks=None, maximum_workers=None,asynchronous=True):
-        """Create a new recruiter (or update an existing recruiter of the same rank)"""
+                         prefetch=None, minimum_tasks=None, maximum_workers=None, policy=None, asynchronous=True):
+        """Create a new recruiter (or update an existing recruiter of the same rank)
+        - policy: how the number of workers is computed, tasks_per_worker (default) or drain"""
         validate_protofilter(flavor)
         return self.post(f'/recruiter/', data=_clean({
             'batch': batch,'rank':rank,'tasks_per_worker':tasks_per_worker,'worker_flavor':flavor,
             'worker_region':region,'worker_provider':provider,'worker_concurrency':concurrency,
-            'worker_prefetch': prefetch,'minimum_tasks':minimum_tasks,'maximum_workers':maximum_workers
+            'worker_prefetch': prefetch,'minimum_tasks':minimum_tasks,'maximum_workers':maximum_workers,
+            'policy':policy
         }), asynchronous=asynchronous)
     
     def recruiter_update(self, batch, rank, tasks_per_worker=None, flavor=None, region=None, provider=None, concurrency=None, 
-                         prefetch=None, minimum_tasks=None, maximum_workers=None,asynchronous=True):
+                         prefetch=None, minimum_tasks=None, maximum_workers=None, policy=None, asynchronous=True):
         """Update an existing recruiter"""
         if flavor is not None:
             validate_protofilter(flavor)
         return self.put(f'/recruiter/{batch}/{rank}', data=_clean({
             'tasks_per_worker':tasks_per_worker,'worker_flavor':flavor,
             'worker_region':region,'worker_provider':provider,'worker_concurrency':concurrency,
-            'worker_prefetch': prefetch,'minimum_tasks':minimum_tasks,'maximum_workers':maximum_workers
+            'worker_prefetch': prefetch,'minimum_tasks':minimum_tasks,'maximum_workers':maximum_workers,
+            'policy':policy
         }), asynchronous=asynchronous)
     
     def recruiter_delete(self, batch, rank,asynchronous=True):
@@ -610,22 +678,28 @@ class Server:
             task_list = [Namespace(**task) for task in task_list]
         task_ids = [task.task_id for task in task_list]
         task_retries = dict([(task_id,0) for task_id in task_ids])
+        # restrict the feed with batches when they are known, this is lighter than the ids
+        if all(getattr(task,'batch',None) for task in task_list):
+            feed_filter = {'batch': list(set(task.batch for task in task_list))}
+        else:
+            feed_filter = {'task_id_list': task_ids}
 
-        all_task_done = False
-        tasks = None
-        dynamic_sleep_time = True
-        sleep_time = JOIN_DYNAMIC_SLEEP_TIME_INCREMENT
+        cursor, changes = self.task_changes(**feed_filter)
+        task_status = dict([(task_id, changes.get(task_id)) for task_id in task_ids])
         failed_tasks = []
-        while not all_task_done:
+        tasks = None
+        while True:
             all_task_done = True
             old_tasks = tasks
             tasks = {status:0 for status in TASK_STATUS}
-            for task,task_status in zip(task_list,self.task_status(task_id_list=task_ids)):
-                if task_status=='failed':
+            for task in task_list:
+                status = task_status[task.task_id]
+                if status=='failed':
                     if task_retries[task.task_id]<retry:
                         print(f'Retrying task {task.name or task.task_id} [{task_retries[task.task_id]+1}/{retry}]...')
-                        self.task_update(task.task_id, status='pending')
+                        self.task_update(task.task_id, status='pending', asynchronous=False)
                         task_retries[task.task_id]+=1
+                        task_status[task.task_id]='pending'
                         tasks['pending']+=1
                         all_task_done = False
                     else:
@@ -633,30 +707,21 @@ class Server:
                         if task.task_id not in failed_tasks:
                             print(f'Task {task.name or task.task_id} failed too many times giving up')
                             failed_tasks.append(task.task_id)
-                elif task_status in ['running','accepted','pending','assigned']:
+                elif status in ['running','accepted','pending','assigned']:
                     all_task_done = False
-                    tasks[task_status]+=1
-                else:
-                    tasks[task_status]+=1
-            print(f"Remaining tasks pending : {tasks['pending']}, assigned: {tasks['assigned']}, accepted: {tasks['accepted']}, running: {tasks['running']}, failed: {tasks['failed']}, succeeded: {tasks['succeeded']}")
-            
-            # sleeping if needed
-            if not all_task_done:
-                sleep(sleep_time)
-
-            # adjust sleeping time
-            if old_tasks is not None and dynamic_sleep_time:
-                if tasks['succeeded']==old_tasks['succeeded'] and tasks['failed']==old_tasks['failed']:
-                    # no task has been completed since last iteration so it is likely that the time loop is two short
-                    sleep_time += JOIN_DYNAMIC_SLEEP_TIME_INCREMENT
-                else:
-                    # ok so now some tasks have been completed so it is likely the time loop is correct, no need to move it further
-                    dynamic_sleep_time = False
-            elif not dynamic_sleep_time and sleep_time>JOIN_DYNAMIC_SLEEP_TIME_INCREMENT:
-                if tasks['succeeded']!=old_tasks['succeeded'] or tasks['failed']!=old_tasks['failed']:
-                    # after all it seems it is moving quicker than expected, maybe time to shorten the time loop
-                    dynamic_sleep_time = True
-                    sleep_time -= JOIN_DYNAMIC_SLEEP_TIME_INCREMENT
+                    tasks[status]+=1
+                elif status is not None:
+                    tasks[status]+=1
+            if tasks!=old_tasks:
+                print(f"Remaining tasks pending : {tasks['pending']}, assigned: {tasks['assigned']}, accepted: {tasks['accepted']}, running: {tasks['running']}, failed: {tasks['failed']}, succeeded: {tasks['succeeded']}")
+            if all_task_done:
+                break
+
+            sleep(JOIN_CHANGES_INTERVAL)
+            cursor, changes = self.task_changes(since=cursor, **feed_filter)
+            for task_id,status in changes.items():
+                if task_id in task_status:
+                    task_status[task_id]=status
         if check and tasks['failed']>0:
             raise RuntimeError('Could not complete all the tasks...')
         print('All tasks done!')
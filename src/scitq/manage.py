@@ -5,12 +5,12 @@ import argparse
 import sys
 from datetime import datetime
 import os 
-from .util import package_path, package_version
+from .util import package_path, package_version, if_is_not_None
 import shutil
 import random
 from .debug import Debugger
 from .constants import DEFAULT_SERVER_CONF, DEFAULT_WORKER_CONF, TASK_STATUS, EXECUTION_STATUS,\
-    FLAVOR_DEFAULT_LIMIT, FLAVOR_DEFAULT_EVICTION, DEFAULT_RCLONE_CONF
+    FLAVOR_DEFAULT_LIMIT, FLAVOR_DEFAULT_EVICTION, DEFAULT_RCLONE_CONF, RECRUITER_POLICY_NAMES, RECRUITER_DEFAULT_POLICY
 from signal import SIGKILL, SIGCONT, SIGQUIT, SIGTSTP
 import dotenv
 from tabulate import tabulate
@@ -190,6 +190,7 @@ def main():
     recruiter_create_parser.add_argument('-T','--tasks-per-worker',type=int,help='how many workers should be recruited (default to concurrency, but if you want each worker to work two rounds, set it to twice the concurrency)',default=None)
     recruiter_create_parser.add_argument('-m','--minimum-tasks',type=int,help='prevent the recruiter from triggering before this minimal number of tasks is reached',default=None)
     recruiter_create_parser.add_argument('-W','--maximum-workers',type=int,help='prevent the recruiter from recruiting more than this number of worker',default=None)
+    recruiter_create_parser.add_argument('--policy',type=str,choices=RECRUITER_POLICY_NAMES,help=f'how the number of workers is computed: tasks_per_worker (one worker each tasks per worker pending tasks) or drain (based on task duration and deploy time, see documentation), default to {RECRUITER_DEFAULT_POLICY}',default=None)
     
     recruiter_modify_parser = subsubparser.add_parser('update', help='Update a recruiter')
     recruiter_modify_parser.add_argument('-b','--batch',type=str,required=True,help='batch in which workers are deployed')
@@ -202,6 +203,7 @@ def main():
     recruiter_modify_parser.add_argument('-T','--tasks-per-worker',type=int,help='how many workers should be recruited (default to concurrency, but if you want each worker to work two rounds, set it to twice the concurrency)',default=None)
     recruiter_modify_parser.add_argument('-m','--minimum-tasks',type=int,help='prevent the recruiter from triggering before this minimal number of tasks is reached',default=None)
     recruiter_modify_parser.add_argument('-W','--maximum-workers',type=int,help='prevent the recruiter from recruiting more than this number of worker',default=None)
+    recruiter_modify_parser.add_argument('--policy',type=str,choices=RECRUITER_POLICY_NAMES,help=f'how the number of workers is computed: tasks_per_worker (one worker each tasks per worker pending tasks) or drain (based on task duration and deploy time, see documentation), default to {RECRUITER_DEFAULT_POLICY}',default=None)
 
     recruiter_delete_parser = subsubparser.add_parser('delete', help='Delete a recruiter')
     recruiter_delete_parser.add_argument('-b','--batch',type=str,required=True,help='batch in which workers are deployed')
@@ -214,6 +216,11 @@ def main():
     db_upgrade_parser=subsubparser.add_parser('upgrade',help='Migrate the database to the current version of scitq')
     db_init_parser=subsubparser.add_parser('init',help='Initialize a new database with current version of scitq')
     db_upgrade_parser=subsubparser.add_parser('upgrade-or-init',help='Migrate the database to the current version of scitq if it exists, initialize it otherwise')
+    db_archive_parser=subsubparser.add_parser('archive',help='Archive output and error of old executions, keeping only their tail in the database')
+    db_archive_parser.add_argument('-r','--retention',help='Archive executions older than this number of days (default to EXECUTION_RETENTION setting)',type=int,default=None)
+    db_archive_parser.add_argument('-u','--uri',help='Archive in this object storage folder, e.g. s3://bucket/archive (default to EXECUTION_ARCHIVE_URI setting, or in the database if unset)',type=str,default=None)
+    db_archive_parser.add_argument('-C','--chunk',help='Number of executions archived per transaction (default to EXECUTION_ARCHIVE_CHUNK setting)',type=int,default=None)
+    db_archive_parser.add_argument('-n','--dry-run',help='Only count archivable executions',action='store_true')
 
     execution_parser = subparser.add_parser('execution', help='The following options will only concern task executions')
     subsubparser=execution_parser.add_subparsers(dest='action')
@@ -379,7 +386,7 @@ def main():
                 filters['batch']=args.batch
             if args.status:
                 filters['status']=args.status
-            task_list=s.tasks(**filters)
+            task_list=s.iter_tasks(**filters)
             __list_print(task_list, info_task, headers, long=args.long)
 
         elif args.action=='relaunch':
@@ -532,13 +539,13 @@ def main():
             s.recruiter_create(batch=args.batch,rank=args.rank,region=args.region,
                 flavor=args.flavor,concurrency=args.concurrency, prefetch=args.prefetch,
                 provider=args.provider, tasks_per_worker=args.tasks_per_worker,
-                minimum_tasks=args.minimum_tasks, maximum_workers=args.maximum_workers)
+                minimum_tasks=args.minimum_tasks, maximum_workers=args.maximum_workers, policy=args.policy)
         
         elif args.action == 'update':
             s.recruiter_update(batch=args.batch,rank=args.rank,region=args.region,
                 flavor=args.flavor,concurrency=args.concurrency, prefetch=args.prefetch,
                 provider=args.provider, tasks_per_worker=args.tasks_per_worker,
-                minimum_tasks=args.minimum_tasks, maximum_workers=args.maximum_workers)
+                minimum_tasks=args.minimum_tasks, maximum_workers=args.maximum_workers, policy=args.policy)
 
         elif args.action =='delete' :
             s.recruiter_delete(batch=args.batch, rank=args.rank)
@@ -648,6 +655,18 @@ def main():
                 cwd=package_path(), check=True)
             print('DB migrated')
 
+        if args.action=='archive':
+            dotenv.load_dotenv(args.conf)
+            from .server import get_session
+            from .server.archive import archive_executions
+            from .server.config import EXECUTION_RETENTION, EXECUTION_ARCHIVE_URI, EXECUTION_ARCHIVE_CHUNK
+            archived = archive_executions(get_session(),
+                retention=if_is_not_None(args.retention, EXECUTION_RETENTION),
+                uri=if_is_not_None(args.uri, EXECUTION_ARCHIVE_URI),
+                chunk=if_is_not_None(args.chunk, EXECUTION_ARCHIVE_CHUNK),
+                dry_run=args.dry_run)
+            print(f'{archived} executions would be archived' if args.dry_run else f'{archived} executions archived')
+
     elif args.object == 'flavor':
 
         if args.action=='list':
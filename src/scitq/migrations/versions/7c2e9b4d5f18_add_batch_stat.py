@@ -0,0 +1,153 @@
+"""Add batch stat
+
+Revision ID: 7c2e9b4d5f18
+Revises: 3a9d7e51c2f4
+Create Date: 2024-12-12 11:04:36.520817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e9b4d5f18'
+down_revision = '3a9d7e51c2f4'
+branch_labels = None
+depends_on = None
+
+# triggers as they were at this revision (not imported from the model, which may change later)
+BATCH_STAT_TASK_INCREMENT = """INSERT INTO batch_stat (batch,status,count) VALUES (NEW.batch,NEW.status,1)
+            ON CONFLICT (batch,status) DO UPDATE SET count=batch_stat.count+1;"""
+BATCH_STAT_TASK_DECREMENT = """UPDATE batch_stat SET count=count-1 WHERE batch=OLD.batch AND status=OLD.status;"""
+BATCH_STAT_EXECUTION_CONDITION = """NEW.status IN ('succeeded','failed') AND OLD.status NOT IN ('succeeded','failed')
+            AND NEW.modification_date IS NOT NULL AND NEW.creation_date IS NOT NULL"""
+
+batch_stat_sqlite = [
+    f"""
+        CREATE TRIGGER batch_stat_task_insert AFTER INSERT ON task FOR EACH ROW 
+        BEGIN
+            {BATCH_STAT_TASK_INCREMENT}
+        END
+        """,
+    f"""
+        CREATE TRIGGER batch_stat_task_update AFTER UPDATE OF status,batch ON task FOR EACH ROW 
+        BEGIN
+            {BATCH_STAT_TASK_DECREMENT}
+            {BATCH_STAT_TASK_INCREMENT}
+        END
+        """,
+    f"""
+        CREATE TRIGGER batch_stat_task_delete AFTER DELETE ON task FOR EACH ROW 
+        BEGIN
+            {BATCH_STAT_TASK_DECREMENT}
+        END
+        """,
+    f"""
+        CREATE TRIGGER batch_stat_execution AFTER UPDATE OF status ON execution FOR EACH ROW 
+        WHEN {BATCH_STAT_EXECUTION_CONDITION}
+        BEGIN
+            INSERT INTO batch_stat (batch,status,duration_count,duration_sum,duration_min,duration_max)
+            SELECT batch,NEW.status,1,duration,duration,duration FROM (
+                SELECT batch,(JULIANDAY(NEW.modification_date)-JULIANDAY(NEW.creation_date))*86400 AS duration
+                FROM task WHERE task_id=NEW.task_id) WHERE true
+            ON CONFLICT (batch,status) DO UPDATE SET duration_count=batch_stat.duration_count+1,
+                duration_sum=batch_stat.duration_sum+excluded.duration_sum,
+                duration_min=MIN(COALESCE(batch_stat.duration_min,excluded.duration_min),excluded.duration_min),
+                duration_max=MAX(COALESCE(batch_stat.duration_max,excluded.duration_max),excluded.duration_max);
+        END
+        """,
+]
+
+batch_stat_postgres = [
+    f"""
+        CREATE OR REPLACE FUNCTION batch_stat_task() 
+        RETURNS TRIGGER
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE','DELETE') THEN
+                {BATCH_STAT_TASK_DECREMENT}
+            END IF;
+            IF TG_OP IN ('INSERT','UPDATE') THEN
+                {BATCH_STAT_TASK_INCREMENT}
+            END IF;
+            RETURN NULL;
+        END;
+        $$
+        """,
+    """
+CREATE TRIGGER batch_stat_task AFTER INSERT OR DELETE OR UPDATE OF status,batch ON task FOR EACH ROW EXECUTE PROCEDURE batch_stat_task()
+""",
+    """
+        CREATE OR REPLACE FUNCTION batch_stat_execution() 
+        RETURNS TRIGGER
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            INSERT INTO batch_stat (batch,status,duration_count,duration_sum,duration_min,duration_max)
+            SELECT batch,NEW.status,1,duration,duration,duration FROM (
+                SELECT batch,EXTRACT(EPOCH FROM (NEW.modification_date-NEW.creation_date)) AS duration
+                FROM task WHERE task_id=NEW.task_id) AS d
+            ON CONFLICT (batch,status) DO UPDATE SET duration_count=batch_stat.duration_count+1,
+                duration_sum=batch_stat.duration_sum+EXCLUDED.duration_sum,
+                duration_min=LEAST(batch_stat.duration_min,EXCLUDED.duration_min),
+                duration_max=GREATEST(batch_stat.duration_max,EXCLUDED.duration_max);
+            RETURN NULL;
+        END;
+        $$
+        """,
+    f"""
+CREATE TRIGGER batch_stat_execution AFTER UPDATE OF status ON execution FOR EACH ROW 
+WHEN ({BATCH_STAT_EXECUTION_CONDITION}) EXECUTE PROCEDURE batch_stat_execution()
+""",
+]
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('batch_stat',
+    sa.Column('batch', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('duration_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('duration_sum', sa.Float(), server_default='0', nullable=False),
+    sa.Column('duration_min', sa.Float(), nullable=True),
+    sa.Column('duration_max', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('batch', 'status')
+    )
+    # ### end Alembic commands ###
+
+    # initial content from history, then triggers keep it up to date
+    if op.get_bind().dialect.name=='sqlite':
+        duration='(JULIANDAY(e.modification_date)-JULIANDAY(e.creation_date))*86400'
+        triggers=batch_stat_sqlite
+    else:
+        duration='EXTRACT(EPOCH FROM (e.modification_date-e.creation_date))'
+        triggers=batch_stat_postgres
+    op.execute('''INSERT INTO batch_stat (batch,status,count) 
+                  SELECT batch,status,COUNT(task_id) FROM task GROUP BY batch,status''')
+    op.execute(f'''INSERT INTO batch_stat (batch,status,duration_count,duration_sum,duration_min,duration_max)
+                   SELECT batch,status,COUNT(duration),SUM(duration),MIN(duration),MAX(duration) FROM (
+                        SELECT task.batch,e.status,{duration} AS duration FROM execution e JOIN task ON task.task_id=e.task_id
+                        WHERE e.status IN ('succeeded','failed') AND e.modification_date IS NOT NULL 
+                        AND e.creation_date IS NOT NULL) AS d
+                   GROUP BY batch,status
+                   ON CONFLICT (batch,status) DO UPDATE SET duration_count=excluded.duration_count,
+                        duration_sum=excluded.duration_sum, duration_min=excluded.duration_min,
+                        duration_max=excluded.duration_max''')
+    for ddl in triggers:
+        op.execute(ddl)
+
+
+def downgrade():
+    if op.get_bind().dialect.name=='sqlite':
+        for trigger in ['batch_stat_task_insert','batch_stat_task_update','batch_stat_task_delete','batch_stat_execution']:
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    else:
+        op.execute('DROP TRIGGER IF EXISTS batch_stat_task ON task')
+        op.execute('DROP TRIGGER IF EXISTS batch_stat_execution ON execution')
+        op.execute('DROP FUNCTION IF EXISTS batch_stat_task')
+        op.execute('DROP FUNCTION IF EXISTS batch_stat_execution')
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('batch_stat')
+    # ### end Alembic commands ###
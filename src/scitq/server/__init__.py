@@ -51,6 +51,9 @@ def create_app(get_background=True, get_webapp=True):
     from .api import api
     api.init_app(app)
 
+    from .encoding import compress_response
+    app.after_request(compress_response)
+
     from .ui import ui
     app.register_blueprint(ui)
 
@@ -1,23 +1,29 @@
 from flask_restx import Api, Resource, fields
 from flask import jsonify
-from datetime import datetime
+from datetime import datetime, timedelta
 from sqlalchemy import and_, delete, select, func, update
 from sqlalchemy.sql.expression import label
+from sqlalchemy.orm import selectinload
 import logging as log
 import json as json_module
 
 from .model import Task, Execution, Signal, Requirement, Worker,\
-    create_worker_destroy_job, Job, Recruiter, delete_batch, \
+    create_worker_destroy_job, Job, Recruiter, create_batch_delete_job, \
     find_flavor, execution_update_status, worker_delete, \
-    ModelException, create_worker_create_job, worker_handle_eviction
+    ModelException, create_worker_create_job, worker_handle_eviction, \
+    WorkerStat, worker_merge_stats, BatchStat, create_batch_signal, worker_signals, worker_batch_signals
 from .db import db
-from .config import IS_SQLITE, REMOTE_URI
-from ..constants import TASK_STATUS, EXECUTION_STATUS, FLAVOR_DEFAULT_LIMIT, FLAVOR_DEFAULT_EVICTION, WORKER_STATUS, TASK_STATUS_ID, DEFAULT_RCLONE_CONF
+from .encoding import output_columns
+from .archive import archived_logs
+from .config import IS_SQLITE, REMOTE_URI, TASK_CHANGES_OVERLAP
+from ..constants import TASK_STATUS, EXECUTION_STATUS, FLAVOR_DEFAULT_LIMIT, FLAVOR_DEFAULT_EVICTION, WORKER_STATUS, TASK_STATUS_ID, DEFAULT_RCLONE_CONF, \
+    COLUMNS_MIMETYPE, RECRUITER_POLICY_NAMES, RECRUITER_DEFAULT_POLICY
 
 
 api = Api(version='1.2', title='TaskMVC API',
     description='A simple TaskMVC API'
 )
+api.representation(COLUMNS_MIMETYPE)(output_columns)
 
 
 
@@ -107,9 +113,19 @@ class TaskDAO(BaseDAO):
     ObjectType = Task
     authorized_status = TASK_STATUS
 
-    def list(self, **args):
+    def list(self, after_id=None, limit=None, **args):
+        """List tasks by task_id order, paginated with after_id (keyset) and limit
+        requirements are loaded in one query for the whole page"""
+        q = Task.query.options(selectinload(Task.requirements))
+        if args:
+            q = q.filter(process_filtering_args(Task, args))
+        if after_id is not None:
+            q = q.filter(Task.task_id > after_id)
+        q = q.order_by(Task.task_id)
+        if limit:
+            q = q.limit(limit)
         task_list = []
-        for task in super().list(sorting_column='task_id',**args):
+        for task in q:
             task.required_task_ids = list([r.other_task_id for r in task.requirements])
             task_list.append(task)
         return task_list
@@ -207,6 +223,8 @@ task_filter = api.model('TaskFilter', {
     'batch': fields.String(required=False, description="Filter with this batch"),
     'status': fields.String(required=False, description="Filter with this status"),
     'name': fields.String(required=False, description="Filter with this name"),
+    'after_id': fields.Integer(required=False, description="Only list tasks with a greater task_id (pagination)"),
+    'limit': fields.Integer(required=False, description="Limit results to this number"),
 })
 
 
@@ -253,6 +271,39 @@ class TaskStatusList(Resource):
         return jsonify([task_to_status[id] for id in task_id_list])
 
 
+task_changes_filter = api.model('TaskChangesFilter', {
+    'since': fields.String(required=False, 
+        description='The cursor returned by the previous call, if absent all tasks are returned'),
+    'task_id': fields.List(fields.Integer(),required=False,description='A list of ids to restrict listing'),
+    'batch': fields.List(fields.String(),required=False,description='A list of batches to restrict listing'),
+})
+
+@ns.route('/changes')
+class TaskChanges(Resource):
+    '''A feed of task status changes'''
+    @ns.doc('list_task_changes')
+    @ns.expect(task_changes_filter)
+    def get(self):
+        '''List status changes since a cursor: return {cursor:..., tasks:[[task_id,status_id],...]},
+        the cursor should be passed as since in next call (the answer is immediate, clients poll)'''
+        payload = api.payload or {}
+        since = payload.get('since')
+        since = datetime.fromisoformat(since) if since else None
+        filters = []
+        if payload.get('task_id'):
+            filters.append(Task.task_id.in_(payload['task_id']))
+        if payload.get('batch'):
+            filters.append(Task.batch.in_(payload['batch']))
+        if since is not None:
+            filters.append(Task.status_date >= since - timedelta(seconds=TASK_CHANGES_OVERLAP))
+        changes = db.session.query(Task.task_id,Task.status,Task.status_date).filter(*filters).all()
+        # the cursor comes from committed data, not from the clock, so that it never gets ahead of
+        # what was actually read
+        cursor = max([status_date for _,_,status_date in changes if status_date is not None], default=since)
+        return jsonify({'cursor': cursor.isoformat() if cursor else None, 
+                'tasks': [[task_id, TASK_STATUS_ID[status]] for task_id,status,_ in changes]})
+
+
 
 @ns.route("/<id>")
 @ns.param("id", "The task identifier")
@@ -326,15 +377,35 @@ class WorkerDAO(BaseDAO):
     ObjectType = Worker
     authorized_status = WORKER_STATUS
 
-    def update_contact(self, id, load,memory,stats):
+    def update_contact(self, id, load,memory,stats, delta=False, samples=None, images=None):
+        if delta:
+            previous_stats = db.session.query(Worker.stats).filter(Worker.worker_id==id).scalar()
+            stats = worker_merge_stats(previous_stats, stats, delta=True)
+        values = {'last_contact_date':datetime.utcnow(),'load':load,'memory':memory}
+        if stats:
+            values['stats']=stats
+        if images is not None:
+            values['images']=images
         db.engine.execute(
             db.update(Worker
-                    ).values({'last_contact_date':datetime.utcnow(),
-                        'load':load,'memory':memory,'stats':stats}
+                    ).values(values
                     ).where(Worker.worker_id==id)
         )
+        if samples:
+            db.session.bulk_save_objects([
+                WorkerStat(worker_id=id, stat_date=datetime.utcfromtimestamp(sample['time']), **sample)
+                for sample in json_module.loads(samples)])
         db.session.commit()
 
+    def stat_history(self, id, since=None, limit=None):
+        query = db.session.query(WorkerStat).filter(WorkerStat.worker_id==id)
+        if since is not None:
+            query = query.filter(WorkerStat.stat_date>=since)
+        query = query.order_by(WorkerStat.stat_date.desc())
+        if limit:
+            query = query.limit(limit)
+        return list(reversed(query.all()))
+
     def update(self, id, data):
         object = self.get(id)
         modified = False
@@ -402,6 +473,8 @@ worker = api.model('Worker', {
         description="region (cloud regional entity of the instance) of the worker."),
     'provider': fields.String(readonly=True, 
         description="provider (cloud provider of the instance) of the worker."),
+    'images': fields.String(readonly=True, 
+        description="space separated list of docker images present on the worker."),
 })
 
 @ns.route('/')
@@ -468,10 +541,27 @@ class WorkerObject(Resource):
         """Delete a worker"""
         return worker_dao.delete(id)
 
+signal = api.model('Signal', {
+    'signal_id': fields.Integer(readonly=True, description='The signal unique identifier'), 
+    'execution_id': fields.Integer(readonly=True, description='The execution unique identifier'), 
+    'worker_id': fields.Integer(readonly=True, description='A worker unique identifier'),
+    'signal': fields.Integer(readonly=True, description='The signal to send to the execution (UNIX signal)'),
+    'batch': fields.String(readonly=True, description='For a batch-wide signal, the batch'),
+})
+
+worker_sync = api.inherit('WorkerSync', worker, {
+    'signals': fields.List(fields.Nested(signal), attribute='pending_signals',
+        description='Pending signals for this worker, to be acknowledged in next ping'),
+})
+
 ping_parser = api.parser()
 ping_parser.add_argument('load', type=str, help='Worker load', location='json')
 ping_parser.add_argument('memory', type=float, help='Worker memory', location='json')
 ping_parser.add_argument('stats', type=str, help='Worker other stats', location='json')
+ping_parser.add_argument('delta', type=bool, help='If set, stats contains only the changed fields', location='json')
+ping_parser.add_argument('samples', type=str, help='A JSON list of numerical telemetry samples', location='json')
+ping_parser.add_argument('images', type=str, help='Space separated list of docker images present on worker (sent only when it changes)', location='json')
+ping_parser.add_argument('signals_ack', type=str, help='Space separated list of signal ids received in previous ping answers', location='json')
 
 @ns.route("/<id>/ping")
 @ns.param("id", "The worker identifier")
@@ -479,12 +569,66 @@ ping_parser.add_argument('stats', type=str, help='Worker other stats', location=
 class WorkerPing(Resource):
     @ns.doc("update_worker_contact")
     @ns.expect(ping_parser)
-    @ns.marshal_with(worker)
+    @ns.marshal_with(worker_sync)
     def put(self, id):
-        """Update a worker last contact"""
+        """Update a worker last contact, acknowledge delivered signals and return pending signals"""
         args = ping_parser.parse_args()
-        worker_dao.update_contact(id, args.get('load',''),args.get('memory',''),args.get('stats',''))
-        return worker_dao.get(id)
+        worker_dao.update_contact(id, args.get('load',''),args.get('memory',''),args.get('stats',''),
+                                  delta=args.get('delta') or False, samples=args.get('samples'),
+                                  images=args.get('images'))
+        worker = worker_dao.get(id)
+        worker.pending_signals = worker_signals(worker.worker_id, db.session, 
+            acknowledged=[int(signal_id) for signal_id in (args.get('signals_ack') or '').split()])
+        return worker
+
+@ns.route("/<id>/images")
+@ns.param("id", "The worker identifier")
+@ns.response(404, "Worker not found")
+class WorkerImages(Resource):
+    @ns.doc("get_worker_images")
+    def get(self, id):
+        """List the docker images needed by the tasks queued in this worker batch or assigned to it"""
+        worker = worker_dao.get(id)
+        containers = set(container for container, in db.session.query(Task.container).filter(
+                Task.batch==worker.batch, Task.status.in_(['pending','assigned','accepted']),
+                Task.container.isnot(None)).distinct())
+        containers.update(container for container, in db.session.query(Task.container).join(Execution.task).filter(
+                Execution.worker_id==worker.worker_id, Execution.status.in_(['pending','accepted']),
+                Task.container.isnot(None)).distinct())
+        return jsonify(sorted(containers))
+
+worker_stat = api.model('WorkerStat', {
+    'stat_date': fields.DateTime(readonly=True, description='timestamp of the sample'),
+    'cpu': fields.Float(readonly=True, description='CPU user time (in %)'),
+    'iowait': fields.Float(readonly=True, description='CPU iowait time (in %)'),
+    'memory': fields.Float(readonly=True, description='Memory used (in %)'),
+    'load': fields.Float(readonly=True, description='1 minute load average'),
+    'disk_read': fields.Float(readonly=True, description='Disk read speed (bytes/s)'),
+    'disk_write': fields.Float(readonly=True, description='Disk write speed (bytes/s)'),
+    'network_sent': fields.Float(readonly=True, description='Network upload speed (bytes/s)'),
+    'network_recv': fields.Float(readonly=True, description='Network download speed (bytes/s)'),
+    'scratch_usage': fields.Float(readonly=True, description='Working disk usage (in %)'),
+})
+
+stat_history_parser = api.parser()
+stat_history_parser.add_argument('since', type=str, help='Only samples after this ISO date', 
+    required=False, location='json', default=None)
+stat_history_parser.add_argument('limit', type=int, help='Only the N most recent samples', 
+    required=False, location='json', default=None)
+
+@ns.route("/<id>/stats")
+@ns.param("id", "The worker identifier")
+@ns.response(404, "Worker not found")
+class WorkerStatHistory(Resource):
+    @ns.doc("get_worker_stat_history")
+    @ns.expect(stat_history_parser)
+    @ns.marshal_list_with(worker_stat)
+    def get(self, id):
+        """Return the telemetry history of a worker"""
+        args = stat_history_parser.parse_args()
+        worker_dao.get(id)
+        since = datetime.fromisoformat(args.since) if args.since else None
+        return worker_dao.stat_history(id, since=since, limit=args.limit)
 
 callback_parser = api.parser()
 callback_parser.add_argument('message', type=str, help='Callback message sent (idle)', location='json')
@@ -607,11 +751,14 @@ class ExecutionDAO(BaseDAO):
             db.session.commit()
         return execution
 
-    def list(self,no_output=False,limit=None,reverse=False,trunc=None,**args):
+    def list(self,no_output=False,limit=None,reverse=False,trunc=None,after_id=None,**args):
         sorting_column=Execution.execution_id
         if reverse:
             sorting_column=sorting_column.desc()
         q=Execution.query
+        if after_id is not None:
+            # keyset pagination, following the sorting order
+            q=q.filter(Execution.execution_id < after_id if reverse else Execution.execution_id > after_id)
         if args:
             task_args = {}
             if 'task_name' in args:
@@ -685,7 +832,8 @@ execution = api.model('Execution', {
     'output_files': fields.String(readonly=True, description='A list of output files transmitted (if any)'),
     'command': fields.String(required=False, description='The command that was really launched for this execution (it case Task.execution is modified)'),
     'freeze': fields.Boolean(required=False, description='Freeze execution to compute output hash'),
-    'latest': fields.Boolean(readonly=True, description='Latest or current execution for the related task')
+    'latest': fields.Boolean(readonly=True, description='Latest or current execution for the related task'),
+    'archive': fields.String(readonly=True, description='Where output and error were archived (if they were), only their tail is kept in listings'),
 })
 
 execution_plus_batch = api.model('ExecutionPlusBatch', {
@@ -759,12 +907,6 @@ class WorkerExecutionFilterObject(Resource):
                                     Execution.status==status))
         return list(worker_executions)
 
-signal = api.model('Signal', {
-    'execution_id': fields.Integer(readonly=True, description='The execution unique identifier'), 
-    'worker_id': fields.Integer(readonly=True, description='A worker unique identifier'),
-    'signal': fields.Integer(readonly=True, description='The signal to send to the execution (UNIX signal)'),
-})
-
 signal_parser = api.parser()
 signal_parser.add_argument('execution_id', type=int, help='Execution identifier', location='json')
 signal_parser.add_argument('signal', type=int, help='Signal to send', location='json')
@@ -776,10 +918,17 @@ class WorkerSignal(Resource):
     @ns.doc("get_worker_signals")
     @ns.marshal_list_with(signal)
     def get(self, id):
-        """Fetch a worker executions given the worker identifier and the executions status"""
+        """Fetch and delete the signals of a worker (for workers that do not send signals_ack,
+        thus do not get them in their ping answer): batch signals are expanded to the worker executions and these executions
+        are removed from the batch signal so that they are delivered once"""
         signals = list(Signal.query.filter(Signal.worker_id==id))
         for sig in signals:
             db.session.delete(sig)
+        for batch_signal, execution_id in worker_batch_signals(id, db.session, for_update=True):
+            signals.append({'signal_id':batch_signal.signal_id, 'execution_id':execution_id, 'worker_id':id,
+                            'signal':batch_signal.signal, 'batch':batch_signal.batch})
+            batch_signal.execution_ids = [other_id for other_id in batch_signal.execution_ids 
+                                            if other_id!=execution_id]
         db.session.commit()
         return signals
     
@@ -802,6 +951,7 @@ execution_filter = api.model('ExecutionFilter', {
     'batch': fields.String(required=False, description="Filter with this batch"),
     'limit': fields.Integer(required=False, description="Limit results to this number"),
     'reverse': fields.Boolean(required=False, description="Reverse sorting order, most recent executions first"),
+    'after_id': fields.Integer(required=False, description="Only list executions after this execution_id in sorting order (pagination)"),
     'no_output': fields.Boolean(required=False, description="Do not include output and error for a lighter query"),
     'trunc': fields.Integer(required=False, description="Limit output size to this number"),
 })
@@ -831,7 +981,14 @@ class ExecutionObject(Resource):
     @ns.marshal_with(execution)
     def get(self, id):
         """Fetch a execution given its identifier"""
-        return execution_dao.get(id)
+        execution = execution_dao.get(id)
+        if execution.archive is None:
+            return execution
+        output, error = archived_logs(execution.execution_id, execution.archive, db.session) or \
+                            (execution.output, execution.error)
+        answer = dict([(column.name, getattr(execution, column.name)) for column in Execution.__table__.columns])
+        answer.update(output=output, error=error)
+        return answer
 
     @ns.doc("update_execution")
     @ns.expect(execution)
@@ -892,6 +1049,20 @@ class ExecutionOutput(Resource):
         output_start=data.get('output_position',1)
         error_start=data.get('error_position',1)
 
+        # output and error may be big, only the archive location is read here
+        execution = db.session.execute(select(Execution.archive).where(Execution.execution_id==id)).one_or_none()
+        if execution is None:
+            api.abort(404, f"Execution {id} doesn't exist")
+        logs = archived_logs(int(id), execution.archive, db.session) if execution.archive is not None else None
+        if logs is not None:
+            archived_output, archived_error = logs
+            answer = {}
+            if output:
+                answer['output'] = archived_output[output_start-1:] if archived_output is not None else None
+            if error:
+                answer['error'] = archived_error[error_start-1:] if archived_error is not None else None
+            return answer
+
         query_items=[]
         if output:
             if IS_SQLITE:
@@ -973,7 +1144,8 @@ class BatchList(Resource):
             worker_query='''SELECT batch,GROUP_CONCAT(name,',') FROM worker GROUP BY batch'''
         else:
             worker_query='''SELECT batch,STRING_AGG(name,',') FROM worker GROUP BY batch'''
-        batch_query='''SELECT batch,status,count(task_id) FROM task GROUP BY batch,status ORDER BY batch,status'''
+        batch_query=select(BatchStat.batch,BatchStat.status,BatchStat.count).where(BatchStat.count>0).\
+                        order_by(BatchStat.batch,BatchStat.status)
         batches = []
         batches_attributes = {}
         for batch,status,count in db.session.execute(batch_query):
@@ -997,12 +1169,7 @@ class BatchStop(Resource):
             w.status = 'paused'
         args = batch_parser.parse_args()
         if args.get('signal',False):
-            log.warning(f'Sending signal {args["signal"]} to executions for batch {name}')
-            for e in db.session.scalars(select(Execution).join(Execution.task).where(
-                                            Execution.status=='running',
-                                            Task.batch==name)):
-                log.warning(f'Sending signal {args["signal"]} to execution {e.execution_id}')
-                db.session.add(Signal(e.execution_id, e.worker_id, args['signal']))
+            create_batch_signal(name, args['signal'], db.session, commit=False)
         db.session.commit()
         return {'result':'Ok'}
 
@@ -1018,12 +1185,7 @@ class BatchGo(Resource):
             w.status = 'running'
         args = batch_parser.parse_args()
         if args.get('signal',False):
-            log.warning(f'Sending signal {args["signal"]} to executions for batch {name}')
-            for e in db.session.scalars(select(Execution).join(Execution.task).where(
-                                            Execution.status=='running',
-                                            Task.batch==name)):
-                log.warning(f'Sending signal {args["signal"]} to execution {e.execution_id}')
-                db.session.add(Signal(e.execution_id, e.worker_id, args['signal']))
+            create_batch_signal(name, args['signal'], db.session, commit=False)
         db.session.commit()
         return {'result':'Ok'}
 
@@ -1035,10 +1197,10 @@ class BatchGo(Resource):
 class BatchDelete(Resource):
     @ns.doc("delete_a_batch")
     def delete(self, name):
-        """Delete all tasks and executions for this batch"""
+        """Delete all tasks and executions for this batch (this is done in the background by a batch_delete job)"""
         log.warning(f'Deleting batch {name}')
-        delete_batch(name, session=db.session)
-        return {'result':'Ok'}
+        job = create_batch_delete_job(name, session=db.session)
+        return {'result':'Ok', 'job_id':job.job_id}
 
 
 ns = api.namespace('requirement', description='Task requirements management')
@@ -1091,7 +1253,10 @@ class RecruiterDAO(BaseDAO):
         return object
         
     def create(self, data):
-        object = self.ObjectType(**data)
+        try:
+            object = self.ObjectType(**data)
+        except ModelException as model_exception:
+            api.abort(500, model_exception.message)
         db.session.merge(object)
         db.session.commit()
         return object
@@ -1102,6 +1267,8 @@ class RecruiterDAO(BaseDAO):
         for attr, value in data.items():
             if hasattr(object,attr): 
                 if getattr(object,attr)!=value:
+                    if attr=='policy' and value is not None and value not in RECRUITER_POLICY_NAMES:
+                        api.abort(500, f'Unknown recruiter policy {value} (only {" ".join(RECRUITER_POLICY_NAMES)})')
                     setattr(object, attr, value)
                     modified = True
             else:
@@ -1134,6 +1301,7 @@ recruiter = api.model('Recruiter', {
     'worker_prefetch': fields.Integer(required=False, description='Set worker prefetch to this when recruited (0 otherwise)'),
     'minimum_tasks': fields.Integer(required=False, description='Do not trigger until there is this minimum number of task (should be above tasks_per_worker)'),
     'maximum_workers': fields.Integer(required=False, description='Stop to trigger when there is this number of worker for the batch'),
+    'policy': fields.String(required=False, description=f'How the number of workers is computed: {" or ".join(RECRUITER_POLICY_NAMES)} (default to {RECRUITER_DEFAULT_POLICY})'),
 })
 
 @ns.route('/')
@@ -0,0 +1,117 @@
+import zlib
+import gzip
+import json as json_module
+import os
+import tempfile
+import logging as log
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, and_, or_, distinct
+
+from .model import Task, Execution, ExecutionArchive, BatchStat
+from .config import EXECUTION_RETENTION, EXECUTION_ARCHIVE_URI, EXECUTION_ARCHIVE_CHUNK, UI_OUTPUT_TRUNC
+from ..fetch import put, open_stream
+
+ARCHIVE_IN_DB = 'db'
+ARCHIVABLE_STATUS = ['succeeded','failed','refused']
+
+def _compress(text):
+    return None if text is None else zlib.compress(text.encode('utf-8'))
+
+def _decompress(blob):
+    return None if blob is None else zlib.decompress(blob).decode('utf-8')
+
+def _tail(text):
+    return None if text is None else text[-UI_OUTPUT_TRUNC:]
+
+def inactive_batches(session, cutoff):
+    """Batches with no task alive and no task status change since cutoff: alive tasks are counted
+    in batch_stat, and recent changes are looked up with task.status_date index, so that the
+    task table is not scanned"""
+    batches = set(session.execute(select(BatchStat.batch).where(BatchStat.count>0)).scalars())
+    batches -= set(session.execute(select(BatchStat.batch).where(BatchStat.count>0, 
+                        BatchStat.status.notin_(['succeeded','failed']))).scalars())
+    batches -= set(session.execute(select(distinct(Task.batch)).where(Task.status_date>=cutoff)).scalars())
+    return sorted(batches)
+
+def archive_executions(session, retention=EXECUTION_RETENTION, uri=EXECUTION_ARCHIVE_URI, 
+                       chunk=EXECUTION_ARCHIVE_CHUNK, dry_run=False):
+    """Archive output and error of executions older than retention days that are either
+    not the latest execution of their task or belong to an inactive batch.
+    Work chunk by chunk, each chunk in its own transaction, so that it can be
+    interrupted and relaunched at any time. Return the number of archived executions."""
+    cutoff = datetime.utcnow()-timedelta(days=retention)
+    batches = inactive_batches(session, cutoff)
+    log.warning(f'Archiving executions older than {cutoff} (inactive batches: {", ".join(batches) or "none"})')
+    condition = and_(Execution.archive.is_(None),
+                     Execution.status.in_(ARCHIVABLE_STATUS),
+                     or_(and_(Execution.latest==False, Execution.modification_date<cutoff),
+                         Execution.task_id.in_(select(Task.task_id).where(Task.batch.in_(batches)))))
+    if dry_run:
+        return session.execute(select(func.count()).select_from(Execution).where(condition)).scalar_one()
+    archived = 0
+    last_id = 0
+    while True:
+        executions = list(session.scalars(select(Execution).where(condition, Execution.execution_id>last_id).\
+                        order_by(Execution.execution_id).limit(chunk)))
+        if not executions:
+            break
+        if uri:
+            location = f"{uri.rstrip('/')}/executions_{executions[0].execution_id}_{executions[-1].execution_id}.jsonl.gz"
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                chunk_file = os.path.join(tmp_dir, os.path.basename(location))
+                with gzip.open(chunk_file, 'wt') as f:
+                    for execution in executions:
+                        f.write(json_module.dumps({'execution_id': execution.execution_id,
+                            'output': execution.output, 'error': execution.error})+'\n')
+                put(chunk_file, location)
+        else:
+            location = ARCHIVE_IN_DB
+            for execution in executions:
+                session.add(ExecutionArchive(execution_id=execution.execution_id,
+                    output=_compress(execution.output), error=_compress(execution.error)))
+        for execution in executions:
+            execution.output = _tail(execution.output)
+            execution.error = _tail(execution.error)
+            execution.archive = location
+        session.commit()
+        archived += len(executions)
+        last_id = executions[-1].execution_id
+        log.warning(f'Archived {archived} executions (up to execution {last_id})')
+    return archived
+
+class ArchiveChunkCache:
+    """The last archive chunk object read, kept compressed per execution: logs are usually looked at
+    for several executions of a batch, which were archived in the same chunk"""
+    def __init__(self):
+        self.location = None
+        self.logs = {}
+        self.lock = threading.Lock()
+
+    def get(self, location, execution_id):
+        """Return the compressed (output, error) of an execution in this chunk object, None if absent"""
+        with self.lock:
+            if location!=self.location:
+                logs = {}
+                with open_stream(location) as stream:
+                    with gzip.open(stream, 'rt') as f:
+                        for line in f:
+                            item = json_module.loads(line)
+                            logs[item['execution_id']] = (_compress(item['output']), _compress(item['error']))
+                self.location, self.logs = location, logs
+            return self.logs.get(execution_id)
+
+# work as a singleton
+archive_chunk_cache = ArchiveChunkCache()
+
+def archived_logs(execution_id, archive, session):
+    """Return the complete (output, error) of an archived execution (None if they cannot be found)"""
+    if archive==ARCHIVE_IN_DB:
+        logs = session.execute(select(ExecutionArchive.output, ExecutionArchive.error).where(
+                    ExecutionArchive.execution_id==execution_id)).one_or_none()
+    else:
+        logs = archive_chunk_cache.get(archive, execution_id)
+    if logs is None:
+        log.error(f'Could not find archived logs of execution {execution_id} in {archive}')
+        return None
+    return _decompress(logs[0]), _decompress(logs[1])
@@ -1,13 +1,12 @@
-from sqlalchemy import select, and_, func, distinct, update
+from sqlalchemy import select, and_, func, distinct, update, text
 from sqlalchemy.orm import Session, aliased
 from sqlalchemy.exc import NoResultFound
 import logging as log
 import os
 from subprocess import run, Popen, PIPE as sub_PIPE, TimeoutExpired
 import json as json_module
-from datetime import datetime
+from datetime import datetime, timedelta
 from argparse import Namespace
-import math
 from time import sleep, time
 from signal import SIGKILL
 import re
@@ -17,14 +16,17 @@ from asyncio.subprocess import PIPE as async_PIPE
 import traceback
 import shlex
 
-from .model import Worker, Task, Execution, Job, Recruiter, Requirement, Signal, worker_delete, find_flavor, Flavor
+from .model import Worker, Task, Execution, Job, Recruiter, Requirement, Signal, worker_delete, find_flavor, Flavor,\
+    WorkerStat, delete_batch_chunk, deleted_batches, find_remaining_quotas, consume_quota, flavor_catalog
 from .config import WORKER_IDLE_CALLBACK, SERVER_CRASH_WORKER_RECOVERY, WORKER_OFFLINE_DELAY, WORKER_CREATE_CONCURRENCY,\
     WORKER_CREATE, WORKER_CREATE_RETRY, MAIN_THREAD_SLEEP, IS_SQLITE, SCITQ_SHORTNAME, TERMINATE_TIMEOUT, KILL_TIMEOUT,\
-    JOB_MAX_LIFETIME
+    JOB_MAX_LIFETIME, WORKER_STAT_RETENTION, WORKER_STAT_PURGE_INTERVAL, BATCH_DELETE_TIME_SLICE,\
+    BATCH_SIGNAL_RETENTION
 from .db import db
 from ..server import get_session
-from ..util import PropagatingThread, to_obj, validate_protofilter
-from ..constants import PROTOFILTER_SEPARATOR, PROTOFILTER_SYNTAX
+from ..util import PropagatingThread, to_obj, validate_protofilter, docker_image_name
+from ..constants import PROTOFILTER_SEPARATOR, PROTOFILTER_SYNTAX, RECRUITER_DEFAULT_POLICY
+from .recruiting import needed_workers, plan_recycling
 from ..fetch import UnsupportedError, copy
 
 protofilter_syntax=re.compile(PROTOFILTER_SYNTAX)
@@ -197,6 +199,7 @@ def background(app):
         other_process_queue.append(('Worker access task',process))
         process.start()
 
+    last_stat_purge = None
     while True:
         log.warning('Starting main loop')
         pending_job = None
@@ -212,12 +215,19 @@ def background(app):
 
 
             task_list = list(session.query(Task).filter(
-                    Task.status=='pending').with_entities(Task.task_id, Task.batch, Task.use_cache))
+                    Task.status=='pending').with_entities(Task.task_id, Task.batch, Task.use_cache, Task.container))
+            # tasks of a batch being deleted are not dispatched anymore
+            deleting = deleted_batches(session)
+            if deleting:
+                task_list = [task for task in task_list if task.task_id > deleting.get(task.batch, 0)]
             if task_list:
 
                 worker_list = list(session.query(Worker).filter(
                             Worker.status=='running').with_entities(
-                            Worker.worker_id,Worker.batch,Worker.concurrency,Worker.prefetch,Worker.task_properties))
+                            Worker.worker_id,Worker.batch,Worker.concurrency,Worker.prefetch,Worker.task_properties,
+                            Worker.images))
+                worker_images = {worker.worker_id: set(worker.images.split()) if worker.images else set() 
+                                    for worker in worker_list}
                 execution_per_worker_list = session.query(Execution.worker_id,Task.batch,Execution.status).\
                                                 join(Execution.task).filter(and_(
                                                 Execution.worker_id.in_(list([w.worker_id for w in worker_list])),
@@ -236,6 +246,7 @@ def background(app):
                         execution_per_worker[worker_id] += 1
 
                 changed = False             
+                changed_tasks = []
                 for task in task_list:
                     if task.use_cache:
                         #
@@ -285,6 +296,7 @@ def background(app):
                                 execution.output_files=other_execution.output_files
                                 execution.output=f'Cached from execution {other_execution.execution_id}'
                                 session.add(execution)
+                                changed_tasks.append(complete_task.task_id)
                                 completed_by_cached=True
                                 changed=True
                                 break
@@ -292,7 +304,14 @@ def background(app):
                         if completed_by_cached:
                             continue
 
-                    for worker in worker_list:
+                    if task.container:
+                        # prefer workers that already have the docker image
+                        image = docker_image_name(task.container)
+                        candidate_workers = [worker for worker in worker_list if image in worker_images[worker.worker_id]] + \
+                            [worker for worker in worker_list if image not in worker_images[worker.worker_id]]
+                    else:
+                        candidate_workers = worker_list
+                    for worker in candidate_workers:
                         if worker.batch != task.batch:
                             continue
                         if execution_per_worker.get(worker.worker_id,0)<(worker.concurrency+worker.prefetch):
@@ -301,11 +320,17 @@ def background(app):
                             session.query(Task).filter(Task.task_id==task.task_id).update(
                                 {'status':'assigned'}
                             )
+                            changed_tasks.append(task.task_id)
                             execution_per_worker[worker.worker_id] = execution_per_worker.get(worker.worker_id,0)+1
                             log.info(f'Execution of task {task.task_id} proposed to worker {worker.worker_id}')
                             changed = True
                             break
-                if changed:
+                if changed or changed_tasks:
+                    # status_date is the cursor of /tasks/changes feed: it is stamped right before
+                    # commit, not when the task was processed, for the change not to fall behind
+                    # the cursor of a client that read in between
+                    session.query(Task).filter(Task.task_id.in_(changed_tasks)).update(
+                        {'status_date':datetime.utcnow()}, synchronize_session=False)
                     session.commit()
             now = datetime.utcnow()
 
@@ -355,6 +380,19 @@ def background(app):
                         change = True
                 if change:
                     session.commit()
+
+            if last_stat_purge is None or time()-last_stat_purge > WORKER_STAT_PURGE_INTERVAL:
+                log.warning('Purging old worker stats')
+                session.query(WorkerStat).filter(
+                    WorkerStat.stat_date < now - timedelta(seconds=WORKER_STAT_RETENTION)
+                ).delete(synchronize_session=False)
+                session.commit()
+                last_stat_purge = time()
+
+            if session.query(Signal).filter(Signal.batch.isnot(None),
+                    Signal.creation_date < now - timedelta(seconds=BATCH_SIGNAL_RETENTION)
+                ).delete(synchronize_session=False):
+                session.commit()
             
 
             #        ##  #######  ########     ########  ########   #######   ######  ########  ######   ######  #### ##    ##  ######   
@@ -369,6 +407,12 @@ def background(app):
             for job in list(session.query(Job).filter(Job.status == 'pending')):
                 pending_job = job
 
+                if job.action == 'batch_delete':
+                    log.warning(f'Starting deletion of batch {job.target}')
+                    job.status = 'running'
+                    job.progression = 0
+                    change = True
+
                 if job.action == 'worker_destroy':
                     change=True
                     if ('destroy',job.target) in worker_process_queue:
@@ -559,6 +603,8 @@ def background(app):
                     worker_process_status.value = JobFollower.STATUS_KILL
 
             for job in list(session.query(Job).filter(Job.status == 'running')):
+                if job.action=='batch_delete':
+                    continue
                 if job.action=='worker_deploy':
                     action='create'
                 elif job.action=='worker_destroy':
@@ -573,6 +619,26 @@ def background(app):
             if change:
                 session.commit()
                 
+            # batch deletion: a few chunks per loop so that scheduling is never blocked for long
+            deadline = time()+BATCH_DELETE_TIME_SLICE
+            for job in list(session.query(Job).filter(Job.status == 'running', Job.action == 'batch_delete')):
+                pending_job = job
+                while time()<deadline:
+                    deleted = 0 if job.args['max_task_id'] is None else \
+                        delete_batch_chunk(job.target, job.args['max_task_id'], session)
+                    if deleted:
+                        job.args = dict(job.args, deleted=job.args.get('deleted',0)+deleted)
+                        job.progression = min(99, 100*job.args['deleted']//max(job.args['total'],1))
+                        job.log = f"{job.args['deleted']} tasks deleted"
+                    else:
+                        log.warning(f'Batch {job.target} deleted')
+                        job.status = 'succeeded'
+                        job.progression = 100
+                    session.commit()
+                    if job.status == 'succeeded':
+                        break
+            pending_job = None
+
             for process_name, process in list(other_process_queue):
                 try:
                     if not process.is_alive():
@@ -635,7 +701,9 @@ def background(app):
             #        join(Task,and_(Task.batch==Recruiter.batch,Task.status=='pending')).\
             #        join(Worker,and_(Worker.batch==Recruiter.batch,Worker.status!='running'),isouter=True).\
             #        group_by(Recruiter.batch,Recruiter.rank).order_by(Recruiter.batch,Recruiter.rank))
-            newly_recruited_workers = []   
+            # remaining quotas are computed once per round (when needed) and updated as jobs are created
+            quotas = None
+            needs = []
             for recruiter,pending_tasks,workers in active_recruiters:
                 log.warning(f'-> recruiting for recruiter {recruiter} with {pending_tasks} pending tasks and {workers} current workers')
                 if recruiter.minimum_tasks and recruiter.minimum_tasks > pending_tasks:
@@ -644,8 +712,8 @@ def background(app):
                 if recruiter.maximum_workers and recruiter.maximum_workers <= workers:
                     log.warning(f'  --> too many workers already, not recruiting ({recruiter} has reached the maximum of {recruiter.maximum_workers})')
                     continue
-                nb_workers = math.ceil(pending_tasks/recruiter.tasks_per_worker) - workers
-                log.warning(f'  --> we need {nb_workers} because {pending_tasks} pending tasks ({recruiter.tasks_per_worker} expected per worker) and we already have {workers} workers.')
+                nb_workers = needed_workers(recruiter, pending_tasks, workers, session)
+                log.warning(f'  --> we need {nb_workers} because {pending_tasks} pending tasks ({recruiter.policy or RECRUITER_DEFAULT_POLICY} policy, {recruiter.tasks_per_worker} tasks per worker) and we already have {workers} workers.')
                 if recruiter.maximum_workers and recruiter.maximum_workers < nb_workers + workers:
                     nb_workers = recruiter.maximum_workers - workers
                     log.warning(f'  --> adjusting to {nb_workers} because maximum is {recruiter.maximum_workers} and \
@@ -653,49 +721,40 @@ we already have {workers} workers')
                 if nb_workers <= 0:
                     log.warning(f'  --> giving up')
                     continue
-                
-                if len(recyclable_worker_active_tasks.items())==0:
-                    log.warning(f'  --> No recyclable workers {recyclable_worker_active_tasks}')
-                for worker, active_tasks  in recyclable_worker_active_tasks.items():  
-                    if worker.batch != recruiter.batch and recruiter.match_flavor(worker, session=session) \
-                            and active_tasks<worker.concurrency and nb_workers>0 and worker not in newly_recruited_workers:
-                        previous_batch = worker.batch
-                        previous_concurrency = worker.concurrency
-                        previous_task_properties = worker_task_properties[worker]
-
-                        task_ratio = recruiter.worker_concurrency / previous_concurrency
-                        task_properties = dict([(batch, ( max(ratio*task_ratio,recruiter.worker_concurrency) , prio+1 )) 
-                                                for batch,(ratio,prio) in previous_task_properties.items()])
-                        task_properties[previous_batch] = (task_ratio,1)
-
-                        if recruiter.batch in task_properties:
-                            log.warning(f'-> Recruiter {recruiter} tried to recycle {worker} but some task of the same batch from a previous recycling round are present, giving up')
-                            continue
-                        
-                        log.warning(f'-> Recruiting worker {worker} from batch {previous_batch} to {recruiter.batch}')
-                        newly_recruited_workers.append(worker)
-                        change = True
-                        worker.batch = recruiter.batch
-                        worker.prefetch = recruiter.worker_prefetch
-                        worker.concurrency = recruiter.worker_concurrency
-                        worker.task_properties = json_module.dumps(task_properties)
-                        session.add(worker)
-                        nb_workers -= 1
-                    else:
-                        if worker.batch == recruiter.batch:
-                            reason = 'already recruited'
-                        elif worker.flavor != recruiter.worker_flavor:
-                            reason = 'not the right flavor'
-                        elif active_tasks>=worker.concurrency:
-                            reason = f'too busy {active_tasks}>={worker.concurrency}'
-                        elif nb_workers <= 0:
-                            reason = f'no more workers needed'
-                        elif worker in newly_recruited_workers:
-                            reason = f'it was recently recruited by another recruiter'
-                        else:
-                            reason = f'something mysterious that should never occur'
-                        log.warning(f'  --> {worker} not suitable because {reason} ')
-                
+                needs.append((recruiter, nb_workers))
+
+            # recycling is planned for all recruiters at once, then remaining needs are deployed
+            recycled = {}
+            if needs and recyclable_worker_active_tasks:
+                plan = plan_recycling(needs, recyclable_worker_active_tasks, worker_task_properties, session)
+                for recruiter, worker, utilization in plan:
+                    previous_batch = worker.batch
+                    previous_concurrency = worker.concurrency
+                    previous_task_properties = worker_task_properties[worker]
+
+                    task_ratio = recruiter.worker_concurrency / previous_concurrency
+                    task_properties = dict([(batch, ( max(ratio*task_ratio,recruiter.worker_concurrency) , prio+1 )) 
+                                            for batch,(ratio,prio) in previous_task_properties.items()])
+                    task_properties[previous_batch] = (task_ratio,1)
+
+                    log.warning(f'-> Recruiting worker {worker} from batch {previous_batch} to {recruiter.batch} \
+(expected utilization {"unknown" if utilization is None else f"{utilization:.0%}"})')
+                    change = True
+                    worker.batch = recruiter.batch
+                    worker.prefetch = recruiter.worker_prefetch
+                    worker.concurrency = recruiter.worker_concurrency
+                    worker.task_properties = json_module.dumps(task_properties)
+                    session.add(worker)
+                    recycled[recruiter] = recycled.get(recruiter, 0) + 1
+                utilizations = [utilization for _,_,utilization in plan if utilization is not None]
+                if plan:
+                    log.warning(f'-> Recycled {len(plan)} workers'+(f', mean expected utilization {sum(utilizations)/len(utilizations):.0%}' 
+                                                                   if utilizations else ''))
+            elif needs:
+                log.warning(f'  --> No recyclable workers')
+
+            for recruiter, nb_workers in needs:
+                nb_workers -= recycled.get(recruiter, 0)
                 if recruiter.worker_provider is not None and recruiter.worker_region is not None and nb_workers>0:
                     if recruiter.worker_provider=='auto' or recruiter.worker_region=='auto' or recruiter.worker_flavor.startswith('auto'):
                         log.warning(' -> Auto recruiter detected')
@@ -711,15 +770,19 @@ we already have {workers} workers')
                             worker_flavor=recruiter.worker_flavor
                         worker_to_find=nb_workers
                         
+                        if quotas is None:
+                            quotas = find_remaining_quotas(session)
+                        flavor_list=find_flavor(session, provider=worker_provider, region=worker_region, 
+                                                        flavor=worker_flavor, protofilters=protofilters, limit=None,
+                                                        quotas=quotas)
                         while worker_to_find>0:
-                            flavor_list=find_flavor(session, provider=worker_provider, region=worker_region, 
-                                                            flavor=worker_flavor, protofilters=protofilters, limit=None)
                             for current_flavor in flavor_list:
-                                if current_flavor['available']>0:
+                                if current_flavor['available'] is None or current_flavor['available']>0:
                                     break
                             else:
                                 break
                             worker_to_find-=1
+                            consume_quota(flavor_list, current_flavor, quotas)
                             current_flavor=to_obj(current_flavor)
                             log.warning(f'-> Deploying one worker from {current_flavor.provider},{current_flavor.region} : {current_flavor.name}')
                             session.add(
@@ -743,6 +806,9 @@ we already have {workers} workers')
 
 
                     else:
+                        if quotas is not None and (recruiter.worker_provider,recruiter.worker_region) in quotas:
+                            quotas[(recruiter.worker_provider,recruiter.worker_region)] -= nb_workers * \
+                                flavor_catalog.cpu(recruiter.worker_flavor,recruiter.worker_provider)
                         for _ in range(nb_workers):
                             log.warning(f'-> Deploying one worker from {recruiter.worker_provider}')
                             session.add(
@@ -782,7 +848,7 @@ we already have {workers} workers')
             #active_requirements = session.query(task1,task2.status).\
             #                        join(task1,Requirement.task).filter(task1.status == 'waiting').\
             #                        join(task2,Requirement.other_task).groupby(task1.id)
-            session.execute('''
+            session.execute(text('''
 WITH TaskProgress AS (
     SELECT 
         t1.task_id,
@@ -798,12 +864,12 @@ WITH TaskProgress AS (
         t1.task_id
 )
 UPDATE task
-SET status = 'pending'
+SET status = 'pending', status_date = :now
 WHERE task_id IN (
     SELECT task_id
     FROM TaskProgress
     WHERE success = total
-)''')
+)'''), {'now': datetime.utcnow()})
             session.commit()
 
 
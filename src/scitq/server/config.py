@@ -38,6 +38,10 @@ WORKER_CREATE_RETRY=2
 WORKER_CREATE_RETRY_SLEEP=30
 UI_OUTPUT_TRUNC=100
 UI_MAX_DISPLAYED_ROW = 500
+# dashboard data is queried at most once per UI_FEED_PERIOD seconds by each server process
+# whatever the number of browsers, which receive only what changed in the last UI_FEED_HISTORY seconds
+UI_FEED_PERIOD=2
+UI_FEED_HISTORY=600
 WORKER_DESTROY_RETRY=2
 DEFAULT_BATCH = 'Default'
 TERMINATE_TIMEOUT = 20
@@ -74,6 +78,48 @@ EVICTION_COST_MARGIN=_num('EVICTION_COST_MARGIN', default=10)
 
 REMOTE_URI=_('REMOTE_URI')
 
+# worker telemetry history (WorkerStat rows) older than this (in seconds) is purged
+WORKER_STAT_RETENTION=_num('WORKER_STAT_RETENTION', default=3*24*3600)
+WORKER_STAT_PURGE_INTERVAL=600
+
+# execution archival (scitq-manage db archive): output/error of executions older than 
+# EXECUTION_RETENTION days (non latest or in inactive batches) are moved to execution_archive
+# table or as compressed chunks to EXECUTION_ARCHIVE_URI if set, only a short tail is kept
+EXECUTION_RETENTION=_num('EXECUTION_RETENTION', default=90)
+EXECUTION_ARCHIVE_URI=_('EXECUTION_ARCHIVE_URI')
+EXECUTION_ARCHIVE_CHUNK=1000
+
+# batch deletion is done by a batch_delete job in the background loop, deleting tasks by
+# chunks of BATCH_DELETE_CHUNK (one transaction each) for at most BATCH_DELETE_TIME_SLICE seconds per loop
+BATCH_DELETE_CHUNK=_num('BATCH_DELETE_CHUNK', default=1000)
+BATCH_DELETE_TIME_SLICE=2
+
+# batch-wide signals are stored once and delivered in each worker ping answer until purged
+# after BATCH_SIGNAL_RETENTION seconds (workers ping every few seconds)
+BATCH_SIGNAL_RETENTION=300
+
+# flavors and their metrics are kept in memory (see model.FlavorCatalog), and reloaded from
+# database every FLAVOR_CATALOG_CHECK_INTERVAL seconds
+FLAVOR_CATALOG_CHECK_INTERVAL=10
+
+# drain recruiter policy (see recruiting.py): a new worker is deployed only if it should work at least 
+# RECRUITER_DRAIN_EFFICIENCY of the time it is paid for (deploy time included), deploy time is estimated on the
+# last RECRUITER_DEPLOY_HISTORY successful deploys (RECRUITER_DEFAULT_DEPLOY_TIME seconds if there are none)
+# and task duration needs RECRUITER_MIN_DURATION_SAMPLES finished tasks (the tasks_per_worker rule is used before)
+RECRUITER_DRAIN_EFFICIENCY=_num('RECRUITER_DRAIN_EFFICIENCY', default=0.5)
+RECRUITER_DEFAULT_DEPLOY_TIME=_num('RECRUITER_DEFAULT_DEPLOY_TIME', default=300)
+RECRUITER_DEPLOY_HISTORY=50
+RECRUITER_MIN_DURATION_SAMPLES=5
+
+# /tasks/changes feed: the cursor is the latest status_date seen by the client, replayed this
+# many seconds back to catch transactions that stamped status_date just before committing
+# (status_date is stamped right before commit, so this only covers a flush and a commit)
+TASK_CHANGES_OVERLAP=5
+
+# responses bigger than COMPRESS_MIN_SIZE bytes are gzipped if the client accepts it
+COMPRESS_MIN_SIZE=1024
+COMPRESS_LEVEL=5
+
 def get_quotas(provider=None):
     if provider=='ovh':
         return dict(zip(OVH_REGIONS.split(),map(int,OVH_CPUQUOTAS.split())))
@@ -0,0 +1,34 @@
+import gzip
+import json as json_module
+from flask import request, make_response
+
+from .config import COMPRESS_MIN_SIZE, COMPRESS_LEVEL
+from ..constants import COLUMNS_MIMETYPE
+from ..util import to_columns
+
+COMPRESSIBLE_MIMETYPES = ['application/json', COLUMNS_MIMETYPE, 'text/html', 'text/css', 
+                          'text/plain', 'application/javascript']
+
+def compress_response(response):
+    """An after_request hook that gzip the response when the client accepts it
+    and the response is big enough to benefit from it"""
+    if response.direct_passthrough or response.is_streamed \
+            or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES \
+            or 'gzip' not in request.headers.get('Accept-Encoding','').lower():
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def output_columns(data, code, headers=None):
+    """A flask-restx representation rendering lists of objects in column-oriented
+    compact JSON (see util.to_columns), the keys being sent only once"""
+    response = make_response(json_module.dumps(to_columns(data), separators=(',',':')), code)
+    response.headers.extend(headers or {})
+    response.headers['Content-Type'] = COLUMNS_MIMETYPE
+    return response
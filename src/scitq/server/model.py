@@ -1,15 +1,20 @@
 from datetime import datetime
 import json as json_module
-from sqlalchemy import DDL, event, func, delete, select, or_, and_, tuple_
+from sqlalchemy import DDL, event, func, delete, select, or_, and_, tuple_, text
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy import func
 import hashlib
 import os
+import re
+import operator
+from functools import lru_cache
+from time import time
 
-from .config import DEFAULT_BATCH, WORKER_DESTROY_RETRY, get_quotas, EVICTION_ACTION, EVICTION_COST_MARGIN, PREFERRED_REGIONS
+from .config import DEFAULT_BATCH, WORKER_DESTROY_RETRY, BATCH_DELETE_CHUNK, get_quotas, EVICTION_ACTION, EVICTION_COST_MARGIN, PREFERRED_REGIONS,\
+    FLAVOR_CATALOG_CHECK_INTERVAL
 from .db import db
-from ..util import to_dict, validate_protofilter, protofilter_syntax, PROTOFILTER_SEPARATOR, is_like, has_tag
-from ..constants import FLAVOR_DEFAULT_EVICTION, FLAVOR_DEFAULT_LIMIT, EXECUTION_STATUS, WORKER_STATUS
+from ..util import to_dict, validate_protofilter, protofilter_syntax, PROTOFILTER_SEPARATOR
+from ..constants import FLAVOR_DEFAULT_EVICTION, FLAVOR_DEFAULT_LIMIT, EXECUTION_STATUS, WORKER_STATUS, RECRUITER_POLICY_NAMES
 from ..fetch import list_content, info, FetchError, UnsupportedError
 
 import logging as log
@@ -27,14 +32,14 @@ class Task(db.Model):
     status = db.Column(db.String, nullable=False)
     creation_date = db.Column(db.DateTime, nullable=False)
     modification_date = db.Column(db.DateTime)
-    batch = db.Column(db.String, nullable=False, default=DEFAULT_BATCH)
+    batch = db.Column(db.String, nullable=False, default=DEFAULT_BATCH, index=True)
     input = db.Column(db.String, nullable=True)
     output = db.Column(db.String, nullable=True)
     container = db.Column(db.String, nullable=True)
     container_options = db.Column(db.String, nullable=True)
     resource = db.Column(db.String, nullable=True)
     retry = db.Column(db.Integer, nullable=False, default=0)
-    status_date = db.Column(db.DateTime)
+    status_date = db.Column(db.DateTime, index=True)
     download_timeout = db.Column(db.Integer, nullable=True)
     run_timeout = db.Column(db.Integer, nullable=True)
     use_cache = db.Column(db.Boolean, default=False)
@@ -63,6 +68,13 @@ class Task(db.Model):
         self.run_timeout = run_timeout
         self.use_cache = use_cache
 
+@event.listens_for(Task.status, 'set')
+def task_status_date(task, value, oldvalue, initiator):
+    """Keep status_date in line with status whatever the code path that changes it,
+    this date is the cursor of /tasks/changes feed"""
+    if value != oldvalue:
+        task.status_date = datetime.utcnow()
+
 
 class Worker(db.Model):
     __tablename__ = "worker"
@@ -89,6 +101,7 @@ class Worker(db.Model):
     ansible_host = db.Column(db.String, nullable=True)
     ansible_group = db.Column(db.String, nullable=True)
     ansible_active = db.Column(db.Boolean, default=False)
+    images = db.Column(db.String, nullable=True)
     signals = db.relationship("Signal", cascade="all,delete")
 
     def __init__(self, name, concurrency, prefetch=0, hostname=None, 
@@ -105,7 +118,46 @@ class Worker(db.Model):
         self.region = region
         self.flavor = flavor
         self.provider = provider
-     
+
+
+class WorkerStat(db.Model):
+    """A time series of numerical worker telemetry (one row per worker sample)"""
+    __tablename__ = "worker_stat"
+    worker_stat_id = db.Column(db.Integer, primary_key=True)
+    worker_id = db.Column(db.Integer, db.ForeignKey("worker.worker_id"), nullable=False, index=True)
+    stat_date = db.Column(db.DateTime, nullable=False, index=True)
+    cpu = db.Column(db.Float)
+    iowait = db.Column(db.Float)
+    memory = db.Column(db.Float)
+    load = db.Column(db.Float)
+    disk_read = db.Column(db.Float)
+    disk_write = db.Column(db.Float)
+    network_sent = db.Column(db.Float)
+    network_recv = db.Column(db.Float)
+    scratch_usage = db.Column(db.Float)
+
+    SAMPLE_FIELDS = ['cpu','iowait','memory','load','disk_read','disk_write',
+                     'network_sent','network_recv','scratch_usage']
+
+    def __init__(self, worker_id, stat_date, **sample):
+        self.worker_id = worker_id
+        self.stat_date = stat_date
+        for field in self.SAMPLE_FIELDS:
+            setattr(self, field, sample.get(field))
+
+
+def worker_merge_stats(previous_stats, stats, delta=False):
+    """Return the JSON stats string to store for a worker: if delta is set, stats only
+    contains the top level keys that changed since last ping and is merged with previous_stats"""
+    if not delta or not stats:
+        return stats
+    try:
+        merged = json_module.loads(previous_stats) if previous_stats else {}
+    except ValueError:
+        merged = {}
+    merged.update(json_module.loads(stats))
+    return json_module.dumps(merged)
+
 
 class Execution(db.Model):
     __tablename__ = "execution"
@@ -117,7 +169,7 @@ class Execution(db.Model):
                          uselist=True,
                          cascade='save-update',
                          order_by='Execution.modification_date.desc()'))
-    task_id = db.Column(db.Integer, db.ForeignKey("task.task_id"), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey("task.task_id"), nullable=False, index=True)
     task = db.relationship(
         Task,
         backref=db.backref('executions',
@@ -141,6 +193,7 @@ class Execution(db.Model):
     input_hash = db.Column(db.String, index=True, nullable=True)
     output_hash = db.Column(db.String, nullable=True)
     latest = db.Column(db.Boolean, default=True)
+    archive = db.Column(db.String, nullable=True)
 
 
     def __init__(self, worker_id, task_id, status='pending', pid=None, 
@@ -256,6 +309,193 @@ event.listen(
     trigger_latest_postgres.execute_if(dialect="postgresql")    
 )
 
+
+class BatchStat(db.Model):
+    """Per batch statistics maintained by triggers on task and execution: count is
+    the number of tasks in this status (the task status, not the status of its latest
+    execution), durations (in seconds) are those of all the executions that ended in
+    this status, including retried (non latest) ones"""
+    __tablename__ = "batch_stat"
+    batch = db.Column(db.String, primary_key=True)
+    status = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, server_default='0')
+    duration_count = db.Column(db.Integer, nullable=False, server_default='0')
+    duration_sum = db.Column(db.Float, nullable=False, server_default='0')
+    duration_min = db.Column(db.Float)
+    duration_max = db.Column(db.Float)
+
+BATCH_STAT_TASK_INCREMENT = """INSERT INTO batch_stat (batch,status,count) VALUES (NEW.batch,NEW.status,1)
+            ON CONFLICT (batch,status) DO UPDATE SET count=batch_stat.count+1;"""
+BATCH_STAT_TASK_DECREMENT = """UPDATE batch_stat SET count=count-1 WHERE batch=OLD.batch AND status=OLD.status;"""
+BATCH_STAT_EXECUTION_CONDITION = """NEW.status IN ('succeeded','failed') AND OLD.status NOT IN ('succeeded','failed')
+            AND NEW.modification_date IS NOT NULL AND NEW.creation_date IS NOT NULL"""
+
+batch_stat_sqlite = [
+    (Task, DDL(f"""
+        CREATE TRIGGER batch_stat_task_insert AFTER INSERT ON task FOR EACH ROW 
+        BEGIN
+            {BATCH_STAT_TASK_INCREMENT}
+        END
+        """)),
+    (Task, DDL(f"""
+        CREATE TRIGGER batch_stat_task_update AFTER UPDATE OF status,batch ON task FOR EACH ROW 
+        BEGIN
+            {BATCH_STAT_TASK_DECREMENT}
+            {BATCH_STAT_TASK_INCREMENT}
+        END
+        """)),
+    (Task, DDL(f"""
+        CREATE TRIGGER batch_stat_task_delete AFTER DELETE ON task FOR EACH ROW 
+        BEGIN
+            {BATCH_STAT_TASK_DECREMENT}
+        END
+        """)),
+    (Execution, DDL(f"""
+        CREATE TRIGGER batch_stat_execution AFTER UPDATE OF status ON execution FOR EACH ROW 
+        WHEN {BATCH_STAT_EXECUTION_CONDITION}
+        BEGIN
+            INSERT INTO batch_stat (batch,status,duration_count,duration_sum,duration_min,duration_max)
+            SELECT batch,NEW.status,1,duration,duration,duration FROM (
+                SELECT batch,(JULIANDAY(NEW.modification_date)-JULIANDAY(NEW.creation_date))*86400 AS duration
+                FROM task WHERE task_id=NEW.task_id) WHERE true
+            ON CONFLICT (batch,status) DO UPDATE SET duration_count=batch_stat.duration_count+1,
+                duration_sum=batch_stat.duration_sum+excluded.duration_sum,
+                duration_min=MIN(COALESCE(batch_stat.duration_min,excluded.duration_min),excluded.duration_min),
+                duration_max=MAX(COALESCE(batch_stat.duration_max,excluded.duration_max),excluded.duration_max);
+        END
+        """)),
+]
+
+batch_stat_postgres = [
+    (Task, DDL(f"""
+        CREATE OR REPLACE FUNCTION batch_stat_task() 
+        RETURNS TRIGGER
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE','DELETE') THEN
+                {BATCH_STAT_TASK_DECREMENT}
+            END IF;
+            IF TG_OP IN ('INSERT','UPDATE') THEN
+                {BATCH_STAT_TASK_INCREMENT}
+            END IF;
+            RETURN NULL;
+        END;
+        $$
+        """)),
+    (Task, DDL("""
+CREATE TRIGGER batch_stat_task AFTER INSERT OR DELETE OR UPDATE OF status,batch ON task FOR EACH ROW EXECUTE PROCEDURE batch_stat_task()
+""")),
+    (Execution, DDL("""
+        CREATE OR REPLACE FUNCTION batch_stat_execution() 
+        RETURNS TRIGGER
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            INSERT INTO batch_stat (batch,status,duration_count,duration_sum,duration_min,duration_max)
+            SELECT batch,NEW.status,1,duration,duration,duration FROM (
+                SELECT batch,EXTRACT(EPOCH FROM (NEW.modification_date-NEW.creation_date)) AS duration
+                FROM task WHERE task_id=NEW.task_id) AS d
+            ON CONFLICT (batch,status) DO UPDATE SET duration_count=batch_stat.duration_count+1,
+                duration_sum=batch_stat.duration_sum+EXCLUDED.duration_sum,
+                duration_min=LEAST(batch_stat.duration_min,EXCLUDED.duration_min),
+                duration_max=GREATEST(batch_stat.duration_max,EXCLUDED.duration_max);
+            RETURN NULL;
+        END;
+        $$
+        """)),
+    (Execution, DDL(f"""
+CREATE TRIGGER batch_stat_execution AFTER UPDATE OF status ON execution FOR EACH ROW 
+WHEN ({BATCH_STAT_EXECUTION_CONDITION}) EXECUTE PROCEDURE batch_stat_execution()
+""")),
+]
+
+for table,ddl in batch_stat_sqlite:
+    event.listen(
+        table.__table__, 'after_create',
+        ddl.execute_if(dialect="sqlite")
+    )
+for table,ddl in batch_stat_postgres:
+    event.listen(
+        table.__table__, 'after_create',
+        ddl.execute_if(dialect="postgresql")
+    )
+
+class ExecutionArchive(db.Model):
+    """Compressed output and error of archived executions (see archive.py)"""
+    __tablename__ = "execution_archive"
+    execution_id = db.Column(db.Integer, primary_key=True)
+    output = db.Column(db.LargeBinary)
+    error = db.Column(db.LargeBinary)
+
+class WorkerExecutionCount(db.Model):
+    """Number of executions per worker and status, maintained by triggers on execution"""
+    __tablename__ = "worker_execution_count"
+    worker_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, server_default='0')
+
+# executions reused from the cache have no worker and are not counted
+WORKER_EXECUTION_INCREMENT = """INSERT INTO worker_execution_count (worker_id,status,count) 
+            SELECT NEW.worker_id,NEW.status,1 WHERE NEW.worker_id IS NOT NULL
+            ON CONFLICT (worker_id,status) DO UPDATE SET count=worker_execution_count.count+1;"""
+WORKER_EXECUTION_DECREMENT = """UPDATE worker_execution_count SET count=count-1 WHERE worker_id=OLD.worker_id AND status=OLD.status;"""
+
+worker_execution_count_sqlite = [
+    DDL(f"""
+        CREATE TRIGGER worker_execution_count_insert AFTER INSERT ON execution FOR EACH ROW 
+        BEGIN
+            {WORKER_EXECUTION_INCREMENT}
+        END
+        """),
+    DDL(f"""
+        CREATE TRIGGER worker_execution_count_update AFTER UPDATE OF status,worker_id ON execution FOR EACH ROW 
+        BEGIN
+            {WORKER_EXECUTION_DECREMENT}
+            {WORKER_EXECUTION_INCREMENT}
+        END
+        """),
+    DDL(f"""
+        CREATE TRIGGER worker_execution_count_delete AFTER DELETE ON execution FOR EACH ROW 
+        BEGIN
+            {WORKER_EXECUTION_DECREMENT}
+        END
+        """),
+]
+
+worker_execution_count_postgres = [
+    DDL(f"""
+        CREATE OR REPLACE FUNCTION worker_execution_count() 
+        RETURNS TRIGGER
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE','DELETE') THEN
+                {WORKER_EXECUTION_DECREMENT}
+            END IF;
+            IF TG_OP IN ('INSERT','UPDATE') THEN
+                {WORKER_EXECUTION_INCREMENT}
+            END IF;
+            RETURN NULL;
+        END;
+        $$
+        """),
+    DDL("""
+CREATE TRIGGER worker_execution_count AFTER INSERT OR DELETE OR UPDATE OF status,worker_id ON execution FOR EACH ROW EXECUTE PROCEDURE worker_execution_count()
+"""),
+]
+
+for ddl in worker_execution_count_sqlite:
+    event.listen(
+        Execution.__table__, 'after_create',
+        ddl.execute_if(dialect="sqlite")
+    )
+for ddl in worker_execution_count_postgres:
+    event.listen(
+        Execution.__table__, 'after_create',
+        ddl.execute_if(dialect="postgresql")
+    )
+
 def execution_update_status(execution, session, status, commit=True):
     """Change status of an execution, impacting on task if required"""
     if status not in EXECUTION_STATUS:
@@ -316,19 +556,66 @@ class Signal(db.Model):
     __tablename__ = "signal"
     #execution_id = db.Column(db.Integer, db.ForeignKey("execution.execution_id"), primary_key=True, nullable=True)
     signal_id = db.Column(db.Integer, primary_key=True)
-    execution_id = db.Column(db.Integer, db.ForeignKey("execution.execution_id"), nullable=True)
+    execution_id = db.Column(db.Integer, db.ForeignKey("execution.execution_id"), nullable=True, index=True)
     worker_id = db.Column(db.Integer, db.ForeignKey("worker.worker_id"))
     signal = db.Column(db.Integer, nullable=False)    
+    batch = db.Column(db.String, nullable=True, index=True)
+    creation_date = db.Column(db.DateTime, nullable=True)
+    execution_ids = db.Column(db.JSON, nullable=True)
     execution = db.relationship(
         Execution,
         backref=db.backref('signals',
                             uselist=True,
                             cascade='delete,all'))
 
-    def __init__(self, execution_id, worker_id, signal):
+    def __init__(self, execution_id, worker_id, signal, batch=None, execution_ids=None):
         self.execution_id = execution_id
         self.worker_id = worker_id
         self.signal = signal
+        self.batch = batch
+        self.execution_ids = execution_ids
+        self.creation_date = datetime.utcnow()
+
+def create_batch_signal(batch, signal, session, commit=True):
+    """Send a signal to all running executions of a batch: the signal is stored once for the batch 
+    (without worker or execution) with the ids of the executions running at that time, and expanded
+    for each worker in its ping answer, see worker_signals"""
+    log.warning(f'Sending signal {signal} to executions for batch {batch}')
+    execution_ids = list(session.execute(select(Execution.execution_id).join(Execution.task).where(
+        Task.batch==batch, Execution.status=='running')).scalars())
+    session.add(Signal(None, None, signal, batch=batch, execution_ids=execution_ids))
+    if commit:
+        session.commit()
+
+def worker_batch_signals(worker_id, session, for_update=False):
+    """Return the batch signals of a worker as a list of (signal, execution_id), for the executions
+    of the worker that were running when the signal was sent and still are"""
+    running = dict(session.execute(select(Execution.execution_id, Task.batch).join(Execution.task).where(
+                    Execution.worker_id==worker_id, Execution.status=='running')).all())
+    if not running:
+        return []
+    query = select(Signal).where(Signal.batch.in_(set(running.values()))).order_by(Signal.signal_id)
+    if for_update:
+        query = query.with_for_update()
+    return [(signal, execution_id) for signal in session.execute(query).scalars()
+                for execution_id in signal.execution_ids or [] if running.get(execution_id)==signal.batch]
+
+def worker_signals(worker_id, session, acknowledged=None):
+    """Delete the signals acknowledged by a worker and return its pending signals (as dicts), 
+    that is its own signals plus batch signals expanded to its executions that were running when 
+    the signal was sent, see worker_batch_signals (batch signals are purged after BATCH_SIGNAL_RETENTION
+    seconds, and a worker is expected to ignore a signal_id/execution_id pair it has already received)"""
+    if acknowledged:
+        session.execute(delete(Signal).where(Signal.worker_id==worker_id, Signal.signal_id.in_(acknowledged)),
+            execution_options={'synchronize_session':False})
+        session.commit()
+    signals = [{'signal_id':signal_id, 'execution_id':execution_id, 'signal':signal, 'batch':None} 
+               for signal_id, execution_id, signal in session.execute(
+                    select(Signal.signal_id, Signal.execution_id, Signal.signal).where(
+                        Signal.worker_id==worker_id).order_by(Signal.signal_id))]
+    signals.extend({'signal_id':signal.signal_id, 'execution_id':execution_id, 'signal':signal.signal, 
+                    'batch':signal.batch} for signal, execution_id in worker_batch_signals(worker_id, session))
+    return signals
 
 
 class Job(db.Model):
@@ -361,7 +648,12 @@ def worker_delete(worker, session, is_destroyed=False, commit=True):
             execution_update_status(execution, session, 'failed')
         for execution in session.query(Execution).filter(Execution.worker_id==worker.worker_id, Execution.status.in_(['pending','accepted'])):
             execution_update_status(execution, session, 'refused')
+        # stat history may be long, delete it in bulk rather than through the ORM
+        session.execute(delete(WorkerStat).where(WorkerStat.worker_id==worker.worker_id),
+             execution_options={'synchronize_session':False})
         session.delete(worker)
+        session.execute(delete(WorkerExecutionCount).where(WorkerExecutionCount.worker_id==worker.worker_id),
+             execution_options={'synchronize_session':False})
         session.commit()
         return worker
 
@@ -397,9 +689,13 @@ def worker_handle_eviction(worker, session, commit=True):
     # Here we want to make an exception: Execution failure on worker eviction should be 
     # immediately retried whatever the retry status
     # NB could not make the SQLALchemy ORM work in that simple case... NotImplementedError: This backend does not support multiple-table criteria within UPDATE
-    session.execute(f"UPDATE task SET status='pending' WHERE task_id IN (SELECT task_id FROM execution WHERE worker_id={worker.worker_id} AND status IN ('running','pending','accepted','assigned'))")
-    session.execute(f"UPDATE execution SET status='failed' WHERE worker_id={worker.worker_id} AND status='running'")
-    session.execute(f"UPDATE execution SET status='refused' WHERE worker_id={worker.worker_id} AND status IN ('pending','accepted')")
+    session.execute(text(f"UPDATE task SET status='pending', status_date=:now WHERE task_id IN (SELECT task_id FROM execution WHERE worker_id={worker.worker_id} AND status IN ('running','pending','accepted','assigned'))"),
+                    {'now': datetime.utcnow()})
+    # modification_date is set as the ORM would do, batch_stat durations rely on it
+    session.execute(text(f"UPDATE execution SET status='failed', modification_date=:now WHERE worker_id={worker.worker_id} AND status='running'"),
+                    {'now': datetime.utcnow()})
+    session.execute(text(f"UPDATE execution SET status='refused', modification_date=:now WHERE worker_id={worker.worker_id} AND status IN ('pending','accepted')"),
+                    {'now': datetime.utcnow()})
     
     if commit:
         session.commit()
@@ -442,14 +738,14 @@ def worker_handle_eviction(worker, session, commit=True):
 class Requirement(db.Model):
     __tablename__="requirement"
     requirement_id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey("task.task_id"), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey("task.task_id"), nullable=False, index=True)
     task = db.relationship(
         Task,
         foreign_keys=[task_id],
         backref=db.backref('requirements',
                          uselist=True,
                          cascade='delete,all'))
-    other_task_id = db.Column(db.Integer, db.ForeignKey("task.task_id"), nullable=False)
+    other_task_id = db.Column(db.Integer, db.ForeignKey("task.task_id"), nullable=False, index=True)
     other_task = db.relationship(
         Task,
         foreign_keys=[other_task_id],
@@ -473,12 +769,13 @@ class Recruiter(db.Model):
     worker_prefetch = db.Column(db.Integer, nullable=False, default=0)
     minimum_tasks = db.Column(db.Integer, nullable=True)
     maximum_workers = db.Column(db.Integer, nullable=True)
+    policy = db.Column(db.String, nullable=True)
 
     def __init__(self, batch, rank, tasks_per_worker, 
                  worker_flavor, worker_concurrency,
                  worker_region = None, worker_provider = None, 
                  worker_prefetch = 0,
-                 minimum_tasks=None, maximum_workers=None):
+                 minimum_tasks=None, maximum_workers=None, policy=None):
         self.batch = batch
         self.rank = rank
         self.tasks_per_worker = tasks_per_worker
@@ -490,83 +787,89 @@ class Recruiter(db.Model):
         self.worker_prefetch = worker_prefetch
         self.minimum_tasks = minimum_tasks
         self.maximum_workers = maximum_workers
+        if policy is not None and policy not in RECRUITER_POLICY_NAMES:
+            raise ModelException(f'Unknown recruiter policy {policy} (only {" ".join(RECRUITER_POLICY_NAMES)})')
+        self.policy = policy
+
+    @property
+    def flavor_predicates(self):
+        """The compiled protofilters of worker_flavor (auto:...), see compile_protofilters"""
+        return compile_protofilters(PROTOFILTER_SEPARATOR.join(self.worker_flavor.split(PROTOFILTER_SEPARATOR)[1:]))
 
     def match_flavor(self, worker, session):
         """A function that says if protofilters (which may appear as auto:... in Recruiter.worker_flavor) validate a worker.flavor"""
         if self.worker_flavor.startswith('auto'):
             if PROTOFILTER_SEPARATOR in self.worker_flavor:
-                if worker.flavor_detail is None:
+                flavor = flavor_catalog.flavor(worker.flavor, worker.provider, worker.region, session)
+                if flavor is None:
                     return False
-                flavor_detail=worker.flavor_detail 
-                env={'cpu':flavor_detail.cpu, 'ram':flavor_detail.ram, 'disk':flavor_detail.disk,'tags':flavor_detail.tags, 
-                     'gpumem':flavor_detail.gpumem, 'region':worker.region,'provider':worker.provider}
-                if 'cost' in self.worker_flavor or 'eviction' in self.worker_flavor:
-                    try:
-                        metrics = session.query(FlavorMetrics).filter(FlavorMetrics.flavor_name==worker.flavor,
-                                                                    FlavorMetrics.provider==worker.provider,
-                                                                    FlavorMetrics.region_name==worker.region).one()
-                        env['cost']=metrics.cost
-                        env['eviction']=metrics.eviction
-                    except NoResultFound:
-                        return False
-                result = True
-                for protofilter in self.worker_flavor.split(PROTOFILTER_SEPARATOR):
-                    protofilter_match = protofilter_syntax.match(protofilter)
-                    if protofilter_match:
-                        protofilter_match = protofilter_match.groupdict()
-                        variable = protofilter_match['item']
-                        comp = protofilter_match['comparator']
-                        value = protofilter_match['value']
-                        if value[0] not in '0123456789.':
-                            # value is a string
-                            value=repr(value)
-                        if comp=='~':
-                            env['is_like']=is_like
-                            eval_protofilter = f"is_like({variable},{value})"
-                        elif comp=='#':
-                            env['has_tag']=has_tag
-                            eval_protofilter = f"has_tag({variable},{value})"
-                        elif comp=='!~':
-                            env['is_like']=is_like
-                            eval_protofilter = f"not(is_like({variable},{value}))"
-                        elif comp=='!#':
-                            env['has_tag']=has_tag
-                            eval_protofilter = f"not(has_tag({variable},{value}))"
-                        else:
-                            eval_protofilter = f"{variable}{comp}{value}"
-                        try:
-                            result = result and eval(eval_protofilter,env)
-                        except Exception as e:
-                            log.exception(f'Could not evaluate protofilter {protofilter} (compiled as {eval_protofilter}), eval to False')
-                            return False
-                return result
+                return all(predicate(flavor) for predicate in self.flavor_predicates)
         else:
             return self.worker_flavor==worker.flavor
         
     # NB Session.merge() seems the way to go with this object
     # cf https://docs.sqlalchemy.org/en/14/orm/session_api.html#sqlalchemy.orm.Session.merge
 
-def delete_batch(name, session, commit=True):
-    """Delete a batch (all tasks, executions and recruiters associated to that batch), either in API context or in UI context"""
-    session.execute(delete(Requirement).where(or_(
-        Requirement.task_id.in_(select(Task.task_id).where(Task.batch==name)),
-        Requirement.other_task_id.in_(select(Task.task_id).where(Task.batch==name)))),
-        execution_options={'synchronize_session':False})
-    session.execute(delete(Signal).where(Signal.execution_id.in_(
-        select(Execution.execution_id).where(Execution.task_id.in_(
-            select(Task.task_id).where(Task.batch==name))
-        ))),
-        execution_options={'synchronize_session':False})
-    session.execute(delete(Execution).where(Execution.task_id.in_(
-             select(Task.task_id).where(Task.batch==name))),
-             execution_options={'synchronize_session':False})    
-    session.execute(delete(Task).where(Task.batch==name),
-             execution_options={'synchronize_session':False})
+def create_batch_delete_job(name, session, commit=True):
+    """Delete a batch in the background (see delete_batch_chunk), either in API context or in UI context:
+    recruiters are deleted at once, tasks (with their executions, signals and requirements) are deleted
+    by a batch_delete job, which only deletes the tasks existing now so that the batch name can be reused
+    immediately (these tasks are no longer dispatched in the meantime, see deleted_batches). Return the job."""
+    job = session.query(Job).filter(Job.action=='batch_delete', Job.target==name,
+                                    Job.status.in_(['pending','running'])).one_or_none()
+    max_task_id = session.execute(select(func.max(Task.task_id)).where(Task.batch==name)).scalar()
+    if job is None:
+        job = Job(target=name, action='batch_delete', 
+                  args={'max_task_id': max_task_id, 'total': session.execute(
+                            select(func.count(Task.task_id)).where(Task.batch==name)).scalar()})
+        session.add(job)
+    elif max_task_id is not None and max_task_id > (job.args['max_task_id'] or 0):
+        job.args = dict(job.args, max_task_id=max_task_id, total=job.args.get('deleted',0)+session.execute(
+                            select(func.count(Task.task_id)).where(Task.batch==name)).scalar())
     session.execute(delete(Recruiter).where(Recruiter.batch==name),
              execution_options={'synchronize_session':False})
+    # executions prefetched by workers but not yet started will not start
+    for execution in session.query(Execution).join(Execution.task).filter(Task.batch==name,
+                            Task.task_id<=(max_task_id or 0), Execution.status=='pending'):
+        execution_update_status(execution, session, 'refused', commit=False)
     if commit:
         session.commit()
+    return job
 
+def deleted_batches(session):
+    """Return a dict batch: max_task_id of the batches waiting for (or under) deletion by a batch_delete job,
+    tasks of these batches up to max_task_id must not be dispatched anymore"""
+    return {target: args['max_task_id'] for target, args in session.query(Job.target, Job.args).filter(
+                Job.action=='batch_delete', Job.status.in_(['pending','running']))
+            if args.get('max_task_id') is not None}
+
+def delete_batch_chunk(name, max_task_id, session, chunk=BATCH_DELETE_CHUNK):
+    """Delete up to chunk tasks of a batch (with task_id not above max_task_id) and everything attached to them,
+    executions are deleted by primary key without ever being loaded (their logs may be heavy).
+    Commit and return the number of deleted tasks (0 when the batch is done)."""
+    task_ids = list(session.scalars(select(Task.task_id).where(Task.batch==name, Task.task_id<=max_task_id).\
+                        order_by(Task.task_id).limit(chunk)))
+    if not task_ids:
+        session.execute(delete(BatchStat).where(BatchStat.batch==name, BatchStat.count<=0),
+             execution_options={'synchronize_session':False})
+        session.commit()
+        return 0
+    execution_ids = list(session.scalars(select(Execution.execution_id).where(Execution.task_id.in_(task_ids))))
+    session.execute(delete(Requirement).where(Requirement.task_id.in_(task_ids)),
+        execution_options={'synchronize_session':False})
+    session.execute(delete(Requirement).where(Requirement.other_task_id.in_(task_ids)),
+        execution_options={'synchronize_session':False})
+    if execution_ids:
+        session.execute(delete(Signal).where(Signal.execution_id.in_(execution_ids)),
+            execution_options={'synchronize_session':False})
+        session.execute(delete(ExecutionArchive).where(ExecutionArchive.execution_id.in_(execution_ids)),
+            execution_options={'synchronize_session':False})
+        session.execute(delete(Execution).where(Execution.execution_id.in_(execution_ids)),
+            execution_options={'synchronize_session':False})
+    session.execute(delete(Task).where(Task.task_id.in_(task_ids)),
+        execution_options={'synchronize_session':False})
+    session.commit()
+    return len(task_ids)
 
 class Region(db.Model):
     __tablename__="region"
@@ -611,6 +914,103 @@ class FlavorMetrics(db.Model):
             backref='metrics', 
             lazy=True)
 
+FLAVOR_FIELDS = ['name','provider','region','cpu','ram','tags','gpu','gpumem','disk','cost','eviction']
+FLAVOR_NUMERIC_FIELDS = ['cpu','ram','gpumem','disk','cost','eviction']
+PROTOFILTER_OPERATORS = {'==':operator.eq, '!=':operator.ne, '>':operator.gt, '<':operator.lt, 
+                         '>=':operator.ge, '<=':operator.le}
+
+@lru_cache(maxsize=256)
+def like_regexp(pattern):
+    """Compile a SQL LIKE pattern (with % and _ wildcards) into a regexp"""
+    return re.compile(''.join('.*' if c=='%' else '.' if c=='_' else re.escape(c) for c in pattern)+'$', re.DOTALL)
+
+def _compare(compare, flavor_value, value):
+    """Apply a comparison operator, a None flavor value or mismatching types never match"""
+    try:
+        return flavor_value is not None and compare(flavor_value, value)
+    except TypeError:
+        return False
+
+def _flavor_predicate(item, comparator, value):
+    """Return a predicate on a flavor dict, a None value never matches (like NULL in SQL)"""
+    if comparator in PROTOFILTER_OPERATORS:
+        compare = PROTOFILTER_OPERATORS[comparator]
+        return lambda flavor: _compare(compare, flavor[item], value)
+    if comparator in ['~','!~']:
+        regexp = like_regexp(str(value))
+        expected = comparator=='~'
+        return lambda flavor: flavor[item] is not None and (regexp.match(str(flavor[item])) is not None)==expected
+    letters = str(value)
+    if comparator=='#':
+        return lambda flavor: flavor[item] is not None and all(letter in flavor[item] for letter in letters)
+    return lambda flavor: flavor[item] is not None and not any(letter in flavor[item] for letter in letters)
+
+@lru_cache(maxsize=256)
+def compile_protofilters(protofilters):
+    """Compile a string of PROTOFILTER_SEPARATOR separated protofilters into a tuple of predicates 
+    on flavor dicts (with FLAVOR_FIELDS keys), with the same meaning as the SQL filters they used to be"""
+    predicates = []
+    for protofilter_string in protofilters.split(PROTOFILTER_SEPARATOR) if protofilters else []:
+        protofilter = protofilter_syntax.match(protofilter_string)
+        if not protofilter:
+            log.warning(f'Unknown protofilter {protofilter_string}')
+            continue
+        protofilter = protofilter.groupdict()
+        value = protofilter['value']
+        if protofilter['item'] in FLAVOR_NUMERIC_FIELDS and protofilter['comparator'] in PROTOFILTER_OPERATORS:
+            # the syntax also accepts things like 1abc, which are left as strings (and do not match)
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        predicates.append(_flavor_predicate(protofilter['item'], protofilter['comparator'], value))
+    return tuple(predicates)
+
+class FlavorCatalog:
+    """An in-memory copy of flavors joined with their metrics (one dict per flavor and region, 
+    sorted by cost), reloaded every FLAVOR_CATALOG_CHECK_INTERVAL seconds (a few thousand rows)"""
+    def __init__(self):
+        self.flavors = []
+        self.details = {}
+        self.metrics = {}
+        self.check_time = None
+
+    def get(self, session):
+        """Return the list of flavor dicts, reloading it if needed"""
+        if self.check_time is None or time()-self.check_time > FLAVOR_CATALOG_CHECK_INTERVAL:
+            log.info('Loading flavor catalog')
+            self.flavors = [dict(zip(FLAVOR_FIELDS, row)) for row in session.query(
+                    Flavor.name, Flavor.provider, FlavorMetrics.region_name, 
+                    Flavor.cpu, Flavor.ram, Flavor.tags, Flavor.gpu, Flavor.gpumem, 
+                    Flavor.disk, FlavorMetrics.cost, FlavorMetrics.eviction      
+                ).select_from(FlavorMetrics).join(FlavorMetrics.flavor).order_by(FlavorMetrics.cost)]
+            self.metrics = dict(((flavor['name'], flavor['provider'], flavor['region']), flavor) 
+                                for flavor in self.flavors)
+            self.details = dict(((name, provider), {'name':name, 'provider':provider, 'cpu':cpu, 'ram':ram,
+                                    'tags':tags, 'gpu':gpu, 'gpumem':gpumem, 'disk':disk}) 
+                                for name, provider, cpu, ram, tags, gpu, gpumem, disk in session.query(
+                                    Flavor.name, Flavor.provider, Flavor.cpu, Flavor.ram, Flavor.tags, 
+                                    Flavor.gpu, Flavor.gpumem, Flavor.disk))
+            self.check_time = time()
+        return self.flavors
+
+    def cpu(self, name, provider):
+        """Return the number of CPU of a flavor (0 if unknown), get() must have been called"""
+        return self.details.get((name, provider), {}).get('cpu', 0)
+
+    def flavor(self, name, provider, region, session):
+        """Return the flavor dict of a flavor in a region (with None cost and eviction if there 
+        is no metrics for this region, None if the flavor is unknown)"""
+        self.get(session)
+        if (name, provider, region) in self.metrics:
+            return self.metrics[(name, provider, region)]
+        if (name, provider) in self.details:
+            return dict(self.details[(name, provider)], region=region, cost=None, eviction=None)
+        return None
+
+# work as a singleton
+flavor_catalog = FlavorCatalog()
+
 def find_remaining_quotas(session):
     """Return a dictionnary of (provider,region):cpus where cpus is the number of CPUs still available because of the quota"""
     quotas = get_quotas()
@@ -620,92 +1020,58 @@ def find_remaining_quotas(session):
                 .group_by(Worker.provider, Worker.region):
             if (provider,region) in quotas:
                 quotas[(provider,region)]-=cpus
-        create_jobs=list(map(lambda x: x[0],session.query(Job.args).select_from(Job).filter(Job.action=='worker_create')))
-        if create_jobs:
-            flavors=[]
-            for job_args in create_jobs:
-                if (job_args['flavor'],job_args['provider']) not in flavors:
-                    flavors.append((job_args['flavor'],job_args['provider']))
-            flavors_cpu = { (name, provider):cpu for name, provider, cpu in
-                session.query(Flavor.name, Flavor.provider, Flavor.cpu).select_from(Flavor).filter(
-                    tuple_(Flavor.name, Flavor.provider).in_(flavors))
-            }
-            for job_args in create_jobs:
-                if (job_args['provider'],job_args['region']) in quotas:
-                    quotas[(job_args['provider'],job_args['region'])]-=flavors_cpu.get((job_args['flavor'],job_args['provider']),0)
+        flavor_catalog.get(session)
+        for job_args, in session.query(Job.args).filter(Job.action=='worker_create'):
+            if (job_args['provider'],job_args['region']) in quotas:
+                quotas[(job_args['provider'],job_args['region'])]-=flavor_catalog.cpu(job_args['flavor'],job_args['provider'])
     return quotas    
 
+def consume_quota(flavors, flavor, quotas):
+    """Account for the deployment of a worker of this flavor (one of find_flavor() answer) in quotas 
+    and in the available attribute of flavors of the same provider and region"""
+    key = (flavor['provider'], flavor['region'])
+    if key in quotas:
+        quotas[key] -= flavor['cpu']
+        for other_flavor in flavors:
+            if (other_flavor['provider'], other_flavor['region'])==key:
+                other_flavor['available'] = quotas[key]//other_flavor['cpu']
+
 def find_flavor(session, protofilters='', min_cpu=None, min_ram=None, min_disk=None, 
                 max_eviction=FLAVOR_DEFAULT_EVICTION, 
-                limit=FLAVOR_DEFAULT_LIMIT, provider=None, region=None, flavor=None):
+                limit=FLAVOR_DEFAULT_LIMIT, provider=None, region=None, flavor=None, quotas=None):
     """Return a list of Flavor fulfilling specific conditions
 
     protofilters should be a string of PROTOFILTER_SEPARATOR (e.g. :) separated strings passing validate_protofilter() function
+    quotas may be passed if already computed (see find_remaining_quotas and consume_quota)
     """
-    # WATCH OUT When modifying this function, Recruiter.match_flavor() function (used for recycling) should be updated too
+    # WATCH OUT protofilters are also used by Recruiter.match_flavor() (used for recycling), through compile_protofilters()
     filters = []
-    order_by = (FlavorMetrics.cost,)
     if max_eviction is not None and not (protofilters and 'eviction' in protofilters):
-        filters.append(FlavorMetrics.eviction<=max_eviction)
+        filters.append(_flavor_predicate('eviction', '<=', max_eviction))
     if not (protofilters and 'tags' in protofilters):
-        filters.append(~Flavor.tags.like('%M%'))
+        filters.append(_flavor_predicate('tags', '!#', 'M'))
     if min_cpu is not None:
-        filters.append(Flavor.cpu>=min_cpu)
+        filters.append(_flavor_predicate('cpu', '>=', min_cpu))
     if min_ram is not None:
-        filters.append(Flavor.ram>=min_ram)
+        filters.append(_flavor_predicate('ram', '>=', min_ram))
     if min_disk is not None:
-        filters.append(Flavor.disk>=min_disk)
+        filters.append(_flavor_predicate('disk', '>=', min_disk))
     if provider is not None:
-        filters.append(Flavor.provider==provider)
-        if provider in PREFERRED_REGIONS and PREFERRED_REGIONS[provider]:
-            order_by = (FlavorMetrics.region_name.like(PREFERRED_REGIONS[provider])).desc(),*order_by
+        filters.append(_flavor_predicate('provider', '==', provider))
     if region is not None:
-        filters.append(FlavorMetrics.region_name==region)
+        filters.append(_flavor_predicate('region', '==', region))
     if flavor is not None:
-        filters.append(Flavor.name.like(flavor))
-    if protofilters:
-        for protofilter_string in protofilters.split(PROTOFILTER_SEPARATOR):
-            protofilter = protofilter_syntax.match(protofilter_string)
-            if protofilter:
-                protofilter=protofilter.groupdict()
-                protofilter_item = getattr(FlavorMetrics, 'region_name' if protofilter['item']=='region' else protofilter['item']) \
-                    if protofilter['item'] in ['region','cost','eviction'] else \
-                    getattr(Flavor, protofilter['item'])
-                comp = protofilter['comparator']
-                if comp=='==':
-                    filters.append(protofilter_item==protofilter['value'])
-                elif comp=='!=':
-                    filters.append(protofilter_item!=protofilter['value'])
-                elif comp=='>':
-                    filters.append(protofilter_item>protofilter['value'])
-                elif comp=='<':
-                    filters.append(protofilter_item<protofilter['value'])
-                elif comp=='>=':
-                    filters.append(protofilter_item>=protofilter['value'])
-                elif comp=='<=':
-                    filters.append(protofilter_item<=protofilter['value'])
-                elif comp=='~':
-                    filters.append(protofilter_item.like(protofilter['value']))
-                elif comp=='!~':
-                    filters.append(~protofilter_item.like(protofilter['value']))
-                elif comp=='#':
-                    for letter in protofilter['value']:
-                        filters.append(protofilter_item.like(f'%{letter}%'))
-                elif comp=='!#':
-                    for letter in protofilter['value']:
-                        filters.append(~protofilter_item.like(f'%{letter}%'))
-            else:
-                log.warning(f'Unknown protofilter {protofilter_string}')
-    #return session.query(Flavor,FlavorMetrics
-    fields = ['name','provider','region','cpu','ram','tags','gpu','gpumem','disk','cost','eviction']
-    flavors = [dict(zip(fields, object)) for object in session.query(
-                  Flavor.name, Flavor.provider, FlavorMetrics.region_name, 
-                  Flavor.cpu, Flavor.ram, Flavor.tags, Flavor.gpu, Flavor.gpumem, 
-                  Flavor.disk, FlavorMetrics.cost, FlavorMetrics.eviction      
-            ).select_from(FlavorMetrics).join(FlavorMetrics.flavor)\
-                .filter(*filters)\
-                .order_by(*order_by).limit(limit)]
-    quotas = find_remaining_quotas(session)
+        filters.append(_flavor_predicate('name', '~', flavor))
+    filters.extend(compile_protofilters(protofilters))
+    flavors = [dict(item) for item in flavor_catalog.get(session) 
+                    if all(predicate(item) for predicate in filters)]
+    if provider is not None and provider in PREFERRED_REGIONS and PREFERRED_REGIONS[provider]:
+        preferred_region = like_regexp(PREFERRED_REGIONS[provider])
+        flavors.sort(key=lambda item: preferred_region.match(item['region']) is None)
+    if limit is not None:
+        flavors = flavors[:limit]
+    if quotas is None:
+        quotas = find_remaining_quotas(session)
     for flavor in flavors:
         if (flavor['provider'], flavor['region']) in quotas:
             flavor['available']=quotas[(flavor['provider'], flavor['region'])]//flavor['cpu']
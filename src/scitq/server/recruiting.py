@@ -0,0 +1,137 @@
+"""Recruiter policies: how many new workers a recruiter should deploy for its batch, and
+which recyclable workers should be recruited rather than deployed.
+
+A policy is a function (recruiter, pending_tasks, workers, session) -> number of workers
+to add (possibly negative or zero), registered in RECRUITER_POLICIES under the name used
+in Recruiter.policy, this name being also listed in constants.RECRUITER_POLICY_NAMES (used to
+validate policies in the model, the API and the CLI). Recruiter minimum_tasks and maximum_workers
+are applied by the caller.
+"""
+import math
+import logging as log
+from sqlalchemy import select
+
+from .model import BatchStat, Job, find_flavor, flavor_catalog
+from .config import RECRUITER_DRAIN_EFFICIENCY, RECRUITER_DEFAULT_DEPLOY_TIME, RECRUITER_DEPLOY_HISTORY,\
+    RECRUITER_MIN_DURATION_SAMPLES
+from ..constants import RECRUITER_DEFAULT_POLICY, RECRUITER_POLICY_NAMES, PROTOFILTER_SEPARATOR
+
+def tasks_per_worker_policy(recruiter, pending_tasks, workers, session):
+    """The historical rule: one worker each tasks_per_worker pending tasks"""
+    return math.ceil(pending_tasks/recruiter.tasks_per_worker) - workers
+
+def mean_task_duration(batch, session):
+    """Mean duration (in seconds) of succeeded executions of this batch (None if there are too few)"""
+    stat = session.execute(select(BatchStat.duration_count, BatchStat.duration_sum).where(
+                BatchStat.batch==batch, BatchStat.status=='succeeded')).one_or_none()
+    if stat is None or stat.duration_count < RECRUITER_MIN_DURATION_SAMPLES:
+        return None
+    return stat.duration_sum/stat.duration_count
+
+def mean_deploy_time(provider, session):
+    """Mean time (in seconds) from worker_create job creation to successful deploy for this provider
+    (or any provider if None) on the last RECRUITER_DEPLOY_HISTORY deploys"""
+    durations = []
+    for args, creation_date, modification_date in session.execute(
+            select(Job.args, Job.creation_date, Job.modification_date).where(
+                Job.action=='worker_deploy', Job.status=='succeeded', Job.modification_date.isnot(None)).\
+            order_by(Job.job_id.desc()).limit(RECRUITER_DEPLOY_HISTORY*4)):
+        if provider is None or (args or {}).get('provider')==provider:
+            durations.append((modification_date-creation_date).total_seconds())
+            if len(durations)>=RECRUITER_DEPLOY_HISTORY:
+                break
+    if not durations:
+        return RECRUITER_DEFAULT_DEPLOY_TIME
+    return sum(durations)/len(durations)
+
+def drain_policy(recruiter, pending_tasks, workers, session):
+    """Deploy as many workers as possible to finish the batch sooner, as long as each new worker
+    is expected to work at least RECRUITER_DRAIN_EFFICIENCY of its paid time:
+    - current workers (all counted as active) keep draining the queue while new ones deploy,
+    - if the queue is expected to be empty when new workers arrive, none is deployed,
+    - the remaining tasks are shared so that each worker works at least deploy_time*e/(1-e).
+    Fall back to tasks_per_worker_policy until enough tasks of the batch have succeeded."""
+    duration = mean_task_duration(recruiter.batch, session)
+    if not duration:
+        return tasks_per_worker_policy(recruiter, pending_tasks, workers, session)
+    provider = None if recruiter.worker_provider in [None,'auto'] else recruiter.worker_provider
+    deploy_time = mean_deploy_time(provider, session)
+    worker_rate = recruiter.worker_concurrency/duration
+    remaining_tasks = pending_tasks - workers*worker_rate*deploy_time
+    if remaining_tasks <= 0:
+        log.warning(f'  --> drain policy: current workers should drain the queue in {pending_tasks/(workers*worker_rate):.0f}s, before a new worker is deployed ({deploy_time:.0f}s)')
+        return 0
+    efficiency = min(max(RECRUITER_DRAIN_EFFICIENCY, 0.01), 0.99)
+    minimum_work_time = deploy_time*efficiency/(1-efficiency)
+    total_workers = math.floor(remaining_tasks/(worker_rate*minimum_work_time))
+    log.warning(f'  --> drain policy: tasks last {duration:.0f}s, deploy takes {deploy_time:.0f}s, {remaining_tasks:.0f} tasks left when deployed, at most {total_workers} workers for each to work at least {minimum_work_time:.0f}s')
+    return max(total_workers - workers, 0)
+
+RECRUITER_POLICIES = {
+    'tasks_per_worker': tasks_per_worker_policy,
+    'drain': drain_policy,
+}
+if sorted(RECRUITER_POLICIES)!=sorted(RECRUITER_POLICY_NAMES):
+    raise RuntimeError(f'Recruiter policies {" ".join(RECRUITER_POLICIES)} do not match RECRUITER_POLICY_NAMES {" ".join(RECRUITER_POLICY_NAMES)}')
+
+def needed_workers(recruiter, pending_tasks, workers, session):
+    """Return the number of workers a recruiter should add according to its policy"""
+    return RECRUITER_POLICIES[recruiter.policy or RECRUITER_DEFAULT_POLICY](recruiter, pending_tasks, workers, session)
+
+def recruiter_demand(recruiter, session):
+    """Return the flavor dict of the worker a recruiter would deploy (the cheapest matching one
+    for an auto recruiter), None if unknown"""
+    if recruiter.worker_flavor.startswith('auto'):
+        flavors = find_flavor(session, 
+            protofilters=PROTOFILTER_SEPARATOR.join(recruiter.worker_flavor.split(PROTOFILTER_SEPARATOR)[1:]),
+            provider=None if recruiter.worker_provider in [None,'auto'] else recruiter.worker_provider,
+            region=None if recruiter.worker_region in [None,'auto'] else recruiter.worker_region,
+            limit=1, quotas={})
+        return flavors[0] if flavors else None
+    flavor_catalog.get(session)
+    for (name, provider), flavor in flavor_catalog.details.items():
+        if name==recruiter.worker_flavor and recruiter.worker_provider in [None, provider]:
+            return flavor
+    return None
+
+def expected_utilization(demand, flavor):
+    """Fraction of a worker of this flavor that a recruiter demand would use (the most used of CPU 
+    and RAM, at most 1), None if unknown"""
+    if demand is None or flavor is None or not flavor['cpu'] or not flavor['ram']:
+        return None
+    return min(max(demand['cpu']/flavor['cpu'], demand['ram']/flavor['ram']), 1)
+
+def plan_recycling(needs, recyclable_workers, worker_task_properties, session):
+    """Assign recyclable workers to recruiters, as a bin-packing problem solved with a best fit decreasing
+    heuristic: the batches with the biggest demands (in CPU/RAM of the worker the recruiter would deploy otherwise)
+    are served first, the recruiters of a batch in rank order, each with the compatible workers it would
+    use best (idle ones first on equal utilization).
+    - needs: a list of (recruiter, number of needed workers),
+    - recyclable_workers: a dict worker:active tasks,
+    - worker_task_properties: a dict worker:task properties (a worker still running tasks of the
+      recruiter batch from a previous recycling cannot be recycled again for it).
+    Return a list of (recruiter, worker, expected utilization or None if unknown)"""
+    demands = [(recruiter, needed, recruiter_demand(recruiter, session)) for recruiter, needed in needs if needed>0]
+    batch_demand = {}
+    for recruiter, _, demand in demands:
+        size = (demand['cpu'], demand['ram']) if demand else (0,0)
+        batch_demand[recruiter.batch] = max(batch_demand.get(recruiter.batch, size), size)
+    # a lower rank recruiter of a batch comes first whatever its demand, as when deploying workers
+    demands.sort(key=lambda item: (tuple(-x for x in batch_demand[item[0].batch]), item[0].batch, item[0].rank))
+    plan = []
+    recycled = set()
+    for recruiter, needed, demand in demands:
+        candidates = []
+        for worker, active_tasks in recyclable_workers.items():
+            if worker in recycled or worker.batch==recruiter.batch or active_tasks>=worker.concurrency \
+                    or recruiter.batch in worker_task_properties[worker] \
+                    or not recruiter.match_flavor(worker, session=session):
+                continue
+            utilization = expected_utilization(demand, 
+                flavor_catalog.flavor(worker.flavor, worker.provider, worker.region, session))
+            candidates.append((utilization, active_tasks, worker))
+        candidates.sort(key=lambda item: (-1 if item[0] is None else -item[0], item[1]))
+        for utilization, _, worker in candidates[:needed]:
+            recycled.add(worker)
+            plan.append((recruiter, worker, utilization))
+    return plan
@@ -42,21 +42,36 @@ function worker_status2class(status) {
         }[status]||'dark'; 
 }
 
+// workers are received incrementally from /ui/feed/ : only those that changed since feed_date
+var feed_date = null;
+var workers_by_id = new Map();
+var workers = [];
 async function get_workers() {
     console.log('Fetching workers...');
-    await $.getJSON('/ui/get/', {
-                object: 'workers'
-            }, async function(data) {
+    await $.getJSON('/ui/feed/', 
+            (feed_date===null?{}:{since: feed_date}), 
+            async function(data) {
 
-        workers = data.workers;
         tasks_per_status = data.tasks_per_status;
-        console.log('Received workers ',workers);
+        console.log('Received workers ',data.workers, 'removed', data.removed, 'full', data.full);
         console.log('Received tasks per status ',tasks_per_status);
 
         for (task_status of ['pending','assigned','accepted','running','failed','succeeded']) {
             document.getElementById(`${task_status}-tasks`).value = `${capitalize(task_status)}: ${tasks_per_status[task_status]||0}`;
         }
         
+        feed_date = data.date;
+        if (data.full) {
+            workers_by_id = new Map();
+        } else if (data.workers.length==0 && data.removed.length==0) {
+            // nothing changed, no need to redraw
+            await get_jobs();
+            return;
+        }
+        data.workers.forEach(worker => workers_by_id.set(worker.worker_id, worker));
+        data.removed.forEach(worker_id => workers_by_id.delete(worker_id));
+        workers = Array.from(workers_by_id.values()).sort((a,b) => 
+            (a.batch||'').localeCompare(b.batch||'') || a.name.localeCompare(b.name));
         
         worker_table = '';
         for (i=0; i<workers.length; i++) {
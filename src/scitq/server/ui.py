@@ -1,16 +1,17 @@
 from flask import render_template, request, jsonify, current_app, Blueprint
-from time import sleep, time
+from time import time
 import logging as log
 import json as json_module
 from sqlalchemy import select, func, and_, delete, distinct, union, alias
 from signal import SIGKILL, SIGQUIT, SIGTSTP, SIGCONT
 from datetime import datetime
+import threading
 
 from ..util import package_version, tryupdate, to_dict, flat_list
 from .db import db
-from .config import IS_SQLITE, UI_OUTPUT_TRUNC, UI_MAX_DISPLAYED_ROW
+from .config import IS_SQLITE, UI_OUTPUT_TRUNC, UI_MAX_DISPLAYED_ROW, UI_FEED_PERIOD, UI_FEED_HISTORY
 from ..constants import SIGNAL_CLEAN, SIGNAL_RESTART
-from .model import Worker, Signal, Job, Task, Execution, delete_batch, create_worker_create_job, find_flavor
+from .model import Worker, Signal, Job, Task, Execution, create_batch_delete_job, create_batch_signal, create_worker_create_job, find_flavor
 from .api import worker_dao
 
 REFRESH_FLAVOR=60
@@ -56,42 +57,166 @@ def batch():
 
 
 
-@ui.route('/get/')
-def handle_get():
-    json = request.args
-    if 'delay' in json:
-        sleep(int(json['delay']))
-    if json['object']=='workers':
-        log.info('sending workers')
-        return jsonify({
-            'workers':list([tryupdate(dict(row),'stats',json_module.loads,row.stats) for row in db.session.execute(
+def conditional_jsonify(**payload):
+    """jsonify with an ETag, answering 304 Not Modified if the browser already has this content
+    (the ETag is computed on the answer, so this saves bandwidth, not database queries)"""
+    response = jsonify(payload)
+    response.add_etag(weak=True)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+class DashboardFeed:
+    """Some dashboard data shared by all the browsers connected to this server process:
+    the database is queried at most once per UI_FEED_PERIOD, and each browser may 
+    receive only the rows that changed since its previous call (since()).
+    Change dates are the dates of the queries that observed the change, so that a date
+    obtained from another server process remains a valid cursor."""
+
+    def __init__(self, query, key, summary=None):
+        """query is a function returning a list of dict rows, key a function giving the row key,
+        summary an optional function returning something always sent as a whole"""
+        self.query = query
+        self.key = key
+        self.summary_query = summary
+        self.summary = None
+        self.rows = {}
+        self.changed = {}
+        self.removed = {}
+        self.start = None
+        self.date = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Query the database if current snapshot is older than UI_FEED_PERIOD"""
+        with self.lock:
+            now = time()
+            if self.date is not None and now-self.date<UI_FEED_PERIOD:
+                return
+            rows = dict([(self.key(row),row) for row in self.query()])
+            for key,row in rows.items():
+                if self.rows.get(key)!=row:
+                    self.changed[key]=now
+                    self.removed.pop(key,None)
+            for key in self.rows:
+                if key not in rows:
+                    self.removed[key]=now
+                    self.changed.pop(key,None)
+            for key,date in list(self.removed.items()):
+                if now-date>UI_FEED_HISTORY:
+                    del(self.removed[key])
+            self.rows = rows
+            if self.summary_query:
+                self.summary = self.summary_query()
+            if self.start is None:
+                self.start = now
+            self.date = now
+
+    def snapshot(self):
+        """Return all the rows (in query order)"""
+        self.refresh()
+        with self.lock:
+            return list(self.rows.values())
+
+    def since(self, date=None):
+        """Return what changed since date (a previous answer date), or everything
+        if date is unset or too old for this process history"""
+        self.refresh()
+        # changed and removed are modified by concurrent refreshes
+        with self.lock:
+            if date is None or date<self.start or self.date-date>UI_FEED_HISTORY:
+                return {'date':self.date, 'full':True, 'rows':list(self.rows.values()), 
+                        'removed':[], 'summary':self.summary}
+            return {'date':self.date, 'full':False, 
+                    'rows':[self.rows[key] for key,change_date in self.changed.items() if change_date>date],
+                    'removed':[key for key,remove_date in self.removed.items() if remove_date>date],
+                    'summary':self.summary}
+
+
+def query_workers():
+    """Workers with their execution counters (see WorkerExecutionCount)"""
+    return list([tryupdate(dict(row),'stats',json_module.loads,row.stats) for row in db.session.execute(
                 '''SELECT 
-                    worker_id,
+                    worker.worker_id,
                     name, 
                     batch,
                     status, 
                     concurrency,
                     prefetch,
-                    (SELECT count(execution_id) FROM execution WHERE execution.worker_id=worker.worker_id AND
-                                                                        execution.status='accepted') as accepted,
-                    (SELECT count(execution_id) FROM execution WHERE execution.worker_id=worker.worker_id AND 
-                                                                        execution.status='running') as running,
-                    (SELECT count(execution_id) FROM execution WHERE execution.worker_id=worker.worker_id AND 
-                                                                        execution.status='succeeded') as succeeded,
-                    (SELECT count(execution_id) FROM execution WHERE execution.worker_id=worker.worker_id AND 
-                                                                        execution.status='failed') as failed,
-                    (SELECT count(execution_id) FROM execution WHERE execution.worker_id=worker.worker_id) as total,
+                    COALESCE(c.accepted,0) as accepted,
+                    COALESCE(c.running,0) as running,
+                    COALESCE(c.succeeded,0) as succeeded,
+                    COALESCE(c.failed,0) as failed,
+                    COALESCE(c.total,0) as total,
                     load,
                     memory,
                     stats,
                     flavor,
                     provider,
                     region
-                FROM worker
-                ORDER BY worker.batch,worker.name''')]),
-            'tasks_per_status': dict([row for row in db.session.execute(
-                '''SELECT status,count(task_id) as count FROM task GROUP BY status'''
-            )]) })
+                FROM worker LEFT JOIN (
+                    SELECT worker_id,
+                        SUM(CASE WHEN status='accepted' THEN count ELSE 0 END) as accepted,
+                        SUM(CASE WHEN status='running' THEN count ELSE 0 END) as running,
+                        SUM(CASE WHEN status='succeeded' THEN count ELSE 0 END) as succeeded,
+                        SUM(CASE WHEN status='failed' THEN count ELSE 0 END) as failed,
+                        SUM(count) as total
+                    FROM worker_execution_count GROUP BY worker_id
+                ) c ON c.worker_id=worker.worker_id
+                ORDER BY worker.batch,worker.name''')])
+
+def query_tasks_per_status():
+    """Task count per status (see BatchStat)"""
+    return dict([row for row in db.session.execute(
+                '''SELECT status,SUM(count) as count FROM batch_stat WHERE count>0 GROUP BY status'''
+            )])
+
+def query_batches():
+    """Task count and duration per batch and status (see BatchStat), durations are in hours"""
+    return list([dict(row) for row in db.session.execute(
+        '''SELECT batch,status,count,duration_max/3600 as max,duration_min/3600 as min,
+    duration_sum/NULLIF(duration_count,0)/3600 as avg 
+FROM batch_stat WHERE count>0 OR duration_count>0 ORDER BY batch, status''')])
+
+def query_batch_workers():
+    """Worker names per batch"""
+    if IS_SQLITE:
+        worker_query='''SELECT batch,GROUP_CONCAT(name,',') as workers FROM worker GROUP BY batch ORDER BY name'''
+    else:
+        worker_query='''SELECT batch,STRING_AGG(name,',') as workers FROM (SELECT * FROM worker ORDER BY name) w GROUP BY batch'''
+    return list([dict(row) for row in db.session.execute(worker_query)])
+
+def query_jobs():
+    """All jobs, most recent first"""
+    jobs=[]
+    for job in db.session.query(Job).order_by(Job.job_id.desc()).all():
+        job=to_dict(job)
+        job['args']=eval(job['args'])
+        jobs.append(job)
+    return jobs
+
+# work as singletons (one per server process)
+workers_feed = DashboardFeed(query_workers, key=lambda row: row['worker_id'], summary=query_tasks_per_status)
+batches_feed = DashboardFeed(query_batches, key=lambda row: (row['batch'],row['status']), summary=query_batch_workers)
+jobs_feed = DashboardFeed(query_jobs, key=lambda row: row['job_id'])
+
+
+@ui.route('/feed/')
+def handle_feed():
+    """Incremental version of /get/ for workers: only the workers that changed
+    since the date of the previous answer are sent (all of them if since is absent)"""
+    since = request.args.get('since', None, type=float)
+    feed = workers_feed.since(since)
+    return jsonify({'date':feed['date'], 'full':feed['full'], 'workers':feed['rows'], 
+                    'removed':feed['removed'], 'tasks_per_status':feed['summary']})
+
+@ui.route('/get/')
+def handle_get():
+    json = request.args
+    if json['object']=='workers':
+        log.info('sending workers')
+        feed = workers_feed.since()
+        return conditional_jsonify(workers=feed['rows'], tasks_per_status=feed['summary'])
 
     elif json['object']=='tasks':
         sortby = json.get('sortby', None)
@@ -173,28 +298,12 @@ def handle_get():
             distinct(Worker.name)
         ))
 
-        return jsonify({'tasks':task_list, 'batch_list':batch_list, 'worker_list':worker_list})
+        return conditional_jsonify(tasks=task_list, batch_list=batch_list, worker_list=worker_list)
         
     elif json['object'] == 'batch':
         log.info('sending batch')
-        if IS_SQLITE:
-            duration_query='(JULIANDAY(e1.modification_date)-JULIANDAY(e1.creation_date))*24'
-            worker_query='''SELECT batch,GROUP_CONCAT(name,',') as workers FROM worker GROUP BY batch ORDER BY name'''
-        else:
-            duration_query='EXTRACT ( EPOCH FROM (e1.modification_date-e1.creation_date)/3600 )'
-            worker_query='''SELECT batch,STRING_AGG(name,',') as workers FROM (SELECT * FROM worker ORDER BY name) w GROUP BY batch'''
-        batch_query=f'''SELECT * FROM (
-    SELECT batch,status,COUNT(task_id) as count,MAX(duration) as max,MIN(duration) as min, AVG(duration) as avg FROM (
-        SELECT {duration_query} as duration, e1.task_id, e1.status,task.batch FROM execution e1 JOIN task ON (
-            task.task_id=e1.task_id AND e1.latest
-        )
-    ) AS e2 GROUP BY batch,status
-    UNION	 
-    SELECT batch,status, COUNT(task_id),NULL,NULL,NULL 
-    FROM task WHERE task_id NOT IN (SELECT task_id FROM execution) GROUP BY batch,status
-) AS b ORDER BY batch, status'''
-        return jsonify({'batches':list([dict(row) for row in db.session.execute(batch_query)]),
-                        'workers': list([dict(row) for row in db.session.execute(worker_query)])})
+        feed = batches_feed.since()
+        return conditional_jsonify(batches=feed['rows'], workers=feed['summary'])
     
 
 @ui.route('/flavors/')
@@ -345,12 +454,8 @@ def handle_batch_action():
                 t.status = 'paused'
             signal = SIGTSTP
             db.session.commit()
-        log.warning(f'Sending signal {signal} to executions for batch {name}')
-        for e in db.session.scalars(select(Execution).join(Execution.task).where(
-                                        Execution.status=='running',
-                                        Task.batch==name)):
-            log.warning(f'Sending signal {signal} to execution {e.execution_id}')
-            db.session.add(Signal(e.execution_id, e.worker_id, signal ))
+        if signal:
+            create_batch_signal(name, signal, db.session, commit=False)
         db.session.commit()
         log.warning('result pause :Ok')
     elif json['action'] in ['go','simple go']: 
@@ -364,19 +469,15 @@ def handle_batch_action():
             for t in Task.query.filter(Task.batch==name):
                 if t.status == 'paused':
                     t.status='running'
-            for e in db.session.scalars(select(Execution).join(Execution.task).where(
-                                            Execution.status=='running',
-                                            Task.batch==name)):
-                log.warning(f'Sending signal {signal} to execution {e.execution_id}')
-                db.session.add(Signal(e.execution_id, e.worker_id, signal ))
+            create_batch_signal(name, signal, db.session, commit=False)
         db.session.commit()
         log.warning('result go : Ok')
     elif json['action']=='clear':
         #Same function as in the API clear() Delete all tasks and executions and recruiters for this batch
         name=json['name']
         """Delete all tasks and executions for this batch"""
-        delete_batch(name, session=db.session)
-        log.warning(f'result clear batch {name}: Ok ')
+        create_batch_delete_job(name, session=db.session)
+        log.warning(f'result clear batch {name}: Ok (deletion job created)')
     return '"ok"'
 
 #@socketio.on('task_action')
@@ -457,13 +558,7 @@ def delete_worker():
 @ui.route('/jobs')
 def handle_jobs():
     """Provide UI with job list"""
-    jobs=[]
-    for job in db.session.query(Job).order_by(Job.job_id.desc()).all():
-        job=to_dict(job)
-        job['args']=eval(job['args'])
-        jobs.append(job)
-
-    return jsonify({'jobs':jobs})
+    return conditional_jsonify(jobs=jobs_feed.snapshot())
 
 @ui.route('/delete_job')
 def delete_job():
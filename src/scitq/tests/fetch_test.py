@@ -0,0 +1,105 @@
+import os
+from argparse import Namespace
+from time import time
+from scitq.fetch import local_manifest, remote_manifest, manifest_md5, manifest_differ, ListingCache
+from scitq.util import get_md5
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_local_manifest(tmp_path):
+    write(tmp_path / 'a.txt', 'hello')
+    write(tmp_path / 'sub' / 'b.txt', 'world!')
+    manifest = local_manifest(str(tmp_path))
+    assert sorted(manifest) == ['a.txt', os.path.join('sub','b.txt')]
+    assert manifest['a.txt']['size'] == 5
+    assert manifest['a.txt']['md5'] is None
+
+
+def test_local_manifest_reuses_md5(tmp_path):
+    write(tmp_path / 'a.txt', 'hello')
+    previous = local_manifest(str(tmp_path))
+    previous['a.txt']['md5'] = 'cached'
+    assert local_manifest(str(tmp_path), previous)['a.txt']['md5'] == 'cached'
+    # a changed file does not reuse the md5
+    write(tmp_path / 'a.txt', 'hello again')
+    assert local_manifest(str(tmp_path), previous)['a.txt']['md5'] is None
+
+
+def test_manifest_md5(tmp_path):
+    write(tmp_path / 'a.txt', 'hello')
+    manifest = local_manifest(str(tmp_path))
+    md5 = manifest_md5(manifest, 'a.txt', str(tmp_path))
+    assert md5 == get_md5(str(tmp_path / 'a.txt'))
+    # computed once, then kept in the manifest
+    assert manifest['a.txt']['md5'] == md5
+    # no local path, nothing is computed
+    assert manifest_md5({'a.txt': {'size':5, 'md5':None}}, 'a.txt') is None
+
+
+def test_remote_manifest(tmp_path):
+    write(tmp_path / 'a.txt', 'hello')
+    write(tmp_path / 'sub' / 'b.txt', 'world!')
+    manifest = remote_manifest(f'file://{tmp_path}', md5=True)
+    assert manifest['a.txt'] == {'size':5, 'md5':get_md5(str(tmp_path / 'a.txt'))}
+    assert remote_manifest(f'file://{tmp_path}')[os.path.join('sub','b.txt')] == {'size':6, 'md5':None}
+
+
+def test_manifest_differ(tmp_path):
+    write(tmp_path / 'a.txt', 'hello')
+    source = local_manifest(str(tmp_path))
+    local_md5 = get_md5(str(tmp_path / 'a.txt'))
+    assert manifest_differ(source, {}, 'a.txt')
+    assert manifest_differ(source, {'a.txt': {'size':4, 'md5':None}}, 'a.txt')
+    assert not manifest_differ(source, {'a.txt': {'size':5, 'md5':'other'}}, 'a.txt')
+    assert manifest_differ(source, {'a.txt': {'size':5, 'md5':'other'}}, 'a.txt',
+                           md5=True, local_path1=str(tmp_path))
+    assert not manifest_differ(source, {'a.txt': {'size':5, 'md5':local_md5}}, 'a.txt',
+                               md5=True, local_path1=str(tmp_path))
+
+
+def test_manifest_differ_without_remote_md5(tmp_path):
+    """Remotes without md5 (like FTP) fall back to size, and local md5 is not computed"""
+    write(tmp_path / 'a.txt', 'hello')
+    source = local_manifest(str(tmp_path))
+    assert not manifest_differ(source, {'a.txt': {'size':5, 'md5':None}}, 'a.txt',
+                               md5=True, local_path1=str(tmp_path))
+    assert source['a.txt']['md5'] is None
+
+
+def test_listing_cache_expiration(tmp_path):
+    cache = ListingCache(ttl=60, cache_dir=str(tmp_path))
+    cache.set('list', 's3://bucket/a', [Namespace(name='a')], md5=False)
+    assert cache.get('list', 's3://bucket/a', md5=False)[0].name == 'a'
+    # expired entries are dropped from memory and disk when read
+    for entry in cache.entries.values():
+        entry[0] -= 60
+    assert cache.get('list', 's3://bucket/a', md5=False) is None
+    assert not cache.entries
+    assert not any(files for _, _, files in os.walk(tmp_path))
+
+
+def test_listing_cache_purge(tmp_path):
+    cache = ListingCache(ttl=60, cache_dir=str(tmp_path))
+    cache.set('list', 's3://bucket/a/b', [Namespace(name='b')], md5=False)
+    cache.set('list', 's3://bucket/c', [Namespace(name='c')], md5=False)
+    old = time() - 60
+    path = cache._path(cache.key('list', 's3://bucket/a/b', {'md5':False}))
+    os.utime(path, (old, old))
+    cache.entries[cache.key('list', 's3://bucket/a/b', {'md5':False})][0] = old
+    cache.purge()
+    assert list(cache.entries) == [cache.key('list', 's3://bucket/c', {'md5':False})]
+    # the expired entry and its now empty folders are gone
+    assert not os.path.exists(os.path.join(str(tmp_path), 's3%3A', 'bucket', 'a'))
+    assert ListingCache(ttl=60, cache_dir=str(tmp_path)).get('list', 's3://bucket/c', md5=False)[0].name == 'c'
+
+
+def test_listing_cache_local(tmp_path):
+    cache = ListingCache(ttl=60, cache_dir=str(tmp_path))
+    assert not cache.enabled_for(str(tmp_path))
+    assert not cache.enabled_for(f'file://{tmp_path}')
+    assert cache.enabled_for('s3://bucket/a')
@@ -0,0 +1,82 @@
+import sqlite3
+import pytest
+from scitq.server.model import like_regexp, compile_protofilters, FLAVOR_FIELDS
+from scitq.constants import PROTOFILTER_SEPARATOR
+from scitq.util import protofilter_syntax
+
+FLAVORS = [
+    ['b2-7', 'ovh', 'GRA7', 2, 7.0, '', None, None, 50.0, 0.07, 0],
+    ['b2-30', 'ovh', 'GRA9', 8, 30.0, 'S', None, None, 200.0, 0.3, 5],
+    ['t1-45', 'ovh', 'SBG5', 8, 45.0, 'G', 'V100', 16.0, 300.0, 1.9, None],
+    ['c2-60', 'ovh', 'GRA11', 16, 60.0, 'GS', None, None, 400.0, 0.7, 10],
+    ['Standard_D8', 'azure', 'swedencentral', 8, 32.0, None, None, None, 100.0, 0.4, 3],
+    ['1abc', 'local', '1abc', 1, 1.0, 'M', None, None, 10.0, 0.0, 0],
+]
+FLAVOR_DICTS = [dict(zip(FLAVOR_FIELDS, flavor)) for flavor in FLAVORS]
+
+PROTOFILTERS = [
+    'cpu>=8', 'cpu>8', 'cpu==8', 'cpu!=8', 'cpu<16', 'cpu<=16', 'ram>=30.5', 'disk<.5',
+    'cost<1', 'eviction<=5', 'eviction==0', 'gpumem>=16',
+    'region~GRA%', 'region!~GRA%', 'region~GRA_', 'region==GRA9', 'region!=GRA9', 'region==1abc',
+    'provider==azure', 'tags#G', 'tags#GS', 'tags!#G', 'tags!#M',
+    'cpu>=8:ram>=30:tags!#G:region~GRA%:eviction<=5:cost<1',
+]
+
+
+def sql_match(connection, protofilters):
+    """The SQL filters that protofilters used to be (see find_flavor history)"""
+    filters, params = [], []
+    for protofilter_string in protofilters.split(PROTOFILTER_SEPARATOR):
+        protofilter = protofilter_syntax.match(protofilter_string).groupdict()
+        item, comp, value = protofilter['item'], protofilter['comparator'], protofilter['value']
+        if comp in ['~','!~']:
+            filters.append(f"{'NOT ' if comp=='!~' else ''}{item} LIKE ?")
+            params.append(value)
+        elif comp in ['#','!#']:
+            for letter in value:
+                filters.append(f"{'NOT ' if comp=='!#' else ''}{item} LIKE ?")
+                params.append(f'%{letter}%')
+        else:
+            filters.append(f'{item}{comp}?')
+            params.append(value)
+    return [row[0] for row in connection.execute(
+        f"SELECT name FROM flavor WHERE {' AND '.join(filters)} ORDER BY name", params)]
+
+
+@pytest.fixture(scope='module')
+def connection():
+    connection = sqlite3.connect(':memory:')
+    # like PostgreSQL
+    connection.execute('PRAGMA case_sensitive_like=ON')
+    connection.execute('''CREATE TABLE flavor (name TEXT, provider TEXT, region TEXT, cpu INTEGER, ram REAL,
+        tags TEXT, gpu TEXT, gpumem REAL, disk REAL, cost REAL, eviction INTEGER)''')
+    connection.executemany(f"INSERT INTO flavor VALUES ({','.join('?'*len(FLAVOR_FIELDS))})", FLAVORS)
+    return connection
+
+
+@pytest.mark.parametrize('protofilters', PROTOFILTERS)
+def test_sql_equivalence(connection, protofilters):
+    predicates = compile_protofilters(protofilters)
+    matches = sorted(flavor['name'] for flavor in FLAVOR_DICTS
+                        if all(predicate(flavor) for predicate in predicates))
+    assert matches == sql_match(connection, protofilters)
+
+
+def test_like_regexp():
+    assert like_regexp('GRA%').match('GRA11')
+    assert like_regexp('GRA_').match('GRA7')
+    assert not like_regexp('GRA_').match('GRA11')
+    assert not like_regexp('GRA').match('GRA7')
+    assert not like_regexp('gra%').match('GRA7')
+    # regexp special characters are literal
+    assert like_regexp('a.b%').match('a.bc')
+    assert not like_regexp('a.b%').match('axbc')
+
+
+def test_compile_protofilters():
+    assert compile_protofilters('') == ()
+    # unknown protofilters are ignored
+    assert compile_protofilters('foo>1') == ()
+    assert len(compile_protofilters('cpu>=8:tags#GS')) == 2
+    # values allowed by the syntax but not numbers do not raise
+    assert not any(predicate(FLAVOR_DICTS[0]) for predicate in compile_protofilters('cpu>=1abc'))
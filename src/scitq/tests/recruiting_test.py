@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+import pytest
+from scitq.server import recruiting
+from scitq.server.recruiting import drain_policy, needed_workers, tasks_per_worker_policy, RECRUITER_POLICIES
+from scitq.constants import RECRUITER_POLICY_NAMES
+
+
+def recruiter(policy=None, tasks_per_worker=10, worker_concurrency=2):
+    return SimpleNamespace(batch='b', policy=policy, tasks_per_worker=tasks_per_worker,
+                           worker_concurrency=worker_concurrency, worker_provider=None)
+
+
+@pytest.fixture
+def history(monkeypatch):
+    """Tasks of 600s, deploys of 300s, workers expected to work at least half of their time"""
+    monkeypatch.setattr(recruiting, 'mean_task_duration', lambda batch, session: 600)
+    monkeypatch.setattr(recruiting, 'mean_deploy_time', lambda provider, session: 300)
+    monkeypatch.setattr(recruiting, 'RECRUITER_DRAIN_EFFICIENCY', 0.5)
+
+
+def test_policy_names():
+    assert sorted(RECRUITER_POLICIES) == sorted(RECRUITER_POLICY_NAMES)
+
+
+def test_tasks_per_worker_policy():
+    assert tasks_per_worker_policy(recruiter(), 25, 1, None) == 2
+    assert tasks_per_worker_policy(recruiter(), 5, 3, None) == -2
+
+
+def test_drain_policy(history):
+    # 2 tasks per 600s per worker, the current worker does 1 task while new ones deploy,
+    # each new worker must work at least 300s (1 task): 99 workers for 99 tasks
+    assert drain_policy(recruiter('drain'), 100, 1, None) == 98
+    # the current workers drain the queue before a new one is deployed
+    assert drain_policy(recruiter('drain'), 2, 2, None) == 0
+    # never negative
+    assert drain_policy(recruiter('drain'), 10, 20, None) == 0
+
+
+def test_drain_policy_without_history(monkeypatch):
+    monkeypatch.setattr(recruiting, 'mean_task_duration', lambda batch, session: None)
+    assert drain_policy(recruiter('drain'), 25, 1, None) == 2
+
+
+def test_needed_workers(history):
+    assert needed_workers(recruiter(), 25, 1, None) == 2
+    assert needed_workers(recruiter('tasks_per_worker'), 25, 1, None) == 2
+    assert needed_workers(recruiter('drain'), 100, 1, None) == 98
+
+
+class Worker:
+    def __init__(self, name):
+        self.name, self.batch, self.concurrency = name, 'other', 4
+        self.flavor = self.provider = self.region = None
+
+
+def test_plan_recycling_order(monkeypatch):
+    demands = {'a1': {'cpu':4, 'ram':8}, 'b1': {'cpu':2, 'ram':4}, 'b2': {'cpu':8, 'ram':32}}
+    monkeypatch.setattr(recruiting, 'recruiter_demand', lambda recruiter, session: demands[recruiter.name])
+    monkeypatch.setattr(recruiting, 'flavor_catalog', SimpleNamespace(flavor=lambda *args: None))
+    def recruiter(name, batch, rank):
+        return SimpleNamespace(name=name, batch=batch, rank=rank, match_flavor=lambda worker, session: True)
+    workers = [Worker(i) for i in range(2)]
+    plan = recruiting.plan_recycling([(recruiter('a1','a',1),1), (recruiter('b2','b',2),1), (recruiter('b1','b',1),1)],
+                                     {worker:0 for worker in workers}, {worker:{} for worker in workers}, None)
+    # batch b has the biggest demand, and its rank 1 recruiter is served before its rank 2 one
+    assert [(recruiter.name, worker.name) for recruiter, worker, _ in plan] == [('b1',0), ('b2',1)]
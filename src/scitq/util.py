@@ -7,7 +7,7 @@ import re
 import stat
 import shutil
 from argparse import Namespace
-from .constants import PROTOFILTER_SYNTAX, PROTOFILTER_SEPARATOR
+from .constants import PROTOFILTER_SYNTAX, PROTOFILTER_SEPARATOR, COLUMNS_KEY
 from functools import reduce
 import hashlib
 import sys
@@ -226,9 +226,40 @@ def get_md5(path):
             return md5.hexdigest()
 
 
+def docker_image_name(image):
+    """Normalize a docker image name, adding the default latest tag if there is none"""
+    if '@' in image:
+        return image
+    if ':' not in image.split('/')[-1]:
+        return image+':latest'
+    return image
+
 def split_list(l, n):
     """Split list l in n parts of approximately the same size"""
     # avoid creating empty sublist
     n = min(n, len(l))
     k, m = divmod(len(l), n)
-    return (l[i*k+min(i, m):(i+1)*k+min(i+1, m)] for i in range(n))
\ No newline at end of file
+    return (l[i*k+min(i, m):(i+1)*k+min(i+1, m)] for i in range(n))
+
+def to_columns(data):
+    """Transform a list of dicts sharing the same keys in a column-oriented dict
+    ({COLUMNS_KEY: keys, 'rows': list of value lists}), anything else is returned as is"""
+    if type(data)!=list or not data or type(data[0])!=dict:
+        return data
+    columns = list(data[0].keys())
+    rows = []
+    for item in data:
+        if type(item)!=dict or len(item)!=len(columns):
+            return data
+        try:
+            rows.append([item[column] for column in columns])
+        except KeyError:
+            return data
+    return {COLUMNS_KEY: columns, 'rows': rows}
+
+def from_columns(data):
+    """Reverse to_columns, anything not column-oriented is returned as is"""
+    if type(data)!=dict or COLUMNS_KEY not in data:
+        return data
+    columns = data[COLUMNS_KEY]
+    return [dict(zip(columns, row)) for row in data['rows']]
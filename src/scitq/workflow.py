@@ -1,5 +1,5 @@
 from .lib import Server, HTTPException
-from .fetch import get, copy, delete
+from .fetch import get, copy, delete, split_action, PACK_ACTION, PACK_SUFFIX
 from typing import Optional, Union, List
 from time import sleep
 import os
@@ -149,16 +149,30 @@ class Step:
         step.gather('/output/subfolder|mv:subfolder') 
         this pattern is equivalent in this case to a simple filter for files in the subfolder (without the mv the content of the subfolder would be in the main input folder)
         
+        For packed outputs (see Workflow.step output_pack), the archives are unpacked on the fly, and
+        the subfolders are always kept (like with the above mv pattern).
         """
         if attribute == 'step':
             return self.__steps__
         elif attribute == 'output':
-            return [s.output for s in self.__steps__]
+            return [s.output_as_input() for s in self.__steps__]
         elif attribute.startswith('output/'):
-            return [s.output+(attribute[7:] if s.output.endswith('/') else attribute[6:])
-                     for s in self.__steps__]
+            return [s.output_as_input(attribute[7:]) for s in self.__steps__]
         elif attribute.startswith('output|'):
-            return [s.output+(attribute[6:]) for s in self.__steps__]
+            return [split_action(s.output)[0]+(attribute[6:]) for s in self.__steps__]
+    
+    def output_as_input(self, path=''):
+        """Return the URI to use as an input to get this step output (or some path in it)"""
+        output, action = split_action(self.output)
+        if action!=PACK_ACTION:
+            return output+(path if output.endswith('/') or not path else '/'+path)
+        if not path:
+            return output+'|untar'
+        path,_ = split_action(path)
+        subfolder = path.strip('/').split('/')[0]
+        if subfolder!=path.strip('/'):
+            log.warning(f'{path} is in packed output, the whole {subfolder} subfolder will be used')
+        return output+subfolder+PACK_SUFFIX+'|untar'
     
     def get_output(self):
         """Return task output stream if there is one"""
@@ -184,7 +198,7 @@ class Step:
         """Download this step output"""
         if destination is None:
             destination=os.getcwd()
-        get(self.output,destination)
+        get(self.output_as_input(),destination)
 
 palette = [
     ('basic', 'light gray', 'black'),
@@ -282,7 +296,7 @@ class Workflow:
              container: Optional[str]=Unset, container_options: Optional[str]=Unset, 
              retry: Optional[int]=Unset, download_timeout: Optional[int]=Unset, 
              run_timeout: Optional[int]=Unset, use_cache: Optional[bool]=Unset,
-             args: Optional[dict]=None):
+             output_pack: Optional[bool]=False, args: Optional[dict]=None):
         """Add a step to workflow
         - batch: batch for this step (all the different tasks and workers for this step will be grouped into that batch)
                 NB batch is mandatory and is defined by at least concurrency and flavor (either at workflow or step level) 
@@ -372,6 +386,12 @@ class Workflow:
         if output and not output.endswith('/'):
             output += '/'
 
+        if output_pack:
+            if not output:
+                raise WorkflowException(f'Task {name} error: output_pack requires an output')
+            # each /output subfolder is uploaded as a tar.zst archive
+            output += f'|{PACK_ACTION}'
+
         if type(command)==shell_code:
             code = command
             in_container = coalesce(container, self.container) is not None
@@ -501,12 +521,19 @@ class Workflow:
         self.__exit_sleep__ = Event()
         self.__quit_thread__ = Event()
         def query_loop(once=False):
+            # tasks statuses are maintained from the server change feed, only deltas are fetched after the first call
+            task_batch = dict([(s.task_id, s.__batch__.name) for s in self.__steps__])
+            task_status = {}
+            cursor = None
             while True:
                 self.__exit_sleep__.clear()
 
                 batches = list([batch.name for batch in self.__batch__.values()])
                 short_batches = list([batch.shortname for batch in self.__batch__.values()])
-                tasks = self.server.tasks(task_id=[s.task_id for s in self.__steps__])
+                cursor, changes = self.server.task_changes(since=cursor, batch=batches)
+                for task_id,status in changes.items():
+                    if task_id in task_batch:
+                        task_status[task_id]=status
                 workers = self.server.workers(batch=batches)
 
                 task_stats = {}
@@ -514,8 +541,8 @@ class Workflow:
                 for batch in batches:
                     task_stats[batch] = {status:0 for status in TASK_STATUS}
                     worker_stats[batch] = {status:0 for status in WORKER_STATUS}
-                for task in tasks:
-                    task_stats[task.batch][task.status]+=1
+                for task_id,status in task_status.items():
+                    task_stats[task_batch[task_id]][status]+=1
                 for worker in workers:
                     if worker.status in worker_stats[worker.batch]:
                         # avoid crash in case of rare statuses like evicted
@@ -569,7 +596,7 @@ class Workflow:
                 for batch in self.__batch__.values():
                     batch.destroy()
             else:
-                for task in self.server.tasks(task_id=[s.task_id for s in self.__steps__]):
+                for task in self.server.iter_tasks(task_id=[s.task_id for s in self.__steps__]):
                     if download_logs and log_destination is not None:
                         if not os.path.exists(log_destination):
                             os.makedirs(log_destination)